@@ -0,0 +1,178 @@
+"""
+Code for playing many independent games of random players at once with NumPy.
+
+Baselines and training data need huge numbers of games between random players, which OhHell
+plays one card at a time. BatchGames plays a batch of games in lockstep instead: every game has
+the same number of players and hand sizes, so each deal, bid and trick is a few steps over the
+whole batch. As in BatchRollout, hands are kept as arrays of cards of shape (games, players,
+hand size), with EMPTY in the slots of cards played, so picking a card only looks at the cards
+held; hand_masks gives them as (games, players, 52). Players are numbered by their seat, their
+index in GameState.players, with the same dealer and bidding order as OhHell:
+    deal: a shuffled deck per game, hands dealt off the top and the next card turned up as trump
+    bids: drawn from the distribution of Player.make_bid, lower bids more likely, and the dealer
+    never bids the number of tricks that would make the bids add up to the hand size
+    cards: a random legal card, following the leading suit when the player can
+    scores: a point per trick taken and 10 more for making the bid, kept by a BatchTrickTracker
+"""
+import numpy as np
+
+import Cards
+from BatchRollout import EMPTY, TRICK_RANKS
+from TrickTracker import BatchTrickTracker
+
+# Suit of every card
+CARD_SUITS = np.arange(Cards.NUM_CARDS) // Cards.NUM_VALUES
+
+
+def bid_weights(hand_size, scale_fact=3):
+    """
+    :param hand_size: the number of cards in each hand
+    :param scale_fact: the scale factor of Player.make_bid
+    :return: the weight of each bid from 0 to the hand size in Player.make_bid
+    """
+    return scale_fact * (hand_size - np.arange(hand_size + 1)) + 1
+
+
+def pick_following(follows, rng):
+    """
+    Picks a random slot from each hand, one that follows suit if the hand has any.
+    :param follows: bool array of which slots hold a card of the leading suit, slots on the last
+    axis
+    :param rng: numpy random Generator
+    :return: the slot picked from each hand, the slot axis removed
+    """
+    # Number of following cards up to and including each slot
+    counts = np.cumsum(follows, axis=-1, dtype=np.int8)
+    total = counts[..., -1]
+    pick = (rng.random(total.shape) * np.where(total, total, follows.shape[-1])).astype(np.int8)
+    # The slot of the pick'th following card is the number of slots with fewer before it
+    slot = (counts <= pick[..., None]).sum(axis=-1)
+    return np.where(total, slot, pick)
+
+
+class BatchGames:
+    """
+    A batch of games between random players, played in lockstep.
+    """
+    def __init__(self, num_games, num_players, max_hand=None, follow_suit=True, rng=None):
+        """
+        :param num_games: the number of games in the batch
+        :param num_players: the number of players in each game
+        :param max_hand: the largest hand size of the games. If None, the largest possible.
+        :param follow_suit: whether players follow the leading suit when they can. If not, they
+        play any card in their hand, as a random Player does when OhHell doesn't tell it the
+        leading suit.
+        :param rng: numpy random Generator, a new unseeded one if None
+        """
+        self.num_games = num_games
+        self.num_players = num_players
+        self.max_hand = max_hand or (Cards.NUM_CARDS - 1) // num_players
+        self.num_rounds = self.max_hand * 2 - 1
+        self.round_hand = [min(i + 1, self.num_rounds - i) for i in range(self.num_rounds)]
+        self.follow_suit = follow_suit
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.curr_round = 0
+        self.hands = np.full((num_games, num_players, self.max_hand), EMPTY, dtype=np.int8)
+        self.trump_suit = np.zeros(num_games, dtype=np.int64)
+        self.tracker = BatchTrickTracker(num_games, num_players, self.num_rounds)
+
+    def play(self):
+        """
+        Plays every remaining round of the games.
+        :return: the (games, players, rounds) scoreboard of the tracker
+        """
+        while self.curr_round < self.num_rounds:
+            self.play_round()
+        return self.tracker.scoreboard
+
+    def play_round(self):
+        """
+        Plays a round of every game.
+        """
+        self.deal()
+        self.collect_bids()
+        self.play_tricks()
+        self.tracker.calculate_scores()
+        self.tracker.reset()
+        self.curr_round += 1
+
+    def deal(self):
+        """
+        Deals the hands of the round from a shuffled deck per game and turns up the trump card.
+        """
+        hand_size = self.round_hand[self.curr_round]
+        dealt = self.num_players * hand_size
+        decks = self.rng.random((self.num_games, Cards.NUM_CARDS),
+                                dtype=np.float32).argsort(axis=1)[:, :dealt + 1]
+        self.hands[:] = EMPTY
+        self.hands[:, :, :hand_size] = decks[:, :dealt].reshape(self.num_games, self.num_players,
+                                                                hand_size)
+        self.trump_suit = CARD_SUITS[decks[:, dealt]]
+
+    def hand_masks(self):
+        """
+        :return: (games, players, 52) bool array of the cards each player holds
+        """
+        masks = np.zeros((self.num_games, self.num_players, Cards.NUM_CARDS + 1), dtype=bool)
+        np.put_along_axis(masks, self.hands.astype(np.int64), True, axis=2)
+        return masks[:, :, :Cards.NUM_CARDS]
+
+    def collect_bids(self):
+        """
+        Collects the bids of the round in order, starting from the player after the dealer.
+        """
+        hand_size = self.round_hand[self.curr_round]
+        weights = bid_weights(hand_size)
+        cumulative = np.cumsum(weights)
+        first = self.curr_round % self.num_players
+        bids = np.empty((self.num_games, self.num_players), dtype=np.int8)
+        total = np.zeros(self.num_games, dtype=np.int64)
+        for i in range(self.num_players - 1):
+            draws = self.rng.random(self.num_games) * cumulative[-1]
+            bid = np.searchsorted(cumulative, draws, side='right')
+            bids[:, (first + i) % self.num_players] = bid
+            total += bid
+        # The dealer bids last and can't bid the tricks the others left over
+        dealer_weights = np.tile(weights, (self.num_games, 1))
+        bad_bid = hand_size - total
+        bad = bad_bid >= 0
+        dealer_weights[bad, bad_bid[bad]] = 0
+        cumulative = np.cumsum(dealer_weights, axis=1)
+        draws = self.rng.random(self.num_games) * cumulative[:, -1]
+        bids[:, (first - 1) % self.num_players] = (cumulative <= draws[:, None]).sum(axis=1)
+        self.tracker.collect_bids(bids)
+
+    def play_tricks(self):
+        """
+        Plays the tricks of the round. The first player to bid leads the first trick and the
+        winner of each trick leads the next. Once the leader has played, the other players'
+        choices only depend on the leading suit, so they all play their cards in one step. The
+        card played from each hand is replaced by the hand's last card, so the hands are held
+        in the first slots and every trick looks at one slot fewer.
+        """
+        hand_size = self.round_hand[self.curr_round]
+        games = np.arange(self.num_games)
+        rows = games[:, None]
+        seats = np.arange(self.num_players)
+        leader = np.full(self.num_games, self.curr_round % self.num_players)
+        for held_cards in range(hand_size, 0, -1):
+            hands = self.hands[:, :, :held_cards]
+            led = self.rng.integers(held_cards, size=self.num_games)
+            lead = CARD_SUITS[hands[games, leader, led]]
+
+            if self.follow_suit:
+                slots = pick_following(hands // Cards.NUM_VALUES == lead[:, None, None], self.rng)
+            else:
+                slots = self.rng.integers(held_cards, size=(self.num_games, self.num_players))
+            slots[games, leader] = led
+
+            cards = np.take_along_axis(hands, slots[:, :, None], axis=2)[:, :, 0]
+            hands[rows, seats, slots] = hands[:, :, -1]
+            hands[:, :, -1] = EMPTY
+            # Cards that neither follow suit nor are trump have strength 0, and the leader's
+            # card is above 0, so the strongest card is the only one of its strength
+            strength = TRICK_RANKS[self.trump_suit[:, None], lead[:, None], cards]
+            winner = strength.argmax(axis=1)
+            self.tracker.trick_taken(winner)
+            leader = winner
@@ -0,0 +1,140 @@
+"""
+Code for playing out many random continuations of a round at once with NumPy.
+
+The MCTS uses this to get a batch of playouts from a leaf for the cost of one trip through the
+tree. Each continuation deals the cards the searching player has not seen to the other players,
+then plays the remaining tricks with every player picking a random card that follows suit.
+"""
+import numpy as np
+
+import Cards
+
+# TRICK_RANKS[trump_suit, leading_suit, card], see Cards.TRICK_RANKS
+TRICK_RANKS = np.array(Cards.TRICK_RANKS, dtype=np.int8)
+# Marks a slot in a hand whose card has been played. Its suit, EMPTY // 13, matches no suit.
+EMPTY = Cards.NUM_CARDS
+# Bits of the slot number in the keys of pick_random, enough for the 25 card hands of two players
+SLOT_MASK = 31
+
+
+def cards_left(state, player):
+    """
+    :param state: the current GameState
+    :param player: a player in the game
+    :return: the number of cards the player is still holding
+    """
+    played = state.curr_trick + (1 if player in state.trick_cards else 0)
+    return state.curr_hand_size - played
+
+
+def deal_unseen(state, player, hand, k, rng):
+    """
+    Deals the cards the player has not seen to the other players, k different ways. Each other
+    player gets as many cards as they are still holding.
+    :param state: the current GameState
+    :param player: the player running the search
+    :param hand: the player's hand mask
+    :param k: number of deals
+    :param rng: numpy random Generator
+    :return: (num_players, cards in hand, k) array with the cards in every player's hand in each
+    deal, players in the order of the current trick starting at its leader. Players holding
+    fewer cards have their hand padded with EMPTY.
+    """
+    me = state.player2id[player]
+    slots = state.curr_hand_size - state.curr_trick
+    hands = np.full((state.num_players, slots, k), EMPTY, dtype=np.int16)
+
+    unseen = np.array(Cards.cards(Cards.FULL_DECK & ~(hand | state.discard)), dtype=np.int16)
+    shuffled = unseen[rng.random((k, len(unseen)), dtype=np.float32).argsort(axis=1)].T
+    start = 0
+    for pos, idx in enumerate(state.player_order):
+        if idx == me:
+            mine = Cards.cards(hand)
+            hands[pos, :len(mine)] = np.array(mine)[:, None]
+            continue
+        end = start + cards_left(state, state.id2player[idx])
+        hands[pos, :end - start] = shuffled[start:end]
+        start = end
+    return hands
+
+
+def pick_random(legal, rng):
+    """
+    Picks a random legal slot from each hand.
+    :param legal: bool array of which slots can be played, slots on axis -2
+    :param rng: numpy random Generator
+    :return: the slot picked from each hand, the slot axis removed
+    """
+    # Pack a legal flag, a random key and the slot number into one int so a single max picks a
+    # random legal slot. Raw generator output is used for the random key as it is much cheaper.
+    if legal.shape[-2] > SLOT_MASK + 1:
+        raise ValueError('Hands of {} cards have more slots than fit in a key'.format(
+            legal.shape[-2]))
+    count = legal.size
+    keys = rng.bit_generator.random_raw((count + 1) // 2).view(np.int32)[:count]
+    keys = keys.reshape(legal.shape) & (0x07FFFFFF & ~SLOT_MASK)
+    keys |= legal.astype(np.int32) << 27
+    keys |= np.arange(legal.shape[-2], dtype=np.int32)[:, None]
+    return keys.max(axis=-2) & SLOT_MASK
+
+
+def batch_rollout(state, player, hand, k, rng):
+    """
+    Plays k random continuations of the round from the given state. Hands are kept in the order
+    of the current trick, starting at its leader, and rotated to the winner after each trick.
+    Once the leader has played, the other players' choices only depend on the leading suit, so
+    they all play their cards in one step.
+    :param state: the GameState to play out from, left unchanged
+    :param player: the player running the search
+    :param hand: the player's hand mask
+    :param k: number of continuations to play
+    :param rng: numpy random Generator
+    :return: the number of continuations in which the player made their bid
+    """
+    num_players = state.num_players
+    me = state.player2id[player]
+    hands = deal_unseen(state, player, hand, k, rng)
+    ranks = TRICK_RANKS[state.trump_suit]
+    cols = np.arange(k)
+    positions = np.arange(num_players)[:, None]
+    tricks = np.zeros(k, dtype=np.int64)
+
+    # Finish the trick in progress first, its best card so far competes with the rest
+    played = len(state.trick_cards)
+    leader = np.full(k, state.player_order[0])
+    if played:
+        lead = np.full(k, state.leading_suit)
+        best = np.full(k, ranks[state.leading_suit, state.best_played_card])
+        best_pos = np.full(k, (state.best_player_idx - state.player_order[0]) % num_players)
+
+    for _ in range(state.curr_hand_size - state.curr_trick):
+        if not played:
+            held = hands[0]
+            slot = pick_random(held != EMPTY, rng)
+            card = held[slot, cols]
+            held[slot, cols] = EMPTY
+            lead = card // Cards.NUM_VALUES
+            best = ranks[lead, card]
+            best_pos = np.zeros(k, dtype=np.int64)
+            played = 1
+
+        # Strength packed with the position, the max gives the winner
+        best = best.astype(np.int32) << 6 | best_pos
+        if played < num_players:
+            held = hands[played:]
+            legal = held // Cards.NUM_VALUES == lead
+            legal |= ~legal.any(axis=1, keepdims=True) & (held != EMPTY)
+            slot = pick_random(legal, rng)[:, None]
+            card = np.take_along_axis(held, slot, axis=1)[:, 0]
+            np.put_along_axis(held, slot, EMPTY, axis=1)
+            strength = ranks[lead, card].astype(np.int32) << 6 | positions[played:]
+            best = np.maximum(best, strength.max(axis=0))
+        winner = best & 63
+
+        tricks += (leader + winner) % num_players == me
+        leader = (leader + winner) % num_players
+        hands = np.take_along_axis(hands, ((positions + winner) % num_players)[:, None], axis=0)
+        played = 0
+
+    taken = state.tracker.tricks_taken[player] + tricks
+    return int(np.count_nonzero(taken == state.bids[player]))
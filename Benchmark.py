@@ -0,0 +1,430 @@
+"""
+Benchmark suite for the game engine and the AI players.
+
+Each benchmark times a fixed amount of work on positions dealt from fixed seeds and reports a
+rate, so runs on the same machine can be compared. The results are printed and can be written
+as JSON. Given a baseline file, a benchmark whose rate has dropped by more than the tolerance
+counts as a regression and the run exits with an error:
+
+    python Benchmark.py --baseline benchmark_baseline.json
+    python Benchmark.py --save-baseline benchmark_baseline.json
+
+Rates depend on the machine, and on what else it is doing, so a fixed calibration loop of
+plain Python work is timed just before and after each benchmark. A baseline's rate is scaled by
+how much faster or slower the calibration loop runs now than when the baseline was recorded
+before it is compared. This takes out most of the difference between machines, but not all of it, so the
+shipped baseline is an example: record one on your machine to compare against.
+"""
+import json
+import pickle
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+import Cards
+from BatchGames import BatchGames
+from GameCodec import decode_game, encode_game
+from GameState import GameState
+from OhHell import OhHell
+from Player import Player
+from PlayerMCTS import MonteCarloTreeSearch, PlayerMCTS, available_cards
+from STS import STSPlayer
+from TrickTracker import BatchTrickTracker, TrickTracker
+
+# Number of times each benchmark is timed, the fastest run is kept
+REPEATS = 5
+# Largest drop in rate, as a fraction of the baseline, that isn't reported as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def calibration_loop(number=200000):
+    """
+    A fixed amount of the kind of work the engine does, integer and bit operations, list and dict
+    indexing and method calls, that doesn't change when the code does.
+    :param number: the number of loop iterations
+    """
+    table = {}
+    values = list(range(64))
+    total = 0
+    for i in range(number):
+        mask = (i * 2654435761) & 0xFFFFFFFFFFFFF
+        total += bin(mask).count('1') + values[i & 63]
+        table[i & 1023] = total
+    return total
+
+
+def calibrate():
+    """
+    :return: iterations per second of the calibration loop
+    """
+    return time_best(lambda: calibration_loop(50000), 50000)
+
+
+def deal_position(seed, hand_size=5, num_players=4):
+    """
+    Deals a round of the given hand size, collects a bid of 1 from every player and hands the
+    turn to the first player, who searches with MCTS. The others play randomly.
+    :param seed: random seed for the deal
+    :param hand_size: number of cards in each hand
+    :param num_players: number of players at the table
+    :return: the players and the GameState before the first card is played
+    """
+    random.seed(seed)
+    players = [PlayerMCTS('mcts', 1)] + \
+              [Player('random_{}'.format(i), is_ai=True) for i in range(1, num_players)]
+    state = GameState(players, hand_size)
+    state.curr_round = hand_size - 1
+    state.begin_round()
+    deck = list(range(Cards.NUM_CARDS))
+    random.shuffle(deck)
+    for i, player in enumerate(players):
+        for card in deck[i * hand_size:(i + 1) * hand_size]:
+            player.hand |= Cards.bit(card)
+    state.set_trump_suit(deck[-1])
+    for player in state.get_bid_order():
+        state.collect_bid(player, 1)
+    state.get_next_player()
+    return players, state
+
+
+def time_best(func, number):
+    """
+    Times a function, keeping the fastest of several runs.
+    :param func: function running the benchmark's work, called with no arguments
+    :param number: the number of operations done by one call of func
+    :return: operations per second
+    """
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return number / best
+
+
+def bench_play_card(number=20000):
+    """
+    :return: calls per second of GameState.play_card for the first card of a trick
+    """
+    _, state = deal_position(0)
+    player = state.players[0]
+    card = Cards.cards(player.hand)[0]
+
+    def run():
+        for _ in range(number):
+            state.play_card(player, card)
+    return time_best(run, number)
+
+
+def bench_copy_state(number=20000):
+    """
+    :return: calls per second of GameState.copy_state
+    """
+    _, state = deal_position(0)
+
+    def run():
+        for _ in range(number):
+            state.copy_state()
+    return time_best(run, number)
+
+
+def bench_tracker_copy(number=20000):
+    """
+    :return: calls per second of TrickTracker.copy
+    """
+    _, state = deal_position(0)
+    tracker = state.tracker
+
+    def run():
+        for _ in range(number):
+            tracker.copy()
+    return time_best(run, number)
+
+
+def bench_scores(games=2000):
+    """
+    :param games: the number of games scored
+    :return: games per second scored by TrickTracker.calculate_scores, one tracker per game
+    """
+    players = [Player('random_{}'.format(i), is_ai=True) for i in range(4)]
+    trackers = [TrickTracker(players, 9) for _ in range(games)]
+    for tracker in trackers:
+        for i, player in enumerate(players):
+            tracker.collect_bid(player, i % 2)
+            tracker.tricks_taken[player] = 1
+
+    def run():
+        for tracker in trackers:
+            tracker.calculate_scores(players)
+    return time_best(run, games)
+
+
+def bench_batch_scores(games=2000):
+    """
+    :param games: the number of games scored
+    :return: games per second scored by BatchTrickTracker.calculate_scores, all the games at once
+    """
+    tracker = BatchTrickTracker(games, 4, 9)
+    tracker.collect_bids(np.tile(np.arange(4) % 2, (games, 1)))
+    tracker.tricks_taken[:] = 1
+    return time_best(tracker.calculate_scores, games)
+
+
+def bench_available_cards(number=200000):
+    """
+    :return: calls per second of available_cards
+    """
+    players, state = deal_position(0)
+    hand, discard = players[0].hand, state.discard
+
+    def run():
+        for _ in range(number):
+            available_cards(hand, discard)
+    return time_best(run, number)
+
+
+def bench_uct(number=100000):
+    """
+    :return: calls per second of Node.UCT on the root's children after a short search
+    """
+    players, state = deal_position(0)
+    random.seed(0)
+    mcts = MonteCarloTreeSearch(players[0].hand, state.copy_state(), players[0])
+    mcts.search(max_iterations=500)
+    children = mcts.root.children
+    rounds = number // len(children)
+
+    def run():
+        for _ in range(rounds):
+            for child in children:
+                child.UCT()
+    return time_best(run, rounds * len(children))
+
+
+def bench_sts(depth, number):
+    """
+    :param depth: the depth STS explores to
+    :param number: the number of calls to time
+    :return: calls per second of STSPlayer.explore_node from the first player's hand, each
+    starting with an empty cache
+    """
+    players, state = deal_position(0)
+    sts = STSPlayer('sts', depth)
+    hand = players[0].hand
+
+    def run():
+        for _ in range(number):
+            sts.cache.clear()
+            sts.explore_node(hand, depth, trump_suit=state.trump_suit)
+    return time_best(run, number)
+
+
+def bench_mcts(iterations=2000, rollouts=1):
+    """
+    :param iterations: the number of search iterations to time
+    :param rollouts: the number of playouts run from each new node
+    :return: MCTS iterations per second from the start of a 5 card round
+    """
+    players, state = deal_position(0)
+
+    def run():
+        random.seed(0)
+        mcts = MonteCarloTreeSearch(players[0].hand, state.copy_state(), players[0],
+                                    rollouts=rollouts)
+        mcts.search(max_iterations=iterations)
+    return time_best(run, iterations)
+
+
+def bench_ohhell(games=5, max_hand=5):
+    """
+    :param games: the number of games to play
+    :param max_hand: the largest hand size of the games
+    :return: rounds per second of OhHell.play with four random players
+    """
+    def run():
+        random.seed(0)
+        for _ in range(games):
+            players = [Player('random_{}'.format(i), is_ai=True) for i in range(4)]
+            game = OhHell(players, max_hand=max_hand)
+            for _ in range(game.state.num_rounds):
+                game.play()
+    return time_best(run, games * (2 * max_hand - 1))
+
+
+def bench_batch_games(games=2000, max_hand=5):
+    """
+    :param games: the number of games in the batch
+    :param max_hand: the largest hand size of the games
+    :return: rounds per second of BatchGames.play with four random players, to compare with
+    OhHell.play
+    """
+    def run():
+        BatchGames(games, 4, max_hand, rng=np.random.default_rng(0)).play()
+    return time_best(run, games * (2 * max_hand - 1))
+
+
+def codec_game(seed=0, rounds=5):
+    """
+    :param seed: random seed for the game
+    :param rounds: the number of rounds to play before the game is encoded
+    :return: a full size game of four random players, partway through dealing the next round
+    """
+    random.seed(seed)
+    players = [Player('random_{}'.format(i), is_ai=True) for i in range(4)]
+    game = OhHell(players)
+    for _ in range(rounds):
+        game.play()
+    game.deal()
+    return game
+
+
+def bench_encode(number=20000):
+    """
+    :return: calls per second of GameCodec.encode_game on a game in progress
+    """
+    game = codec_game()
+
+    def run():
+        for _ in range(number):
+            encode_game(game)
+    return time_best(run, number)
+
+
+def bench_decode(number=20000):
+    """
+    :return: calls per second of GameCodec.decode_game on a game in progress
+    """
+    game = codec_game()
+    data = encode_game(game)
+
+    def run():
+        for _ in range(number):
+            decode_game(data, game.players)
+    return time_best(run, number)
+
+
+# name: (function returning the rate, unit of the rate)
+BENCHMARKS = {
+    'GameState.play_card': (bench_play_card, 'calls/s'),
+    'GameState.copy_state': (bench_copy_state, 'calls/s'),
+    'TrickTracker.copy': (bench_tracker_copy, 'calls/s'),
+    'TrickTracker.calculate_scores': (bench_scores, 'games/s'),
+    'BatchTrickTracker.calculate_scores': (bench_batch_scores, 'games/s'),
+    'available_cards': (bench_available_cards, 'calls/s'),
+    'Node.UCT': (bench_uct, 'calls/s'),
+    'STSPlayer.explore_node depth 1': (lambda: bench_sts(1, 20000), 'calls/s'),
+    'STSPlayer.explore_node depth 2': (lambda: bench_sts(2, 1000), 'calls/s'),
+    'STSPlayer.explore_node depth 3': (lambda: bench_sts(3, 200), 'calls/s'),
+    'STSPlayer.explore_node depth 5': (lambda: bench_sts(5, 200), 'calls/s'),
+    'MonteCarloTreeSearch.search': (bench_mcts, 'iterations/s'),
+    'MonteCarloTreeSearch.search batched': (lambda: bench_mcts(200, rollouts=64), 'iterations/s'),
+    'OhHell.play random table': (bench_ohhell, 'rounds/s'),
+    'BatchGames.play random table': (bench_batch_games, 'rounds/s'),
+    'GameCodec.encode_game': (bench_encode, 'calls/s'),
+    'GameCodec.decode_game': (bench_decode, 'calls/s'),
+}
+
+# Sizes that are reported alongside the rates but not compared with the baseline.
+# name: function returning the size in bytes
+SIZES = {
+    'GameCodec.encode_game': lambda: len(encode_game(codec_game())),
+    'pickle of OhHell': lambda: len(pickle.dumps(codec_game(), pickle.HIGHEST_PROTOCOL)),
+}
+
+
+def run_benchmarks(names=None):
+    """
+    :param names: the benchmarks to run, all of them if None
+    :return: dict of {'rate': ..., 'unit': ..., 'calibration': ...} for each benchmark run, the
+    calibration being the faster of the calibration loop's rates just before and after it
+    """
+    results = {}
+    for name, (func, unit) in BENCHMARKS.items():
+        if names is None or name in names:
+            calibration = calibrate()
+            rate = func()
+            calibration = max(calibration, calibrate())
+            results[name] = {'rate': rate, 'unit': unit, 'calibration': calibration}
+    return results
+
+
+def scale_baseline(baseline, results):
+    """
+    :param baseline: the benchmarks of a baseline file
+    :param results: the benchmark results of this run
+    :return: dict of the baseline rate of each benchmark run, scaled to the speed of the machine
+    when it ran. Raises ValueError for a baseline recorded without calibration rates.
+    """
+    scaled = {}
+    for name, result in results.items():
+        if name in baseline:
+            if 'calibration' not in baseline[name]:
+                raise ValueError('The baseline has no calibration rates, record it again with '
+                                 '--save-baseline')
+            speed = result['calibration'] / baseline[name]['calibration']
+            scaled[name] = baseline[name]['rate'] * speed
+    return scaled
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the results of a run with a baseline.
+    :param results: the benchmark results of this run
+    :param baseline: the baseline rate of each benchmark, scaled to this run, see scale_baseline
+    :param tolerance: the largest drop in rate, as a fraction, that isn't a regression
+    :return: list of (name, rate, baseline rate) for each benchmark that regressed
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['rate'] < baseline[name] * (1 - tolerance):
+            regressions.append((name, result['rate'], baseline[name]))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the game engine and AI players.')
+    parser.add_argument('--out', help='file to write the results to as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--save-baseline', help='file to store the results in as the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.only)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            try:
+                baseline = scale_baseline(json.load(f)['benchmarks'], results)
+            except ValueError as error:
+                sys.exit(str(error))
+    for name, result in results.items():
+        line = '{:<40} {:>14,.1f} {}'.format(name, result['rate'], result['unit'])
+        if name in baseline:
+            line += '  ({:+.1%} vs baseline)'.format(result['rate'] / baseline[name] - 1)
+        print(line)
+    sizes = {name: func() for name, func in SIZES.items()}
+    for name, size in sizes.items():
+        print('{:<40} {:>14,} bytes per game'.format(name, size))
+
+    output = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': results,
+        'sizes': sizes,
+    }
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(output, f, indent=2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        for name, rate, base in regressions:
+            print('REGRESSION {}: {:,.1f} against a baseline of {:,.1f}'.format(name, rate, base))
+        sys.exit(1)
@@ -0,0 +1,292 @@
+"""
+Bids looked up from tables of the tricks a hand takes, computed offline by simulation.
+
+A hand is reduced to a canonical pattern relative to the trump suit: the number of trumps (up
+to TRUMP_COUNTS - 1, more count as that many), the number of trump honours (Jack to Ace), and
+the number of Aces and Kings in the other suits. For every number of players, hand size, seat
+in the bidding order and pattern, the table holds the expected number of tricks the hand takes,
+the number of tricks it most often takes, and the next most likely number, for a dealer who
+can't bid the first. The tricks are counted over games played by BatchGames, whose players
+follow suit at random, and patterns seen too rarely borrow the counts of coarser patterns.
+
+The table is kept in a file of fixed-width records after a header:
+    magic b'OB', format version, fewest and most players covered, the four pattern sizes
+    (TRUMP_COUNTS, TRUMP_HONOURS, SIDE_ACES, SIDE_KINGS) and the number of records
+and each record is (expected tricks as float16, best bid, second best bid), for each number of
+players, then each hand size, then each seat and then each pattern. The file is memory-mapped
+when it is first used, so a lookup is an index into it. Running this file builds the table:
+
+    python BidTable.py --games 200000 --out bid_table.bin
+"""
+import os
+import struct
+
+import numpy as np
+
+import Cards
+from BatchGames import BatchGames
+
+MAGIC = b'OB'
+VERSION = 1
+HEADER = struct.Struct('<2sBBBBBBBI')
+RECORD = np.dtype([('tricks', '<f2'), ('bid', 'u1'), ('second', 'u1')])
+
+# Sizes of the parts of a pattern
+TRUMP_COUNTS = 6
+TRUMP_HONOURS = 5
+SIDE_ACES = 4
+SIDE_KINGS = 4
+NUM_PATTERNS = TRUMP_COUNTS * TRUMP_HONOURS * SIDE_ACES * SIDE_KINGS
+# Rank of the lowest honour, the Jack
+HONOUR_RANK = 9
+ACES = sum(Cards.bit(suit * Cards.NUM_VALUES + Cards.NUM_VALUES - 1)
+           for suit in range(Cards.NUM_SUITS))
+KINGS = ACES >> 1
+
+# Patterns seen fewer times than this take their counts from a coarser pattern
+MIN_SAMPLES = 50
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bid_table.bin')
+
+
+def hand_pattern(hand, trump_suit):
+    """
+    :param hand: the mask of a hand
+    :param trump_suit: the trump suit
+    :return: the index of the hand's pattern
+    """
+    trumps = hand & Cards.SUIT_MASKS[trump_suit]
+    side = hand & ~trumps
+    count = min(Cards.count(trumps), TRUMP_COUNTS - 1)
+    honours = Cards.count(trumps >> (trump_suit * Cards.NUM_VALUES + HONOUR_RANK))
+    return ((count * TRUMP_HONOURS + honours) * SIDE_ACES
+            + Cards.count(side & ACES)) * SIDE_KINGS + Cards.count(side & KINGS)
+
+
+def hand_patterns(hands, trump_suit):
+    """
+    :param hands: (games, players, hand size) array of the cards in each hand, as in BatchGames
+    :param trump_suit: the trump suit of each game
+    :return: (games, players) array of the index of each hand's pattern
+    """
+    suits = hands // Cards.NUM_VALUES
+    ranks = hands % Cards.NUM_VALUES
+    trumps = suits == trump_suit[:, None, None]
+    side = ~trumps
+    count = np.minimum(trumps.sum(axis=2), TRUMP_COUNTS - 1)
+    honours = (trumps & (ranks >= HONOUR_RANK)).sum(axis=2)
+    aces = (side & (ranks == Cards.NUM_VALUES - 1)).sum(axis=2)
+    kings = (side & (ranks == Cards.NUM_VALUES - 2)).sum(axis=2)
+    return ((count * TRUMP_HONOURS + honours) * SIDE_ACES + aces) * SIDE_KINGS + kings
+
+
+def table_offsets(min_players, max_players):
+    """
+    :param min_players: the fewest players covered by a table
+    :param max_players: the most players covered by a table
+    :return: dict of (players, hand size): index of the first record for them, and the number
+    of records
+    """
+    offsets = {}
+    count = 0
+    for num_players in range(min_players, max_players + 1):
+        for hand_size in range(1, (Cards.NUM_CARDS - 1) // num_players + 1):
+            offsets[(num_players, hand_size)] = count
+            count += num_players * NUM_PATTERNS
+    return offsets, count
+
+
+def count_tricks(num_players, games, rng):
+    """
+    Plays games of random players and counts the tricks taken by each pattern of hand.
+    :param num_players: the number of players in each game
+    :param games: the number of games to play
+    :param rng: numpy random Generator
+    :return: dict of hand size: (seats, patterns, tricks) array of the number of hands of each
+    pattern in each seat of the bidding order that took each number of tricks
+    """
+    batch = BatchGames(games, num_players, rng=rng)
+    counts = {}
+    while batch.curr_round < batch.num_rounds:
+        hand_size = batch.round_hand[batch.curr_round]
+        # Seat of each player in the bidding order, which starts after the dealer
+        seats = (np.arange(num_players) - batch.curr_round % num_players) % num_players
+        batch.deal()
+        patterns = hand_patterns(batch.hands[:, :, :hand_size], batch.trump_suit)
+        batch.collect_bids()
+        batch.play_tricks()
+        cells = ((seats * NUM_PATTERNS + patterns) * (hand_size + 1)
+                 + batch.tracker.tricks_taken).ravel()
+        found = np.bincount(cells, minlength=num_players * NUM_PATTERNS * (hand_size + 1))
+        counts[hand_size] = counts.get(hand_size, 0) + found.reshape(
+            num_players, NUM_PATTERNS, hand_size + 1)
+        batch.tracker.calculate_scores()
+        batch.tracker.reset()
+        batch.curr_round += 1
+    return counts
+
+
+def table_records(counts):
+    """
+    :param counts: (seats, patterns, tricks) array of hand counts, see count_tricks
+    :return: the records of the seats and patterns. A pattern seen fewer than MIN_SAMPLES times
+    uses the counts of the first coarser pattern seen often enough, leaving out the side
+    Kings, then the side Aces, then the trump honours, then everything but the seat.
+    """
+    seats, _, outcomes = counts.shape
+    shape = (seats, TRUMP_COUNTS, TRUMP_HONOURS, SIDE_ACES, SIDE_KINGS, outcomes)
+    full = counts.reshape(shape)
+    chosen = full.astype(np.float64)
+    settled = full.sum(axis=-1) >= MIN_SAMPLES
+    for axes in ((4,), (3, 4), (2, 3, 4), (1, 2, 3, 4)):
+        pooled = np.broadcast_to(full.sum(axis=axes, keepdims=True), shape)
+        enough = pooled.sum(axis=-1) >= MIN_SAMPLES
+        chosen[~settled & enough] = pooled[~settled & enough]
+        settled |= enough
+    chosen = chosen.reshape(seats * NUM_PATTERNS, outcomes)
+
+    records = np.zeros(len(chosen), RECORD)
+    total = chosen.sum(axis=1)
+    tricks = np.arange(outcomes)
+    records['tricks'] = (chosen * tricks).sum(axis=1) / np.maximum(total, 1)
+    records['bid'] = chosen.argmax(axis=1)
+    chosen[np.arange(len(chosen)), records['bid']] = -1
+    records['second'] = chosen.argmax(axis=1)
+    return records
+
+
+def build_table(games, min_players=2, max_players=7, rng=None, report=None):
+    """
+    :param games: the number of games to play for each number of players
+    :param min_players: the fewest players to cover
+    :param max_players: the most players to cover
+    :param rng: numpy random Generator, a new unseeded one if None
+    :param report: function called with a line of progress for each number of players, or None
+    :return: the records of the table
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    offsets, count = table_offsets(min_players, max_players)
+    records = np.zeros(count, RECORD)
+    for num_players in range(min_players, max_players + 1):
+        for hand_size, counts in count_tricks(num_players, games, rng).items():
+            start = offsets[(num_players, hand_size)]
+            records[start:start + num_players * NUM_PATTERNS] = table_records(counts)
+        if report is not None:
+            report('{} players done'.format(num_players))
+    return records
+
+
+def save_table(path, records, min_players=2, max_players=7):
+    """
+    :param path: the file to write the table to
+    :param records: the records of the table, see build_table
+    :param min_players: the fewest players covered
+    :param max_players: the most players covered
+    """
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, min_players, max_players, TRUMP_COUNTS,
+                            TRUMP_HONOURS, SIDE_ACES, SIDE_KINGS, len(records)))
+        f.write(records.astype(RECORD).tobytes())
+
+
+class BidTable:
+    """
+    A table of bids memory-mapped from its file.
+    """
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        :param path: the file of the table, see save_table
+        """
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        (magic, version, self.min_players, self.max_players, trump_counts, trump_honours,
+         side_aces, side_kings, count) = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError('Not a bid table: {}'.format(path))
+        if version != VERSION or (trump_counts, trump_honours, side_aces, side_kings) != (
+                TRUMP_COUNTS, TRUMP_HONOURS, SIDE_ACES, SIDE_KINGS):
+            raise ValueError('Bid table {} has another format'.format(path))
+        self.offsets, expected = table_offsets(self.min_players, self.max_players)
+        if count != expected:
+            raise ValueError('Bid table {} has {} records, expected {}'.format(path, count,
+                                                                               expected))
+        self.records = np.memmap(path, RECORD, 'r', HEADER.size, (count,))
+
+    def lookup(self, num_players, hand_size, seat, hand, trump_suit):
+        """
+        :param num_players: the number of players in the game
+        :param hand_size: the number of cards in each hand this round
+        :param seat: the player's seat in the bidding order, 0 for the first to bid
+        :param hand: the mask of the player's hand
+        :param trump_suit: the trump suit
+        :return: the record of the hand, or None if the table doesn't cover the game
+        """
+        start = self.offsets.get((num_players, hand_size))
+        if start is None:
+            return None
+        return self.records[start + seat * NUM_PATTERNS + hand_pattern(hand, trump_suit)]
+
+    def make_bid(self, state, player, is_dealer):
+        """
+        Bids the number of tricks the player's hand most often takes. The dealer can't bid the
+        number that makes the bids add up to the hand size, as in Player.make_bid, and bids the
+        next most likely number instead.
+        :param state: the game state
+        :param player: the player bidding, holding their hand
+        :param is_dealer: whether the player is the dealer
+        :return: the bid, or None if the table doesn't cover the game
+        """
+        seat = state.player_order.index(state.player2id[player])
+        record = self.lookup(state.num_players, state.curr_hand_size, seat, player.hand,
+                             state.trump_suit)
+        if record is None:
+            return None
+        bid = int(record['bid'])
+        if is_dealer and bid == state.curr_hand_size - sum(state.bids.values()):
+            bid = int(record['second'])
+        return bid
+
+
+_default_table = None
+
+
+def default_table():
+    """
+    Loads the table at DEFAULT_PATH the first time it is asked for, once per process.
+    :return: the BidTable, or None if there is no table file
+    """
+    global _default_table
+    if _default_table is None and os.path.exists(DEFAULT_PATH):
+        _default_table = BidTable(DEFAULT_PATH)
+    return _default_table
+
+
+def table_bid(state, player, is_dealer):
+    """
+    :param state: the game state
+    :param player: the player bidding, holding their hand
+    :param is_dealer: whether the player is the dealer
+    :return: the player's bid from the default table, or None if there is no table or it
+    doesn't cover the game
+    """
+    table = default_table()
+    if table is None:
+        return None
+    return table.make_bid(state, player, is_dealer)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the bid table by simulating games.')
+    parser.add_argument('--games', type=int, default=200000,
+                        help='games to play for each number of players')
+    parser.add_argument('--min-players', type=int, default=2)
+    parser.add_argument('--max-players', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    table = build_table(args.games, args.min_players, args.max_players,
+                        np.random.default_rng(args.seed), report=print)
+    save_table(args.out, table, args.min_players, args.max_players)
+    print('{} records, {:,} bytes'.format(len(table), os.path.getsize(args.out)))
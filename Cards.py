@@ -0,0 +1,199 @@
+"""
+Compact integer representation of the cards used by the game engine.
+
+A card is an int from 0 to 51, encoded as suit * 13 + rank, where rank 0 is a 2 and rank 12 is
+an Ace. A collection of cards (a hand, the discard pile, the cards still unseen) is an int
+bitmask where bit `card` is set when the card is in the collection. Conversion to and from
+pydealer objects only happens at the edges of the game, when dealing and talking to clients.
+"""
+import random
+
+import pydealer
+
+SUITS = ['Clubs', 'Diamonds', 'Hearts', 'Spades']
+VALUES = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'Jack', 'Queen', 'King', 'Ace']
+
+NUM_SUITS = len(SUITS)
+NUM_VALUES = len(VALUES)
+NUM_CARDS = NUM_SUITS * NUM_VALUES
+
+FULL_DECK = (1 << NUM_CARDS) - 1
+SUIT_MASKS = [((1 << NUM_VALUES) - 1) << (suit * NUM_VALUES) for suit in range(NUM_SUITS)]
+
+SUIT_IDS = {suit: i for i, suit in enumerate(SUITS)}
+VALUE_IDS = {value: i for i, value in enumerate(VALUES)}
+CARD_NAMES = ['{} of {}'.format(value, suit) for suit in SUITS for value in VALUES]
+CARD_IDS = {name: i for i, name in enumerate(CARD_NAMES)}
+
+# Index used in place of a trump suit when a trick is played without trump
+NO_TRUMP = NUM_SUITS
+# Highest strength a card can have in a trick, the Ace of trump
+TOP_STRENGTH = 3 * NUM_VALUES
+
+
+def _build_trick_ranks():
+    """
+    Builds the strength of every card for every trump suit and leading suit. Trump cards rank
+    above cards of the leading suit, which rank above everything else. Cards that neither follow
+    suit nor are trump have strength 0 and can never win the trick.
+    :return: TRICK_RANKS[trump_suit][leading_suit][card]
+    """
+    tables = []
+    for trump in range(NUM_SUITS + 1):
+        by_lead = []
+        for lead in range(NUM_SUITS):
+            ranks = []
+            for card in range(NUM_CARDS):
+                suit, rank = card // NUM_VALUES, card % NUM_VALUES
+                if suit == trump:
+                    ranks.append(2 * NUM_VALUES + rank + 1)
+                elif suit == lead:
+                    ranks.append(NUM_VALUES + rank + 1)
+                else:
+                    ranks.append(0)
+            by_lead.append(tuple(ranks))
+        tables.append(tuple(by_lead))
+    return tuple(tables)
+
+
+TRICK_RANKS = _build_trick_ranks()
+
+
+def make_card(value, suit):
+    """
+    Builds the int card for the given value and suit names.
+    :param value: name of the value of the card, e.g. 'Ace'
+    :param suit: name of the suit of the card, e.g. 'Spades'
+    :return: the card
+    """
+    return SUIT_IDS[suit] * NUM_VALUES + VALUE_IDS[value]
+
+
+def suit_of(card):
+    """
+    :param card: a card
+    :return: the suit index of the card
+    """
+    return card // NUM_VALUES
+
+
+def rank_of(card):
+    """
+    :param card: a card
+    :return: the rank of the card within its suit, 0 for a 2 up to 12 for an Ace
+    """
+    return card % NUM_VALUES
+
+
+def bit(card):
+    """
+    :param card: a card
+    :return: the mask holding only the given card
+    """
+    return 1 << card
+
+
+def count(mask):
+    """
+    :param mask: a set of cards
+    :return: the number of cards in the set
+    """
+    return bin(mask).count('1')
+
+
+def cards(mask):
+    """
+    Lists the cards in a set, lowest card first.
+    :param mask: a set of cards
+    :return: list of the cards in the set
+    """
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(low.bit_length() - 1)
+        mask ^= low
+    return out
+
+
+def legal_moves(hand, leading_suit=None):
+    """
+    Finds the cards of a hand that can be played given the leading suit. The player must follow
+    suit if they are able to.
+    :param hand: the cards in the player's hand
+    :param leading_suit: the suit index that was lead, or None if the player is leading
+    :return: the set of cards that can be played
+    """
+    if leading_suit is not None:
+        follow = hand & SUIT_MASKS[leading_suit]
+        if follow:
+            return follow
+    return hand
+
+
+def random_card(mask):
+    """
+    :param mask: a non-empty set of cards
+    :return: a card picked uniformly at random from the set
+    """
+    return random.choice(cards(mask))
+
+
+def trick_winner(cards_played, trump_suit, leading_suit):
+    """
+    :param cards_played: the cards played in the trick
+    :param trump_suit: the trump suit index, or NO_TRUMP
+    :param leading_suit: the suit index that was lead
+    :return: the card that wins the trick
+    """
+    return max(cards_played, key=TRICK_RANKS[trump_suit][leading_suit].__getitem__)
+
+
+def card_name(card):
+    """
+    :param card: a card
+    :return: the name of the card as used by pydealer and the clients, e.g. 'Ace of Spades'
+    """
+    return CARD_NAMES[card]
+
+
+def suit_name(suit):
+    """
+    :param suit: a suit index
+    :return: the name of the suit
+    """
+    return SUITS[suit]
+
+
+def from_pydealer(card):
+    """
+    :param card: a pydealer.Card
+    :return: the matching int card
+    """
+    return make_card(card.value, card.suit)
+
+
+def from_stack(stack):
+    """
+    :param stack: a pydealer.Stack, or any iterable of pydealer.Card
+    :return: the set of cards in the stack
+    """
+    mask = 0
+    for card in stack:
+        mask |= 1 << from_pydealer(card)
+    return mask
+
+
+def to_pydealer(card):
+    """
+    :param card: a card
+    :return: the matching pydealer.Card
+    """
+    return pydealer.Card(VALUES[rank_of(card)], SUITS[suit_of(card)])
+
+
+def to_stack(mask):
+    """
+    :param mask: a set of cards
+    :return: a pydealer.Stack holding the cards in the set
+    """
+    return pydealer.Stack(cards=[to_pydealer(card) for card in cards(mask)])
@@ -0,0 +1,191 @@
+"""
+Exact solver for the last few tricks of a round.
+
+With every hand known (a double-dummy deal), the rest of the round is a small game tree that
+can be searched exhaustively. The outcome for the searching player is whether they make their
+bid exactly, so the search is an alpha-beta search over the values 0 and 1: the player's own
+turns need one card that makes the bid, and in the paranoid search every other player works
+against them, so their turns need every card to make it. Cards of one hand that touch, with no
+card still in play between them, are equivalent and only one of them is searched. Positions at
+the start of a trick are kept in a transposition table.
+
+The searching player doesn't know the other hands, so endgame_move solves a number of deals of
+the unseen cards and plays the card that makes the bid in the most of them.
+"""
+import random
+
+import Cards
+from BatchRollout import cards_left
+
+
+class EndgameSolver:
+    """
+    Double-dummy search of the rest of a round for one player's bid.
+    """
+    def __init__(self, num_players, me, trump_suit, bid, paranoid=True):
+        """
+        :param num_players: number of players at the table
+        :param me: id of the player whose bid is being solved for
+        :param trump_suit: the trump suit index, or None
+        :param bid: the player's bid
+        :param paranoid: whether the other players play to make the player miss their bid. If
+        not, every player plays to help them make it.
+        """
+        self.num_players = num_players
+        self.me = me
+        self.ranks = Cards.TRICK_RANKS[trump_suit if trump_suit is not None else Cards.NO_TRUMP]
+        self.bid = bid
+        self.paranoid = paranoid
+        # Value of positions at the start of a trick, by (hands, leader, tricks taken)
+        self.table = {}
+
+    def trick_start(self, hands, leader, taken):
+        """
+        :param hands: list of every player's hand mask, by player id
+        :param leader: id of the player leading the trick
+        :param taken: tricks taken by the player so far
+        :return: 1 if the player makes their bid from this position, otherwise 0
+        """
+        remaining = Cards.count(hands[leader])
+        if taken > self.bid or taken + remaining < self.bid:
+            return 0
+        if remaining == 0:
+            return 1
+        key = (tuple(hands), leader, taken)
+        value = self.table.get(key)
+        if value is None:
+            value = self.play(hands, leader, 0, None, 0, leader, 0, taken)
+            self.table[key] = value
+        return value
+
+    def play(self, hands, leader, played, lead, best, winner, table, taken):
+        """
+        Searches the position with some cards of the trick played.
+        :param hands: list of every player's hand mask, by player id, changed and put back
+        :param leader: id of the player who leads the trick
+        :param played: number of cards played in the trick
+        :param lead: the leading suit, None before the lead
+        :param best: strength of the best card in the trick
+        :param winner: id of the player with the best card in the trick
+        :param table: mask of the cards played in the trick
+        :param taken: tricks taken by the player before this trick
+        :return: 1 if the player makes their bid from this position, otherwise 0
+        """
+        if played == self.num_players:
+            return self.trick_start(hands, winner, taken + (winner == self.me))
+        player = (leader + played) % self.num_players
+        hand = hands[player]
+        maximizing = player == self.me or not self.paranoid
+        in_play = table
+        for other in hands:
+            in_play |= other
+        for card in self.moves(Cards.legal_moves(hand, lead), in_play & ~hand, taken < self.bid):
+            hands[player] = hand & ~Cards.bit(card)
+            value = self.after_card(hands, leader, played, lead, best, winner, table, taken,
+                                    player, card)
+            hands[player] = hand
+            if value == maximizing:
+                return value
+        return 0 if maximizing else 1
+
+    def after_card(self, hands, leader, played, lead, best, winner, table, taken, player, card):
+        """
+        Searches the position after a player plays a card. The arguments are the position
+        before the card, as for play, except that the card is already out of the player's hand.
+        :param player: id of the player playing the card
+        :param card: the card played
+        :return: 1 if the player makes their bid from the new position, otherwise 0
+        """
+        suit = lead if lead is not None else Cards.suit_of(card)
+        strength = self.ranks[suit][card]
+        if strength > best:
+            best, winner = strength, player
+        return self.play(hands, leader, played + 1, suit, best, winner, table | Cards.bit(card),
+                         taken)
+
+    @staticmethod
+    def moves(legal, others, high_first):
+        """
+        Picks one card from each run of equivalent cards. Two cards of a suit are equivalent
+        when none of the other cards in play lie between them.
+        :param legal: the cards the player can play
+        :param others: the cards in play outside the player's hand
+        :param high_first: whether to try high cards first
+        :return: list of the cards to search
+        """
+        moves = []
+        last = None
+        for card in Cards.cards(legal):
+            if (last is not None and Cards.suit_of(card) == Cards.suit_of(last)
+                    and not others & (Cards.bit(card) - Cards.bit(last + 1))):
+                moves[-1] = card
+            else:
+                moves.append(card)
+            last = card
+        if high_first:
+            moves.reverse()
+        return moves
+
+
+def deal_hands(state, player, hand):
+    """
+    Deals the cards the player has not seen to the other players at random, each getting as many
+    cards as they are still holding.
+    :param state: the current GameState
+    :param player: the player running the search
+    :param hand: the player's hand mask
+    :return: list of every player's hand mask, by player id
+    """
+    unseen = Cards.cards(Cards.FULL_DECK & ~(hand | state.discard))
+    random.shuffle(unseen)
+    hands = []
+    start = 0
+    for other in state.players:
+        if other is player:
+            hands.append(hand)
+            continue
+        mask = 0
+        end = start + cards_left(state, other)
+        for card in unseen[start:end]:
+            mask |= Cards.bit(card)
+        hands.append(mask)
+        start = end
+    return hands
+
+
+def endgame_move(state, player, hand, samples=20):
+    """
+    Picks a card by solving sampled deals of the unseen cards. Each card is scored by the number
+    of deals in which it makes the bid against the other players, with ties broken by the
+    number of deals in which it could make the bid if the other players helped.
+    :param state: the current GameState, with the player about to play
+    :param player: the player running the search
+    :param hand: the player's hand mask
+    :param samples: the number of deals to solve
+    :return: the card to play
+    """
+    me = state.player2id[player]
+    bid = state.bids[player]
+    taken = state.tracker.tricks_taken[player]
+    solvers = [EndgameSolver(state.num_players, me, state.trump_suit, bid, paranoid)
+               for paranoid in (True, False)]
+    played = len(state.trick_cards)
+    leader = state.player_order[0]
+    lead = state.leading_suit
+    best = solvers[0].ranks[lead][state.best_played_card] if played else 0
+    winner = state.best_player_idx if played else me
+    table = 0
+    for card in state.trick_cards.values():
+        table |= Cards.bit(card)
+
+    legal = Cards.cards(Cards.legal_moves(hand, lead))
+    scores = {card: [0, 0] for card in legal}
+    for _ in range(samples):
+        hands = deal_hands(state, player, hand)
+        for card in legal:
+            hands[me] = hand & ~Cards.bit(card)
+            for i, solver in enumerate(solvers):
+                scores[card][i] += solver.after_card(hands, leader, played, lead, best, winner,
+                                                     table, taken, me, card)
+            hands[me] = hand
+    return max(legal, key=lambda card: scores[card])
@@ -0,0 +1,172 @@
+"""
+Compact binary encoding of a game, to store it or send it to another process.
+
+The encoding has fixed-width fields, so its size only depends on the number of players and the
+number of rounds. It starts with a header:
+    magic b'OH', format version, number of players, largest hand size, current round, hand size,
+    current trick, dealer index, whether the dealer is set, trump suit, leading suit, best player
+    index, best card, player turn, first player of the player order, game id, discard mask
+followed by one record per player, in the order of GameState.players:
+    hand mask, card played in the trick, bid in GameState.bids, bid in the TrickTracker, tricks
+    taken, number of rounds bid, number of rounds scored
+and then each player's bid history, trick history and scoreboard row, padded to the number of
+rounds. Absent cards, suits and bids are NONE. Players themselves are not encoded: decoding is
+given the players of the game, in the same order, and sets their hands.
+
+encode_game adds the progress of an OhHell round (see OhHell.step) after the state, and whether
+the game asks for trick acknowledgements and how many events it has produced. Version 1 had only
+the progress of the round; it still decodes, with the defaults of OhHell for the rest.
+"""
+import struct
+
+import numpy as np
+
+import Cards
+from GameState import GameState
+from OhHell import BID, DEAL, OhHell, TRICK_END, TRICKS
+
+MAGIC = b'OH'
+VERSION = 2
+# Stands in for a card, suit, bid or player that isn't set
+NONE = 255
+
+HEADER = struct.Struct('<2sBBBBBBBBBBbBBB16sQ')
+PLAYER = struct.Struct('<QBBBBBB')
+# Phase of the round, number of bids made, id of the player to act, whether tricks are
+# acknowledged and the number of events produced
+ROUND = struct.Struct('<BBBBI')
+ROUND_V1 = struct.Struct('<BBB')
+PHASES = (DEAL, BID, TRICKS, TRICK_END)
+
+
+def _or_none(value):
+    return NONE if value is None else value
+
+
+def _from_none(value):
+    return None if value == NONE else value
+
+
+def encode_state(state):
+    """
+    :param state: the GameState to encode
+    :return: the encoded state, as bytes
+    """
+    num_rounds = state.num_rounds
+    tracker = state.tracker
+    parts = [HEADER.pack(MAGIC, VERSION, state.num_players, state.max_hand, state.curr_round,
+                         state.curr_hand_size, state.curr_trick, state.dealer_idx,
+                         state.dealer is not None, _or_none(state.trump_suit),
+                         _or_none(state.leading_suit), state.best_player_idx,
+                         _or_none(state.best_played_card), state.player_turn,
+                         state.player_order[0], bytes.fromhex(state.game_id), state.discard)]
+    histories = []
+    for player in state.players:
+        bids = tracker.bid_history[player]
+        tricks = tracker.trick_history[player]
+        parts.append(PLAYER.pack(player.hand, _or_none(state.trick_cards.get(player)),
+                                 _or_none(state.bids.get(player)),
+                                 _or_none(tracker.curr_bid.get(player)),
+                                 tracker.tricks_taken[player], len(bids), len(tricks)))
+        histories.append(bytes(bids) + bytes(num_rounds - len(bids)))
+        histories.append(bytes(tricks) + bytes(num_rounds - len(tricks)))
+    parts += histories
+    parts.append(tracker.scoreboard.astype('<i2').tobytes())
+    return b''.join(parts)
+
+
+def decode_state(data, players, offset=0):
+    """
+    :param data: bytes holding an encoded state
+    :param players: the players of the game, in the order they were in when it was encoded.
+    Their hands are set from the encoding.
+    :param offset: where the encoded state starts in data
+    :return: the decoded GameState and the offset just after it in data
+    """
+    (magic, version, num_players, max_hand, curr_round, curr_hand_size, curr_trick, dealer_idx,
+     has_dealer, trump_suit, leading_suit, best_player_idx, best_played_card, player_turn,
+     leader, game_id, discard) = HEADER.unpack_from(data, offset)
+    if magic != MAGIC:
+        raise ValueError('Not an encoded game')
+    if version not in (1, VERSION):
+        raise ValueError('Unknown game encoding version {}'.format(version))
+    if num_players != len(players):
+        raise ValueError('Encoded game has {} players, got {}'.format(num_players, len(players)))
+    offset += HEADER.size
+
+    state = GameState(players, max_hand)
+    tracker = state.tracker
+    num_rounds = state.num_rounds
+    state.game_id = game_id.hex()
+    state.curr_round = tracker.curr_round = curr_round
+    state.curr_hand_size = curr_hand_size
+    state.curr_trick = curr_trick
+    state.dealer_idx = dealer_idx
+    state.dealer = players[dealer_idx] if has_dealer else None
+    state.trump_suit = _from_none(trump_suit)
+    state.leading_suit = _from_none(leading_suit)
+    state.best_player_idx = best_player_idx
+    state.best_played_card = _from_none(best_played_card)
+    if state.leading_suit is not None:
+        state.trick_ranks = Cards.TRICK_RANKS[state.trump_suit][state.leading_suit]
+    state.player_turn = player_turn
+    state.player_order = list(range(leader, num_players)) + list(range(0, leader))
+    state.discard = discard
+
+    lengths = []
+    for player in players:
+        (player.hand, card, bid, curr_bid, tricks_taken, bids_len,
+         tricks_len) = PLAYER.unpack_from(data, offset)
+        offset += PLAYER.size
+        if card != NONE:
+            state.trick_cards[player] = card
+        if bid != NONE:
+            state.bids[player] = bid
+        if curr_bid != NONE:
+            tracker.curr_bid[player] = curr_bid
+        tracker.tricks_taken[player] = tricks_taken
+        lengths.append((bids_len, tricks_len))
+    # Cards of the trick in the order they were played
+    state.trick_cards = {state.id2player[i]: state.trick_cards[state.id2player[i]]
+                         for i in state.player_order if state.id2player[i] in state.trick_cards}
+    for player, (bids_len, tricks_len) in zip(players, lengths):
+        tracker.bid_history[player] = list(data[offset:offset + bids_len])
+        offset += num_rounds
+        tracker.trick_history[player] = list(data[offset:offset + tricks_len])
+        offset += num_rounds
+    count = num_players * num_rounds
+    tracker.scoreboard = np.frombuffer(data, '<i2', count, offset).astype(float).reshape(
+        num_players, num_rounds)
+    return state, offset + 2 * count
+
+
+def encode_game(game):
+    """
+    :param game: the OhHell game to encode
+    :return: the encoded game, as bytes
+    """
+    state = game.state
+    current = state.player2id[game.current_player] if game.current_player is not None else NONE
+    return encode_state(state) + ROUND.pack(PHASES.index(game.phase), game.bids_made, current,
+                                            game.trick_ack, game.events_sent)
+
+
+def decode_game(data, players, **kwargs):
+    """
+    :param data: bytes holding an encoded game
+    :param players: the players of the game, in the order they were in when it was encoded
+    :param kwargs: other arguments of the OhHell game, e.g. ask, inform and decide
+    :return: the decoded OhHell game
+    """
+    state, offset = decode_state(data, players)
+    if data[len(MAGIC)] == 1:
+        phase, bids_made, current = ROUND_V1.unpack_from(data, offset)
+        game = OhHell(players, state.max_hand, state=state, **kwargs)
+    else:
+        phase, bids_made, current, trick_ack, events_sent = ROUND.unpack_from(data, offset)
+        game = OhHell(players, state.max_hand, state=state, trick_ack=bool(trick_ack), **kwargs)
+        game.events_sent = events_sent
+    game.phase = PHASES[phase]
+    game.bids_made = bids_made
+    game.current_player = state.id2player[current] if current != NONE else None
+    return game
@@ -0,0 +1,232 @@
+"""
+Append-only binary log of the games played, for analysing many games without playing them again.
+
+A game given a GameLog records every deal, trump card, bid, card play, trick winner and score as
+it happens. Every record has the same fixed width, see RECORD:
+    game: the first 8 bytes of the game's GameState.game_id
+    value: the hand mask of a deal, the card of a trump or play, the bid of a bid, the score after
+    the round of a score, unused for a trick winner
+    round, trick, hand size and trump suit of the round when the record was made
+    kind: one of the record kinds below
+    player: the seat of the player, their index in GameState.players, NONE for the trump card
+    num_players: the number of players in the game
+so a log file is a plain array of records that is read back by memory-mapping it as a NumPy
+structured array, without parsing. Each writer process appends to its own shard file in a log
+directory, named after the process id, and the reader maps every shard in the directory. The
+first record of a shard is a FORMAT record holding the format version.
+
+A record only reaches the file once the writer is flushed, which a game does at the end of each
+round. A shard cut off in the middle of a record, by a crash, is read up to its last whole record.
+A game packs each record before it changes its state and writes it after, so a record that can't
+be packed leaves the game as it was. Games stepped in several threads can share a writer.
+"""
+import glob
+import os
+import struct
+import threading
+
+import numpy as np
+
+VERSION = 1
+# Stands in for a player or card that isn't set
+NONE = 255
+
+# Record kinds
+FORMAT = 0
+DEAL = 1
+TRUMP = 2
+BID = 3
+PLAY = 4
+TRICK = 5
+SCORE = 6
+
+RECORD = np.dtype([('game', '<u8'), ('value', '<u8'), ('round', 'u1'), ('trick', 'u1'),
+                   ('hand_size', 'u1'), ('trump', 'u1'), ('kind', 'u1'), ('player', 'u1'),
+                   ('num_players', 'u1'), ('pad', 'u1')])
+# The same layout, to pack one record
+RECORD_STRUCT = struct.Struct('<QQ8B')
+SHARD_SUFFIX = '.ohlog'
+
+
+def log_game_id(state):
+    """
+    :param state: the GameState of a game
+    :return: the id of the game in the log
+    """
+    return int(state.game_id[:16], 16)
+
+
+class GameLog:
+    """
+    Appends the records of games to a shard file. The file is only opened once something is
+    written, and a game holding the log can be pickled, which leaves the open file behind.
+    """
+    def __init__(self, path):
+        """
+        :param path: the shard file, appended to if it exists
+        """
+        self.path = path
+        self.file = None
+        # Held while opening the file, so threads writing at once open it only once
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open_shard(cls, directory, shard=None):
+        """
+        :param directory: the log directory, created if it doesn't exist
+        :param shard: the name of the shard, the process id by default so processes writing to
+        the same directory don't share a file
+        :return: the GameLog writing to the shard
+        """
+        os.makedirs(directory, exist_ok=True)
+        if shard is None:
+            shard = os.getpid()
+        return cls(os.path.join(directory, 'games-{}{}'.format(shard, SHARD_SUFFIX)))
+
+    def record(self, state, kind, player=None, value=0):
+        """
+        Appends a record of a game.
+        :param state: the GameState of the game, as it is when the record is made
+        :param kind: the kind of record, e.g. BID
+        :param player: the player the record is about, None for the trump card
+        :param value: the value of the record, see the module docstring
+        """
+        self.write(self.pack(state, kind, player, value))
+
+    def pack(self, state, kind, player=None, value=0):
+        """
+        :param state: the GameState of the game, as it is when the record is made
+        :param kind: the kind of record, e.g. BID
+        :param player: the player the record is about, None for the trump card
+        :param value: the value of the record, see the module docstring
+        :return: the bytes of the record, to write. Raises struct.error if a value doesn't fit
+        its field.
+        """
+        trump = state.trump_suit
+        return RECORD_STRUCT.pack(log_game_id(state), value, state.curr_round, state.curr_trick,
+                                  state.curr_hand_size, NONE if trump is None else trump, kind,
+                                  NONE if player is None else state.player2id[player],
+                                  state.num_players, 0)
+
+    def write(self, record):
+        """
+        Appends a packed record.
+        :param record: the bytes of the record, see pack
+        """
+        if self.file is None:
+            with self.lock:
+                if self.file is None:
+                    self.open()
+        self.file.write(record)
+
+    def open(self):
+        """
+        Opens the shard to append to, starting it with a FORMAT record if it is new. A shard left
+        with a partly written record is cut back to its last whole record first. The file is
+        only set once it is ready to take records.
+        """
+        file = open(self.path, 'ab')
+        end = file.tell()
+        if end % RECORD.itemsize:
+            file.truncate(end - end % RECORD.itemsize)
+        if file.tell() == 0:
+            file.write(RECORD_STRUCT.pack(0, VERSION, 0, 0, 0, 0, FORMAT, 0, 0, 0))
+        self.file = file
+
+    def flush(self):
+        """
+        Writes the buffered records to the shard.
+        """
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        """
+        Flushes and closes the shard. Writing again reopens it.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __getstate__(self):
+        self.flush()
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+def read_shard(path):
+    """
+    :param path: a shard file
+    :return: the records of the shard, as a read-only structured array memory-mapped from the
+    file, without the FORMAT record
+    """
+    count = os.path.getsize(path) // RECORD.itemsize
+    if count == 0:
+        return np.zeros(0, RECORD)
+    records = np.memmap(path, RECORD, 'r', shape=(count,))
+    if records[0]['kind'] != FORMAT:
+        raise ValueError('Not a game log: {}'.format(path))
+    if records[0]['value'] != VERSION:
+        raise ValueError('Unknown game log version {} in {}'.format(records[0]['value'], path))
+    return records[1:]
+
+
+class GameLogReader:
+    """
+    The records of every shard in a log directory.
+    """
+    def __init__(self, directory):
+        """
+        :param directory: the log directory
+        """
+        self.paths = sorted(glob.glob(os.path.join(directory, '*' + SHARD_SUFFIX)))
+        # Memory-mapped records of each shard
+        self.shards = [read_shard(path) for path in self.paths]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def records(self, kind=None):
+        """
+        :param kind: the kind of record to select, None for every record
+        :return: the selected records of all the shards, in one array. Only the selected
+        records are copied out of the files.
+        """
+        if kind is None:
+            parts = self.shards
+        else:
+            parts = [shard[shard['kind'] == kind] for shard in self.shards]
+        if not parts:
+            return np.zeros(0, RECORD)
+        return np.concatenate(parts)
+
+    def round_results(self):
+        """
+        Joins the bids and the trick winners of every round played to its end.
+        :return: structured array with one row per player per round: game, round, player, hand
+        size, trump suit, bid and tricks taken
+        """
+        scored = self.records(SCORE)
+        bids = self.records(BID)
+        tricks = self.records(TRICK)
+        parts = [scored, bids, tricks]
+        keys = np.concatenate([np.stack([part['game'], part['round'].astype('<u8'),
+                                         part['player'].astype('<u8')], axis=1)
+                               for part in parts])
+        keys, rows = np.unique(keys, axis=0, return_inverse=True)
+        scored_rows, bid_rows, trick_rows = np.split(rows, np.cumsum([len(scored), len(bids)]))
+
+        results = np.zeros(len(keys), [('game', '<u8'), ('round', 'u1'), ('player', 'u1'),
+                                       ('hand_size', 'u1'), ('trump', 'u1'), ('bid', 'u1'),
+                                       ('tricks', 'u1')])
+        results['game'], results['round'], results['player'] = keys.T
+        results['bid'][bid_rows] = bids['value']
+        results['hand_size'][bid_rows] = bids['hand_size']
+        results['trump'][bid_rows] = bids['trump']
+        np.add.at(results['tricks'], trick_rows, 1)
+        # Only rounds that were scored were played to the end
+        complete = np.zeros(len(keys), bool)
+        complete[scored_rows] = True
+        return results[complete]
@@ -0,0 +1,232 @@
+"""
+Code shared by the socket.io servers.
+
+app.py serves games on eventlet and app_async.py on asyncio. Both set up games, restore them from
+the game store and report the delays of their event loop the same way, with the functions here.
+
+Live games can be written to a checkpoint file, so they can be carried on after the server
+restarts. The file holds one record per game: the lengths of the three parts, then the client's
+id, the game's setup as JSON and the game encoded by GameCodec. Anyone holding a game's client
+id and resume token can carry it on, so the token is a random secret given only to the client
+that set the game up.
+"""
+import json
+import os
+import secrets
+import struct
+
+from GameCodec import decode_game, encode_game
+from GameLog import GameLog
+from GameStore import open_store
+from OhHell import OhHell
+from Player import Player
+from PlayerSpec import make_player
+
+# Lengths of the id, setup and encoded game of a checkpoint record
+CHECKPOINT_RECORD = struct.Struct('<HII')
+# Random bytes in the token that lets a client resume its game from a checkpoint
+RESUME_TOKEN_BYTES = 16
+
+
+def game_error(players):
+    """
+    Checks the players asked for in a new game.
+    :param players: list of player dicts sent by the client, or None
+    :return: the error to send back to the client, or None if the players are fine
+    """
+    if players is None or len(players) < 2:
+        return 'Not enough players provided'
+    if all(['is_ai' in player and player['is_ai'] for player in players]):
+        return 'No human players provided'
+    if len(players) != len(set([player['name'] for player in players])):
+        return 'Players must have unique names'
+    return None
+
+
+def create_players(data, stats=None):
+    """
+    :param data: data for the game. Includes a list of players.
+    :param stats: collector for the decisions of the MCTS players, or None
+    :return: the list of players
+    """
+    def init_player(player):
+        if 'is_ai' in player and player['is_ai']:
+            return make_player(player, stats=stats)
+        return Player(player['name'])
+    return [init_player(player) for player in data['players']]
+
+
+def create_game(data, stats=None, decide=None, log=None):
+    """
+    Sets up a game from the data sent by a client, once the players have been checked. The game
+    keeps the data it was set up with as its setup, for checkpoints, along with a new resume
+    token.
+    :param data: data for the game. Includes a list of players and a maximum hand size, and
+    optionally whether to send the events in batches and whether to ask for an acknowledgement
+    of each trick, see event_batch.
+    :param stats: collector for the decisions of the MCTS players, or None
+    :param decide: the decide function of the game, see OhHell
+    :param log: the GameLog to record the game to, or None
+    :return: the OhHell game
+    """
+    game = OhHell(create_players(data, stats), max_hand=data.get('max_hand'), decide=decide,
+                  trick_ack=data.get('trick_ack', True), log=log)
+    game.setup = {'players': data['players'], 'max_hand': data.get('max_hand'),
+                  'batch_events': data.get('batch_events', False),
+                  'trick_ack': data.get('trick_ack', True),
+                  'resume_token': secrets.token_urlsafe(RESUME_TOKEN_BYTES)}
+    return game
+
+
+def attach_stats(game, stats):
+    """
+    Points the AI players of a game loaded from a store back at the server's telemetry
+    collector, as the stored game holds a copy of it.
+    :param game: the loaded game
+    :param stats: collector for the decisions of the MCTS players, or None
+    """
+    for player in game.players:
+        if getattr(player, 'stats', None) is not None:
+            player.stats = stats
+
+
+def event_batch(game, events, request):
+    """
+    Puts the events of a step and the request that ends it in one message, for clients that set
+    up their game with batch_events. The message is sent as an 'events' event, and a request is
+    answered by acknowledging the message. Each event has a sequence number, counting up from 0
+    over the game, so the client can play them back in order and skip any it has already seen.
+    :param game: the game that was stepped
+    :param events: the list of (event, data) from OhHell.step
+    :param request: the Request from OhHell.step, or None
+    :return: the message, as a dict of the sequence number of the first event, the events and
+    the request
+    """
+    return {
+        'seq': game.events_sent - len(events),
+        'events': [{'event': event, 'data': data} for event, data in events],
+        'request': {'event': request.event, 'data': request.data} if request is not None else None,
+    }
+
+
+def store_from_environ(environ=os.environ):
+    """
+    Opens the game store set up by the environment variables:
+        GAME_STORE: SQLite file to keep the games in, in memory if unset
+        GAME_TTL: seconds a game may go unused before it is evicted, 3600 by default
+        FINISHED_GAME_TTL: seconds a finished game may go unused before it is evicted, 300 by
+        default
+        MAX_GAMES: the most games to keep, no limit by default
+        GAME_MEMORY_BUDGET: the largest total size of the games to keep in megabytes, no limit by
+        default
+    :param environ: the environment variables
+    :return: the game store
+    """
+    budget = environ.get('GAME_MEMORY_BUDGET')
+    return open_store(environ.get('GAME_STORE'),
+                      ttl=float(environ.get('GAME_TTL') or 3600),
+                      finished_ttl=float(environ.get('FINISHED_GAME_TTL') or 300),
+                      max_games=int(environ.get('MAX_GAMES') or 0) or None,
+                      max_bytes=int(float(budget) * 2 ** 20) if budget else None)
+
+
+def log_from_environ(environ=os.environ):
+    """
+    :param environ: the environment variables
+    :return: the GameLog shard of this process in the directory named by GAME_LOG_DIR, or None
+    if it is unset
+    """
+    directory = environ.get('GAME_LOG_DIR')
+    return GameLog.open_shard(directory) if directory else None
+
+
+def latency_summary(loop_delays):
+    """
+    :param loop_delays: delays of the event loop, in seconds
+    :return: dict of the number of delays and their median, 99th percentile and maximum in
+    milliseconds
+    """
+    delays = sorted(loop_delays)
+    if not delays:
+        return {'samples': 0}
+    return {
+        'samples': len(delays),
+        'p50': delays[len(delays) // 2] * 1000,
+        'p99': delays[int(len(delays) * 0.99)] * 1000,
+        'max': delays[-1] * 1000,
+    }
+
+
+def write_checkpoint(path, store, saved=None):
+    """
+    Writes every game in a store to a checkpoint file. The file is replaced in one step, so a
+    crash while writing leaves the last checkpoint as it was. A game that can't be encoded is
+    left out, and the rest are written.
+    :param path: the checkpoint file
+    :param store: the game store
+    :param saved: dict of client id: (setup, encoded game) of games from an earlier checkpoint
+    that have not been carried on yet, to keep in the file
+    :return: the number of games written
+    """
+    records = dict(saved or {})
+    for sid, game in store.items():
+        try:
+            records[sid] = (game.setup, encode_game(game))
+        except (struct.error, ValueError, OverflowError) as error:
+            print(f'Game {sid} left out of the checkpoint: {error}')
+    with open(path + '.tmp', 'wb') as f:
+        for sid, (setup, data) in records.items():
+            sid_bytes = sid.encode()
+            setup_bytes = json.dumps(setup).encode()
+            f.write(CHECKPOINT_RECORD.pack(len(sid_bytes), len(setup_bytes), len(data)))
+            f.write(sid_bytes + setup_bytes + data)
+    os.replace(path + '.tmp', path)
+    return len(records)
+
+
+def read_checkpoint(path):
+    """
+    :param path: the checkpoint file
+    :return: dict of client id: (setup, encoded game), empty if there is no checkpoint
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        data = f.read()
+    records = {}
+    offset = 0
+    while offset < len(data):
+        sid_len, setup_len, game_len = CHECKPOINT_RECORD.unpack_from(data, offset)
+        offset += CHECKPOINT_RECORD.size
+        sid = data[offset:offset + sid_len].decode()
+        offset += sid_len
+        setup = json.loads(data[offset:offset + setup_len])
+        offset += setup_len
+        records[sid] = (setup, data[offset:offset + game_len])
+        offset += game_len
+    return records
+
+
+def resume_allowed(setup, token):
+    """
+    :param setup: the setup of a game from a checkpoint
+    :param token: the resume token sent by a client
+    :return: whether the token is the game's resume token
+    """
+    expected = setup.get('resume_token')
+    return (isinstance(expected, str) and isinstance(token, str)
+            and secrets.compare_digest(expected, token))
+
+
+def restore_game(setup, data, stats=None, decide=None, log=None):
+    """
+    :param setup: the setup of the game from a checkpoint
+    :param data: the encoded game from a checkpoint
+    :param stats: collector for the decisions of the MCTS players, or None
+    :param decide: the decide function of the game, see OhHell
+    :param log: the GameLog to record the game to, or None
+    :return: the OhHell game
+    """
+    game = decode_game(data, create_players(setup, stats), decide=decide, log=log)
+    game.setup = setup
+    return game
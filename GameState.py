@@ -2,7 +2,9 @@
 Code containg the game state logic for the card game, Oh, Hell.
 """
 import copy
+import uuid
 
+import Cards
 from TrickTracker import TrickTracker
 
 
@@ -11,10 +13,6 @@ class GameState:
     Game state class that maintains all the information about the game.
     """
     total_cards = 52
-    base_ranks = {"suits": {"Spades": 1, "Hearts": 1, "Clubs": 1, "Diamonds": 1},
-                    "values": {"Ace": 13, "King": 12, "Queen": 11, "Jack": 10, "10": 9,
-                               "9": 8, "8": 7, "7": 6, "6": 5, "5": 4, "4": 3, "3": 2, "2": 1, }
-                    }
 
     def __init__(self, players, max_hand=None):
         """
@@ -25,6 +23,8 @@ class GameState:
         """
         self.num_players = len(players)
         self.players = players
+        # Identifies the game across copies of the state, including copies sent to other processes
+        self.game_id = uuid.uuid4().hex
         if max_hand:
             self.max_hand = max_hand
         else:
@@ -51,9 +51,9 @@ class GameState:
         self.dealer = None
         self.trump_suit = None
         self.leading_suit = None
-        self.discard = []
+        self.discard = 0
         self.deck = None
-        self.custom_ranks = None
+        self.trick_ranks = None
         self.trick_cards = {}
         self.bids = {}
         self.player2id = {p: i for i, p in enumerate(self.players)}
@@ -67,11 +67,13 @@ class GameState:
 
     def begin_round(self):
         """
-        Beginning logic of the match. Get hand size and dealer
+        Beginning logic of the match. Get hand size and dealer. The last round's bids are
+        cleared, so the bids only hold those made this round.
         :return: the hand size of the current round and the dealer
         """
         self.dealer = self.players[self.dealer_idx]
         self.curr_hand_size = self.round_hand[self.curr_round]
+        self.bids = {}
         # self.player_order = [i for i in range(self.num_players)]
         offset = self.curr_round % self.num_players
         self.curr_trick = 0
@@ -83,8 +85,8 @@ class GameState:
         Set the trump card for the given round.
         :param trump_card: the trump card of the current round
         """
-        self.trump_suit = trump_card.suit
-        self.discard += [trump_card]
+        self.trump_suit = Cards.suit_of(trump_card)
+        self.discard |= Cards.bit(trump_card)
 
     def get_bid_order(self):
         """
@@ -114,11 +116,8 @@ class GameState:
         :param leading_card: the card that was first played
         :return: the suit of the leading card
         """
-        self.leading_suit = leading_card.suit
-        self.custom_ranks = copy.deepcopy(GameState.base_ranks)
-        self.custom_ranks["suits"][self.trump_suit] = 3
-        if self.trump_suit != self.leading_suit:
-            self.custom_ranks["suits"][self.leading_suit] = 2
+        self.leading_suit = Cards.suit_of(leading_card)
+        self.trick_ranks = Cards.TRICK_RANKS[self.trump_suit][self.leading_suit]
 
         return self.leading_suit
 
@@ -135,26 +134,65 @@ class GameState:
         :param card: card being played by the player
         :return: the new state after the card has been played.
         """
-        def card_gt(card1, card2, ranks):
-            if ranks["suits"][card1.suit] == ranks["suits"][card2.suit]:
-                return ranks["values"][card1.value] > ranks["values"][card2.value]
-            else:
-                return ranks["suits"][card1.suit] > ranks["suits"][card2.suit]
-
         new_state = self.copy_state()
-        new_state.discard += [card]
-        new_state.trick_cards[player] = card
-        player_idx = new_state.player2id[player]
-        # Check for initial play
-        if new_state.best_player_idx == -1:
-            new_state.best_played_card = card
-            new_state.best_player_idx = player_idx
-            new_state.setup_trick(card)
-        elif card_gt(card, new_state.best_played_card, new_state.custom_ranks):
-            new_state.best_played_card = card
-            new_state.best_player_idx = player_idx
+        new_state.apply_move(player, card)
         return new_state
 
+    def apply_move(self, player, card):
+        """
+        Records information for a card played by a player, changing this state in place. Used by
+        searches that play many moves and take them back, see undo_move, snapshot and restore.
+        :param player: the player playing the card
+        :param card: card being played by the player
+        :return: the record undo_move needs to take the card back
+        """
+        undo = (self.best_player_idx, self.best_played_card, self.leading_suit, self.trick_ranks)
+        self.discard |= Cards.bit(card)
+        self.trick_cards[player] = card
+        player_idx = self.player2id[player]
+        # Check for initial play
+        if self.best_player_idx == -1:
+            self.best_played_card = card
+            self.best_player_idx = player_idx
+            self.setup_trick(card)
+        elif self.trick_ranks[card] > self.trick_ranks[self.best_played_card]:
+            self.best_played_card = card
+            self.best_player_idx = player_idx
+        return undo
+
+    def undo_move(self, player, card, undo):
+        """
+        Takes back a card played with apply_move. Moves must be undone in the reverse order
+        they were applied, and not across a finish_trick.
+        :param player: the player who played the card
+        :param card: the card that was played
+        :param undo: the record returned by apply_move
+        """
+        self.discard &= ~Cards.bit(card)
+        del self.trick_cards[player]
+        self.best_player_idx, self.best_played_card, self.leading_suit, self.trick_ranks = undo
+
+    def snapshot(self):
+        """
+        Captures everything that changes while the tricks of a round are played out, so that a
+        state can be played forward in place and then rolled back with restore.
+        :return: the snapshot
+        """
+        return (self.discard, dict(self.trick_cards), self.best_player_idx, self.best_played_card,
+                self.leading_suit, self.trick_ranks, self.player_order, self.player_turn,
+                self.curr_trick, dict(self.tracker.tricks_taken))
+
+    def restore(self, snapshot):
+        """
+        Rolls the state back to a snapshot. The same snapshot can be restored many times.
+        :param snapshot: a snapshot taken with snapshot
+        """
+        (self.discard, trick_cards, self.best_player_idx, self.best_played_card,
+         self.leading_suit, self.trick_ranks, self.player_order, self.player_turn,
+         self.curr_trick, tricks_taken) = snapshot
+        self.trick_cards = dict(trick_cards)
+        self.tracker.tricks_taken = dict(tricks_taken)
+
     def finish_trick(self):
         """
         Wraps up the logic for the end of the trick
@@ -167,7 +205,8 @@ class GameState:
             range(0, self.best_player_idx))
         self.best_player_idx = -1
         self.best_played_card = None
-        self.custom_ranks = {}
+        self.leading_suit = None
+        self.trick_ranks = None
         self.trick_cards = {}
         self.player_turn = 0
         self.curr_trick += 1
@@ -184,6 +223,16 @@ class GameState:
         self.player_turn += 1
         return next_player
 
+    def peek_next_player(self):
+        """
+        Get the player whose turn is next, without moving the turn on
+        :return: the next player. If every player has played in the trick, the trick winner,
+        who leads the next trick.
+        """
+        if self.player_turn >= self.num_players:
+            return self.id2player[self.best_player_idx]
+        return self.id2player[self.player_order[self.player_turn]]
+
     def end_trick_info(self, player):
         """
         Information for the end of the trick about the bids made by the given player and the
@@ -201,7 +250,7 @@ class GameState:
         self.dealer = None
         self.trump_suit = None
         self.leading_suit = None
-        self.discard = []
+        self.discard = 0
         self.curr_round += 1
         self.tracker.reset()
         self.dealer_idx += 1
@@ -211,9 +260,10 @@ class GameState:
 
     def terminal_state(self):
         """
-        :return: if the current state is a terminal state.
+        :return: if the current state is a terminal state, i.e. every card of the round is played.
         """
-        return self.num_players * self.curr_hand_size == len(self.discard)
+        cards_played = self.curr_trick * self.num_players + len(self.trick_cards)
+        return cards_played == self.num_players * self.curr_hand_size
 
     def calculate_scores(self):
         """
@@ -246,15 +296,11 @@ class GameState:
     def copy_state(self):
         """
         Creates a copy of the current state. Custom function to ensure references to players and
-        other custom class objects remain the same.
+        other custom class objects remain the same. Only the containers that are changed in place
+        while playing a round are copied.
         :return: new state
         """
-        new_state = copy.deepcopy(self)
-        new_state.player2id = self.player2id
-        new_state.id2player = self.id2player
-        new_state.players = self.players
-        new_state.dealer = self.dealer
+        new_state = copy.copy(self)
+        new_state.trick_cards = dict(self.trick_cards)
         new_state.tracker = self.tracker.copy()
-        new_state.custom_ranks = self.custom_ranks
-        new_state.bids = self.bids
         return new_state
@@ -0,0 +1,329 @@
+"""
+Storage for the games of the server, so any server process can pick up a client's game.
+
+A game is loaded with its version and saved back with the version it was loaded at. If the game
+was saved by someone else in between, the save is stale and raises StaleGameError instead of
+overwriting their changes; the caller drops its copy of the game.
+
+MemoryStore keeps the game objects of one process and is the default. SQLiteStore pickles the
+games into a SQLite file that every process on the host can share.
+
+Games are evicted so abandoned ones don't pile up. Loading or saving a game counts as using it.
+A store can have:
+    ttl: seconds a game may go unused before sweep evicts it
+    finished_ttl: seconds a game that has played its last round may go unused before sweep
+    evicts it
+    max_games: the number of games kept, the least recently used are evicted past it
+    max_bytes: the total size of the games kept, the least recently used are evicted past it.
+    The size of a game is the size of its pickle, which leaves out the search trees of AI players.
+The store counts its evictions by reason, and sweep hands back the clients whose games were
+evicted since the last sweep, so they can be told.
+"""
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+
+# Reasons a game is evicted for
+IDLE = 'idle'
+FINISHED = 'finished'
+CAPACITY = 'capacity'
+
+
+class StaleGameError(Exception):
+    """
+    Raised when a game is saved at a version that is no longer the stored one.
+    """
+    pass
+
+
+def is_finished(game):
+    """
+    :param game: an OhHell game
+    :return: whether every round of the game has been played
+    """
+    return game.state.curr_round >= game.state.num_rounds
+
+
+def game_size(game):
+    """
+    :param game: an OhHell game
+    :return: the size of the game's pickle in bytes
+    """
+    return len(pickle.dumps(game, pickle.HIGHEST_PROTOCOL))
+
+
+class GameStore:
+    """
+    Eviction limits and counters shared by the stores.
+    """
+    def __init__(self, ttl=None, finished_ttl=None, max_games=None, max_bytes=None):
+        """
+        :param ttl: seconds a game may go unused before it is evicted, None to keep it
+        :param finished_ttl: seconds a finished game may go unused before it is evicted, None to
+        only use ttl
+        :param max_games: the most games to keep, None for no limit
+        :param max_bytes: the largest total size of the games to keep, None for no limit
+        """
+        self.ttl = ttl
+        self.finished_ttl = finished_ttl
+        self.max_games = max_games
+        self.max_bytes = max_bytes
+        self.evictions = {IDLE: 0, FINISHED: 0, CAPACITY: 0}
+        # Clients whose games were evicted since the last sweep
+        self.evicted = []
+
+    def record_eviction(self, sid, reason):
+        """
+        :param sid: the id of the client whose game was evicted
+        :param reason: the reason it was evicted for
+        """
+        self.evictions[reason] += 1
+        self.evicted.append(sid)
+
+    def take_evicted(self):
+        """
+        :return: the clients whose games were evicted since the last call
+        """
+        evicted, self.evicted = self.evicted, []
+        return evicted
+
+
+class MemoryStore(GameStore):
+    """
+    Keeps the games of one server process in a dict. Loading a game gives the stored object
+    itself, not a copy.
+    """
+    def __init__(self, **limits):
+        """
+        :param limits: the eviction limits, see GameStore
+        """
+        super().__init__(**limits)
+        # sid: [game, version, size, time last used], least recently used first
+        self.games = OrderedDict()
+        # sids of the finished games, least recently used first
+        self.finished = OrderedDict()
+        self.total_bytes = 0
+
+    def load(self, sid):
+        """
+        :param sid: the id of the client whose game to load
+        :return: the game and its version, or (None, None) if the client has no game
+        """
+        entry = self.games.get(sid)
+        if entry is None:
+            return None, None
+        entry[3] = time.monotonic()
+        self.games.move_to_end(sid)
+        if sid in self.finished:
+            self.finished.move_to_end(sid)
+        return entry[0], entry[1]
+
+    def save(self, sid, game, version=None):
+        """
+        Stores a game, then evicts the least recently used games past the store's limits.
+        :param sid: the id of the client playing the game
+        :param game: the game to store
+        :param version: the version the game was loaded at, None to store a new game in place
+        of any game the client has
+        :return: the new version of the game
+        """
+        entry = self.games.get(sid)
+        stored = entry[1] if entry is not None else 0
+        if version is not None and version != stored:
+            raise StaleGameError(sid)
+        self.delete(sid)
+        size = game_size(game) if self.max_bytes else 0
+        self.games[sid] = [game, stored + 1, size, time.monotonic()]
+        self.total_bytes += size
+        if is_finished(game):
+            self.finished[sid] = None
+        # The game just saved is kept even if it is over the limits on its own
+        while len(self.games) > 1 and (
+                (self.max_games and len(self.games) > self.max_games)
+                or (self.max_bytes and self.total_bytes > self.max_bytes)):
+            oldest = next(iter(self.games))
+            self.delete(oldest)
+            self.record_eviction(oldest, CAPACITY)
+        return stored + 1
+
+    def delete(self, sid):
+        """
+        :param sid: the id of the client whose game to remove, if they have one
+        :return: whether the client had a game
+        """
+        entry = self.games.pop(sid, None)
+        if entry is None:
+            return False
+        self.total_bytes -= entry[2]
+        self.finished.pop(sid, None)
+        return True
+
+    def sweep(self):
+        """
+        Evicts the games that have gone unused for longer than the store's TTLs.
+        :return: the clients whose games were evicted since the last sweep
+        """
+        now = time.monotonic()
+        for sids, ttl, reason in ((self.finished, self.finished_ttl, FINISHED),
+                                  (self.games, self.ttl, IDLE)):
+            while ttl is not None and sids:
+                oldest = next(iter(sids))
+                if self.games[oldest][3] > now - ttl:
+                    break
+                self.delete(oldest)
+                self.record_eviction(oldest, reason)
+        return self.take_evicted()
+
+    def items(self):
+        """
+        :return: list of (sid, game) of every stored game, without counting as using them
+        """
+        return [(sid, entry[0]) for sid, entry in self.games.items()]
+
+    def stats(self):
+        """
+        :return: dict of the number of games stored, their total size if it is measured and the
+        evictions by reason
+        """
+        return {'games': len(self.games), 'bytes': self.total_bytes,
+                'evictions': dict(self.evictions)}
+
+    def __len__(self):
+        return len(self.games)
+
+
+class SQLiteStore(GameStore):
+    """
+    Keeps pickled games in a SQLite file, which can be shared by the server processes of a host.
+    The limits apply to all the games in the file, and each process counts the evictions it
+    makes.
+    """
+    def __init__(self, path, timeout=10, **limits):
+        """
+        :param path: the SQLite file, created if it doesn't exist
+        :param timeout: seconds to wait for another process's write to finish
+        :param limits: the eviction limits, see GameStore
+        """
+        super().__init__(**limits)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS games (sid TEXT PRIMARY KEY, '
+                                'version INTEGER NOT NULL, game BLOB NOT NULL, '
+                                'used REAL NOT NULL, finished INTEGER NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS games_used ON games (used)')
+
+    def load(self, sid):
+        """
+        :param sid: the id of the client whose game to load
+        :return: the game and its version, or (None, None) if the client has no game
+        """
+        row = self.connection.execute('SELECT game, version FROM games WHERE sid = ?',
+                                      (sid,)).fetchone()
+        if row is None:
+            return None, None
+        self.connection.execute('UPDATE games SET used = ? WHERE sid = ?', (time.time(), sid))
+        return pickle.loads(row[0]), row[1]
+
+    def save(self, sid, game, version=None):
+        """
+        Stores a game, then evicts the least recently used games past the store's limits.
+        :param sid: the id of the client playing the game
+        :param game: the game to store
+        :param version: the version the game was loaded at, None to store a new game in place
+        of any game the client has
+        :return: the new version of the game
+        """
+        data = pickle.dumps(game, pickle.HIGHEST_PROTOCOL)
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute('SELECT version FROM games WHERE sid = ?',
+                                          (sid,)).fetchone()
+            stored = row[0] if row is not None else 0
+            if version is not None and version != stored:
+                raise StaleGameError(sid)
+            self.connection.execute('INSERT OR REPLACE INTO games (sid, version, game, used, '
+                                    'finished) VALUES (?, ?, ?, ?, ?)',
+                                    (sid, stored + 1, data, time.time(), is_finished(game)))
+            if self.max_games or self.max_bytes:
+                self.trim(sid, len(data))
+        return stored + 1
+
+    def trim(self, keep, size):
+        """
+        Evicts the least recently used games past the store's limits, inside the transaction of
+        a save.
+        :param keep: the id of the client whose game was just saved, which is kept
+        :param size: the size of the game just saved
+        """
+        games, total = 1, size
+        for sid, size in self.connection.execute('SELECT sid, length(game) FROM games '
+                                                 'WHERE sid != ? ORDER BY used DESC',
+                                                 (keep,)).fetchall():
+            if ((self.max_games and games + 1 > self.max_games)
+                    or (self.max_bytes and total + size > self.max_bytes)):
+                self.connection.execute('DELETE FROM games WHERE sid = ?', (sid,))
+                self.record_eviction(sid, CAPACITY)
+            else:
+                games += 1
+                total += size
+
+    def delete(self, sid):
+        """
+        :param sid: the id of the client whose game to remove, if they have one
+        :return: whether the client had a game
+        """
+        with self.connection:
+            return self.connection.execute('DELETE FROM games WHERE sid = ?',
+                                           (sid,)).rowcount > 0
+
+    def sweep(self):
+        """
+        Evicts the games that have gone unused for longer than the store's TTLs.
+        :return: the clients whose games were evicted since the last sweep
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            for condition, ttl, reason in (('finished AND used <= ?', self.finished_ttl, FINISHED),
+                                           ('used <= ?', self.ttl, IDLE)):
+                if ttl is None:
+                    continue
+                sids = [row[0] for row in self.connection.execute(
+                    'SELECT sid FROM games WHERE ' + condition, (now - ttl,))]
+                self.connection.execute('DELETE FROM games WHERE ' + condition, (now - ttl,))
+                for sid in sids:
+                    self.record_eviction(sid, reason)
+        return self.take_evicted()
+
+    def items(self):
+        """
+        :return: list of (sid, game) of every stored game, without counting as using them
+        """
+        return [(sid, pickle.loads(data))
+                for sid, data in self.connection.execute('SELECT sid, game FROM games')]
+
+    def stats(self):
+        """
+        :return: dict of the number of games stored, their total size and the evictions this
+        process made by reason
+        """
+        games, size = self.connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(length(game)), 0) FROM games').fetchone()
+        return {'games': games, 'bytes': size, 'evictions': dict(self.evictions)}
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+
+def open_store(path=None, **limits):
+    """
+    :param path: the SQLite file to keep the games in, or None to keep them in memory
+    :param limits: the eviction limits, see GameStore
+    :return: the game store
+    """
+    if path:
+        return SQLiteStore(path, **limits)
+    return MemoryStore(**limits)
@@ -0,0 +1,83 @@
+"""
+Code for running the decisions of AI players in worker processes.
+
+A search can take seconds of CPU, and the server handles every game on one event loop, so it
+sends each bid and card play of an AI player to a process pool instead. The player and the
+game state are pickled together, the method runs on the copy in the worker, and the copy comes
+back along with the result so the player in the server carries on from where the copy left off.
+Players without a __getstate__ of their own are sent as they are. PlayerMCTS leaves its search
+tree behind, so it does not reuse the tree between moves when it runs in a pool, and STSPlayer
+leaves its cache behind.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+class DecisionLog:
+    """
+    Stands in for a player's telemetry collector in the worker and keeps the decisions, so they
+    can be recorded by the real collector in the server.
+    """
+    def __init__(self):
+        self.decisions = []
+
+    def record(self, decision):
+        """
+        :param decision: dict describing the decision, see SearchStats
+        """
+        self.decisions.append(decision)
+
+
+def remote_decision(args):
+    """
+    Runs one decision, the task each worker runs.
+    :param args: the player, the name of the method to call and its arguments
+    :return: the result, the player after the call, and the decisions it recorded
+    """
+    player, method, call_args = args
+    log = None
+    if getattr(player, 'stats', None) is not None:
+        log = player.stats = DecisionLog()
+    result = getattr(player, method)(*call_args)
+    return result, player, log.decisions if log is not None else []
+
+
+class DecisionPool:
+    """
+    Process pool for AI decisions.
+    """
+    def __init__(self, workers=None):
+        """
+        :param workers: the number of worker processes, defaults to the number of CPUs
+        """
+        # Workers are started fresh rather than forked, as a forked worker would inherit the
+        # server's sockets and event loop
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, player, method, *args):
+        """
+        Starts a decision in a worker process.
+        :param player: the AI player making the decision
+        :param method: the name of the method of the player to call, e.g. 'play_card'
+        :param args: the arguments of the method
+        :return: a Future of the worker's result, to be given to finish
+        """
+        return self.executor.submit(remote_decision, (player, method, args))
+
+    @staticmethod
+    def finish(player, future):
+        """
+        Brings the player up to date with its copy in the worker. Its telemetry collector is
+        kept and the decisions made in the worker are recorded in it.
+        :param player: the player that made the decision
+        :param future: the finished Future from submit
+        :return: the result of the decision
+        """
+        result, remote, decisions = future.result()
+        stats = getattr(player, 'stats', None)
+        player.__dict__.update(remote.__dict__)
+        if stats is not None:
+            player.stats = stats
+            for decision in decisions:
+                stats.record(decision)
+        return result
@@ -5,9 +5,38 @@ This class contains the logic for playing a round of Oh Hell. The state object c
 information about the current state of the game. The play function plays a round of the game.
 """
 
+from collections import namedtuple
+
 import pydealer
+
+import Cards
+import GameLog
 from GameState import GameState
 
+# Phases of a round, see OhHell.advance
+DEAL = 'deal'
+BID = 'bid'
+TRICKS = 'tricks'
+TRICK_END = 'trick_end'
+
+# Something the game needs a client to answer before it can go on. The player is the human who
+# has to act, or None when any client can answer.
+Request = namedtuple('Request', ['event', 'data', 'player'], defaults=[None])
+
+
+def no_input(*args):
+    """
+    Default ask and inform of a game, which doesn't talk to anyone.
+    """
+    return None
+
+
+def call_method(player, method, *args):
+    """
+    Default decide of a game, which calls the player's method directly.
+    """
+    return getattr(player, method)(*args)
+
 
 class OhHell:
     '''
@@ -15,7 +44,8 @@ class OhHell:
     '''
     total_cards = 52
 
-    def __init__(self, players, max_hand=None, ask=lambda *args: None, inform=lambda *args: None):
+    def __init__(self, players, max_hand=None, ask=no_input, inform=no_input, decide=None,
+                 state=None, trick_ack=True, log=None):
         """
         Creates an instance of the game.
         :param players: List of players that are going to play the game
@@ -23,17 +53,82 @@ class OhHell:
         possible will be played
         :param ask: function to get input from a user
         :param inform: function to provide output to a suer
+        :param decide: function called as decide(player, method, *args) to get a bid or card from
+        an AI player, e.g. to run the decision in another process. If None, the player's method
+        is called directly.
+        :param state: the GameState of a game to carry on, e.g. one decoded by GameCodec. If
+        None, a new game is started.
+        :param trick_ack: whether human players are asked to acknowledge the winner of each
+        trick. If not, the winner is sent like any other event.
+        :param log: GameLog to record the deals, bids, card plays, trick winners and scores of
+        the game to, or None
         """
         self.ask = ask
         self.inform = inform
-        self.state = GameState(players, max_hand)
+        self.decide = decide or call_method
+        self.state = state or GameState(players, max_hand)
         self.players = players
+        # Where the round stopped, so it can be carried on by step
+        self.phase = DEAL
+        self.bids_made = 0
+        self.current_player = None
+        self.trick_ack = trick_ack
+        # Number of events produced by step so far, the sequence number of the next one
+        self.events_sent = 0
+        self.log = log
 
     def play(self):
         """
-        Play a round of Oh, Hell. This function performs one round of the card game.
+        Play a round of Oh, Hell. This function performs one round of the card game, asking for
+        the moves of human players with ask and sending every event to inform as it happens.
         """
+        request = self.advance()
+        while request is not None:
+            request = self.advance(self.ask(request.event, request.data))
 
+    def step(self, answer=None):
+        """
+        Plays the round until it needs an answer from a client, or until the round is over. The
+        game can be kept as it is between steps, without a thread waiting on the client.
+        :param answer: the answer to the request returned by the previous step, None to start a
+        round
+        :return: the Request waiting for an answer, or None once the round is over, and the list
+        of (event, data) produced by this step. The first event's sequence number is
+        events_sent before the step.
+        """
+        events = []
+        inform = self.inform
+        self.inform = lambda event, data=None: events.append((event, data))
+        try:
+            request = self.advance(answer)
+        finally:
+            self.inform = inform
+            self.events_sent += len(events)
+        return request, events
+
+    def advance(self, answer=None):
+        """
+        Plays the round from where it stopped until it has to wait for a client.
+        :param answer: the answer to the last request, if it stopped on one
+        :return: the Request waiting for an answer, or None once the round is over
+        """
+        if self.phase == DEAL:
+            self.deal()
+        if self.phase == BID:
+            request = self.collect_bids(answer)
+            if request is not None:
+                return request
+            answer = None
+        if self.phase in (TRICKS, TRICK_END):
+            request = self.play_tricks(answer)
+            if request is not None:
+                return request
+        return None
+
+    def deal(self):
+        """
+        Starts a round by dealing the hands and turning up the trump card.
+        """
         curr_hand_size, dealer = self.state.begin_round()
 
         # Output dealer
@@ -42,66 +137,144 @@ class OhHell:
         deck = pydealer.Deck()
         deck.shuffle()
 
-        # Deal hand
+        # Deal hand, and forget the cards seen last round
         for player in self.players:
-            player.hand += deck.deal(curr_hand_size)
+            player.hand |= Cards.from_stack(deck.deal(curr_hand_size))
+            player.cards_observed = []
 
         # Output player hands
         self.display_hands(self.players)
 
         # Set trump card
-        trump_card = deck.deal(1)[0]
+        trump_card = Cards.from_pydealer(deck.deal(1)[0])
 
         self.state.set_trump_suit(trump_card)
 
+        if self.log is not None:
+            for player in self.players:
+                self.log.record(self.state, GameLog.DEAL, player, player.hand)
+            self.log.record(self.state, GameLog.TRUMP, value=trump_card)
+
         # Output trump card
         self.display_trump(trump_card)
+        self.phase = BID
+        self.bids_made = 0
 
-        # Collect bids
-        for player in self.state.get_bid_order():
+    def collect_bids(self, answer=None):
+        """
+        Collects the bids of the players in order.
+        :param answer: the bid of the human player being waited on. Anything but a number of
+        tricks from 0 to the hand size is asked for again, without changing the game.
+        :return: the Request for a human player's bid, or None once everyone has bid
+        """
+        bid_order = self.state.get_bid_order()
+        while self.bids_made < len(bid_order):
+            player = bid_order[self.bids_made]
             if not player.is_ai:
-                bid = self.ask('bid_request', {player.name: bid for (player, bid) in
-                                               self.state.bids.items()})
+                if not self.valid_bid(answer):
+                    # No answer yet, or not a bid, ask again
+                    return Request('bid_request', {player.name: bid for (player, bid) in
+                                                   self.state.bids.items()}, player)
+                bid, answer = answer, None
             else:
-                bid = player.make_bid(self.state, player is dealer)
+                bid = self.decide(player, 'make_bid', self.state, player is self.state.dealer)
 
+            # The record is packed first, so a bid it can't hold fails before the state changes
+            record = None
+            if self.log is not None:
+                record = self.log.pack(self.state, GameLog.BID, player, bid)
             self.state.collect_bid(player, bid)
+            self.bids_made += 1
+            if record is not None:
+                self.log.write(record)
 
         # Output current bids
         self.display_bids(self.state.bids)
+        self.phase = TRICKS
+        self.current_player = None
+        return None
 
-        # Play tricks in round
-        for i in range(curr_hand_size):
-            # Single trick
-            current_player = self.state.get_next_player()
-            p_count = 0
-            while current_player is not None:
-                if not current_player.is_ai:
-                    card = self.ask('card_request', {
-                        'hand': [str(c) for c in current_player.hand],
-                        'plays': {player.name: str(card) for (player, card) in
-                                  self.state.trick_cards.items()}
-                    })
-                    card = current_player.hand.get(card)[0]
-                else:
-                    card = current_player.play_card(self.state)
-
-                # Check if first player to display leading suit
-
-                self.state = self.state.play_card(current_player, card)
-                if p_count == 0:
-                    self.display_leading_suit(card.suit)
-
-                # Display card played
-                self.display_card_played(current_player, card)
-
-                current_player = self.state.get_next_player()
-                p_count += 1
-            p_count = 0
-            trick_winner = self.state.finish_trick()
+    def valid_bid(self, bid):
+        """
+        :param bid: the answer of a human player to a bid request
+        :return: whether it is a number of tricks from 0 to the hand size
+        """
+        return type(bid) is int and 0 <= bid <= self.state.curr_hand_size
 
-            # Output winner
-            self.display_trick_winner(trick_winner)
+    def card_answer(self, player, answer):
+        """
+        :param player: the human player whose card is being waited on
+        :param answer: the player's answer to a card request
+        :return: the card named by the answer, or None if it isn't the name of a card the player
+        can play, one in their hand that follows suit if they are able to
+        """
+        card = Cards.CARD_IDS.get(answer) if isinstance(answer, str) else None
+        if card is None:
+            return None
+        if not Cards.legal_moves(player.hand, self.state.leading_suit) & Cards.bit(card):
+            return None
+        return card
+
+    def play_tricks(self, answer=None):
+        """
+        Plays the tricks of the round in order, then scores the round.
+        :param answer: the card name of the human player being waited on, or anything once a
+        human has seen the winner of a trick. A card that can't be played is asked for again,
+        without changing the game.
+        :return: the Request for a human player's card or acknowledgement, or None once the
+        round is over
+        """
+        while True:
+            if self.phase == TRICK_END:
+                # The winner has been seen, start the next trick
+                self.phase = TRICKS
+                answer = None
+                if self.state.curr_trick >= self.state.curr_hand_size:
+                    break
+            if self.current_player is None:
+                self.current_player = self.state.get_next_player()
+            current_player = self.current_player
+            if current_player is None:
+                if self.log is not None:
+                    # Every player has played, so the next player is the winner
+                    self.log.record(self.state, GameLog.TRICK, self.state.peek_next_player())
+                trick_winner = self.state.finish_trick()
+
+                # Output winner
+                self.phase = TRICK_END
+                request = self.display_trick_winner(trick_winner)
+                if request is not None:
+                    return request
+                continue
+
+            if not current_player.is_ai:
+                card, answer = self.card_answer(current_player, answer), None
+                if card is None:
+                    # No answer yet, or not a card the player can play, ask again
+                    return Request('card_request', {
+                        'hand': [Cards.card_name(c) for c in Cards.cards(current_player.hand)],
+                        'plays': {player.name: Cards.card_name(card) for (player, card) in
+                                  self.state.trick_cards.items()}
+                    }, current_player)
+                current_player.hand &= ~Cards.bit(card)
+            else:
+                card = self.decide(current_player, 'play_card', self.state)
+
+            record = None
+            if self.log is not None:
+                record = self.log.pack(self.state, GameLog.PLAY, current_player, card)
+            self.state.apply_move(current_player, card)
+            if record is not None:
+                self.log.write(record)
+            for player in self.players:
+                player.observe((current_player, card))
+            # Check if first player to display leading suit
+            if len(self.state.trick_cards) == 1:
+                self.display_leading_suit(Cards.suit_of(card))
+
+            # Display card played
+            self.display_card_played(current_player, card)
+            self.current_player = None
 
         tracker_data = self.state.calculate_scores()
 
@@ -109,10 +282,17 @@ class OhHell:
         self.display_round_info(tracker_data)
 
         scoreboard = self.state.get_scoreboard(self.players)
+        if self.log is not None:
+            for player, score_row in zip(self.players, scoreboard):
+                self.log.record(self.state, GameLog.SCORE, player,
+                                int(score_row[self.state.curr_round]))
+            self.log.flush()
         self.display_scoreboard(self.players, scoreboard, self.state.curr_round)
 
         # Shift dealer one over and set up for next round
         self.players = self.state.finish_round()
+        self.phase = DEAL
+        return None
 
     def display_dealer(self, dealer):
         """
@@ -131,7 +311,7 @@ class OhHell:
         """
         hands = {}
         for player in players:
-            hands[player.name] = [str(c) for c in player.hand]
+            hands[player.name] = [Cards.card_name(c) for c in Cards.cards(player.hand)]
         self.inform('hands', hands)
 
     def display_trump(self, trump_card):
@@ -139,7 +319,7 @@ class OhHell:
         Displays the trump card to the user
         :param trump_card: the trump card for the current round
         """
-        self.inform('trump', str(trump_card))
+        self.inform('trump', Cards.card_name(trump_card))
 
     def display_bids(self, bids):
         """
@@ -151,9 +331,9 @@ class OhHell:
     def display_leading_suit(self, suit):
         """
         Displays the leading suit for the current trick.
-        :param suit:
+        :param suit: index of the suit that was lead
         """
-        self.inform('lead_suit', suit)
+        self.inform('lead_suit', Cards.suit_name(suit))
 
     def display_card_played(self, player, card):
         """
@@ -161,17 +341,19 @@ class OhHell:
         :param player: player who played the card
         :param card: card played by the player
         """
-        self.inform('play', {'player': player.name, 'card': str(card) })
+        self.inform('play', {'player': player.name, 'card': Cards.card_name(card) })
 
     def display_trick_winner(self, player):
         """
-        Display the player who won the track
+        Display the player who won the track. Human players are asked to acknowledge it, unless
+        trick_ack is off.
         :param player: the player who won the current trick
+        :return: the Request to acknowledge the winner when there are human players
         """
-        if any([not player.is_ai for player in self.players]):
-            self.ask('trick_winner', player.name)
-        else:
-            self.inform('trick_winner', player.name)
+        if self.trick_ack and any([not player.is_ai for player in self.players]):
+            return Request('trick_winner', player.name)
+        self.inform('trick_winner', player.name)
+        return None
 
     def display_round_info(self, tracker_output):
         """
@@ -1,9 +1,10 @@
 """
 Code for implementing simple random agent to play the game of Oh, Hell
 """
-import pydealer
 import random
 
+import Cards
+
 
 class Player:
     """
@@ -17,7 +18,7 @@ class Player:
         :param is_ai: flag for whether or not this is an AI or a human player
         """
         self.scale_fact = 3
-        self.hand = pydealer.Stack()
+        self.hand = 0
         self.name = name
         self.cards_observed = []
         self.is_ai = is_ai
@@ -30,7 +31,7 @@ class Player:
         :return: the bid the user is making.
         """
         self.cards_observed = []
-        size = len(self.hand) + 1
+        size = Cards.count(self.hand) + 1
         bid_dist = [size-i-1 for i in range(size) for j in range(self.scale_fact*i+1)]
         if is_dealer:
             num_tricks = state.curr_hand_size
@@ -50,19 +51,15 @@ class Player:
         trick
         :return: the card the agent selected to play.
         """
-        if leading_suit:
-            poss_cards = [card for i, card in enumerate(self.hand) if i in self.hand.find_list([leading_suit])]
-            if len(poss_cards) == 0:
-                poss_cards = self.hand
-        else:
-            poss_cards = self.hand
-        card_str = str(random.sample(list(poss_cards), 1)[0])
-        card_to_play = self.hand.get(card_str)[0]
+        poss_cards = Cards.legal_moves(self.hand, leading_suit)
+        card_to_play = Cards.random_card(poss_cards)
+        self.hand &= ~Cards.bit(card_to_play)
         return card_to_play
     
     def observe(self, cards_played):
         """
         Record cards played during round
+        :param cards_played: the player and the card they played
         """
         self.cards_observed.append(cards_played)
 
@@ -3,14 +3,22 @@ Code for implementing the AI agent using Monte Carlo tree search (MCTS).
 
 The MCTS is used for deciding the best card to play given the current state.
 """
-import copy
+import math
+import multiprocessing
 import random
 import time
 
-import pydealer
 import numpy as np
 
+import Cards
+from BatchRollout import batch_rollout
+from BidTable import table_bid
+from Endgame import endgame_move
 from Player import Player
+from SearchStats import PHASES
+
+# Number of iterations between checks of whether the search can stop early
+SETTLED_CHECK = 32
 
 
 class PlayerMCTS(Player):
@@ -18,30 +26,196 @@ class PlayerMCTS(Player):
     Inherits from the Player class. Changes the logic for selecting and playing a
     card.
     """
-    def __init__(self, name, search_time=3):
+    def __init__(self, name, search_time=3, rollouts=1, workers=1, iterations=None,
+                 time_manager=None, stats=None, endgame_cards=4, endgame_samples=30,
+                 bid_table=True):
         """
         Constructs an instance of the PlayerMCTS.
         :param name: The name of the agent.
         :param search_time: The amount of time the agent is allowed to search for a future state.
+        :param rollouts: The number of random playouts to run at once from each new node. More
+        than one uses the batched NumPy rollouts.
+        :param workers: The number of processes to search with. More than one builds an
+        independent tree in each worker process and merges the results at the root.
+        :param iterations: If given, each search runs this many iterations instead of running
+        for search_time, so results do not depend on the speed of the machine.
+        :param time_manager: If given, a TimeManager that decides how long each search runs
+        from a bank of time, in place of search_time.
+        :param stats: If given, a collector whose record method is called with the telemetry of
+        each decision, see SearchStats. Nothing is measured without one.
+        :param endgame_cards: Once the agent holds this many cards or fewer, it picks its card
+        by solving sampled deals exactly instead of searching, see Endgame. 0 never does.
+        :param endgame_samples: The number of deals to solve in the endgame.
+        :param bid_table: Whether to bid from the precomputed bid table, see BidTable. Without
+        it, or for games the table doesn't cover, the agent bids as a random Player does.
         """
         super().__init__(name, is_ai=True)
         self.search_time = search_time
+        self.rollouts = rollouts
+        self.workers = workers
+        self.iterations = iterations
+        self.time_manager = time_manager
+        self.stats = stats
+        self.endgame_cards = endgame_cards
+        self.endgame_samples = endgame_samples
+        self.bid_table = bid_table
+        # Tree kept from the last move of the round, with the round it belongs to and how many
+        # plays had been observed when it was searched
+        self.tree = None
+        self.tree_round = None
+        self.tree_observed = 0
+
+    def make_bid(self, state, is_dealer):
+        """
+        Bids the number of tricks the hand most often takes according to the bid table, which
+        costs no search time.
+        :param state: the game state
+        :param is_dealer: whether the player is the dealer and has an extra restriction on bids.
+        :return: the bid the agent is making.
+        """
+        bid = table_bid(state, self, is_dealer) if self.bid_table else None
+        if bid is None:
+            return super().make_bid(state, is_dealer)
+        self.cards_observed = []
+        return bid
 
     def play_card(self, state, leading_suit=None):
         """
-        Uses MCTS to pick best move to make.
+        Uses MCTS to pick best move to make. A card that is the only legal move is played
+        without searching, and the last few cards are picked by the endgame solver. When
+        searching in this process, the tree is kept for the player's next move of the round.
         :param state: The GameState representing the current state of the game
         :param leading_suit: If a leading suit was used, give information for it. Not used for
         this method, follows inheritance.
         :return: card to be played
         """
-        mcts = MonteCarloTreeSearch(copy.copy(self.hand), state.copy_state(), self)
-        mcts.search(max_search_time=self.search_time)
-        card = mcts.next_move()
-        card = self.hand.get(str(card))[0]
+        legal = Cards.legal_moves(self.hand, state.leading_suit)
+        num_moves = Cards.count(legal)
+        search_time = self.search_time
+        if self.time_manager is not None:
+            search_time = self.time_manager.budget(state, self.hand, num_moves)
+
+        start_time = time.time()
+        endgame = Cards.count(self.hand) <= self.endgame_cards
+        decision = None if self.stats is None else {'forced': num_moves == 1, 'endgame': endgame}
+        if num_moves == 1:
+            card = Cards.cards(legal)[0]
+            self.tree = None
+        elif endgame:
+            card = endgame_move(state, self, self.hand, self.endgame_samples)
+            self.tree = None
+        elif self.workers > 1:
+            card = self.parallel_search(state, search_time, decision)
+        else:
+            card = self.serial_search(state, search_time, decision)
+        elapsed = time.time() - start_time
+        if self.time_manager is not None:
+            self.time_manager.spend(elapsed)
+        if decision is not None:
+            decision['decision_time'] = elapsed
+            self.stats.record(decision)
+        self.hand &= ~Cards.bit(card)
 
         return card
 
+    def serial_search(self, state, search_time, decision=None):
+        """
+        Searches in this process, carrying on from the last move's tree when it can, and keeps
+        the tree for the player's next move of the round.
+        :param state: The GameState representing the current state of the game
+        :param search_time: the time to search for, unless searching for a number of iterations
+        :param decision: dict to add the telemetry of the search to, or None
+        :return: the best card to play
+        """
+        mcts = self.reuse_tree(state)
+        if mcts is None:
+            mcts = MonteCarloTreeSearch(self.hand, state.copy_state(), self,
+                                        rollouts=self.rollouts)
+        phase_times = None if decision is None else {phase: 0 for phase in PHASES}
+        start_time = time.time()
+        start_playouts = mcts.root.n
+        if self.iterations is not None:
+            _, searches = mcts.search(max_iterations=self.iterations, phase_times=phase_times)
+        elif self.time_manager is None:
+            _, searches = mcts.search(max_search_time=search_time, phase_times=phase_times)
+        else:
+            _, searches = mcts.search(max_search_time=search_time, stop_early=True,
+                                      phase_times=phase_times)
+            if mcts.is_close(self.time_manager.close_ratio):
+                _, extra = mcts.search(max_search_time=self.time_manager.extra(search_time),
+                                       stop_early=True, phase_times=phase_times)
+                searches += extra
+        if decision is not None:
+            decision.update(search_stats(mcts.root.children, searches,
+                                         mcts.root.n - start_playouts, time.time() - start_time))
+            decision['phase_times'] = phase_times
+            decision['nodes'], decision['max_depth'], decision['mean_depth'] = mcts.tree_shape()
+        card = mcts.next_move()
+        self.tree = mcts
+        self.tree_round = state.curr_round
+        self.tree_observed = len(self.cards_observed)
+        return card
+
+    def reuse_tree(self, state):
+        """
+        Finds the node of the last move's tree that matches the current state, by following the
+        cards observed since then, and makes it the root of the search. Cards the search never
+        expanded, such as the other players' moves left out by the cap on their branching, are
+        added to the tree as they are followed.
+        :param state: The GameState representing the current state of the game
+        :return: the search rooted at the current state, or None if the tree can't be reused
+        """
+        mcts = self.tree
+        self.tree = None
+        if (mcts is None or self.tree_round != state.curr_round
+                or len(self.cards_observed) < self.tree_observed):
+            return None
+        node = mcts.root
+        for _, card in self.cards_observed[self.tree_observed:]:
+            child = next((child for child in node.children if child.action == card), None)
+            if child is None:
+                if node.state.terminal_state() or node.state.discard & Cards.bit(card):
+                    return None
+                node.untried &= ~Cards.bit(card)
+                child = mcts.add_child(node, card)
+            node = child
+        if node is mcts.root or node.hand != self.hand or node.state.discard != state.discard:
+            return None
+        mcts.reroot(node)
+        return mcts
+
+    def __getstate__(self):
+        """
+        Leaves the kept tree out when the player is sent to worker processes.
+        :return: the state to pickle
+        """
+        player_state = self.__dict__.copy()
+        player_state['tree'] = None
+        return player_state
+
+    def parallel_search(self, state, search_time, decision=None):
+        """
+        Root-parallel MCTS. Each worker process searches its own tree from the current state with
+        a different seed, and the visit and win counts of the root's children are added up
+        before picking the move. With an iteration budget, each worker runs that many
+        iterations.
+        :param state: The GameState representing the current state of the game
+        :param search_time: the time each worker searches for
+        :param decision: dict to add the telemetry of the search to, or None
+        :return: the best card to play
+        """
+        seed = random.getrandbits(32)
+        tasks = [(self.hand, state, self, search_time, self.iterations, self.rollouts, seed + i)
+                 for i in range(self.workers)]
+        start_time = time.time()
+        results = get_pool(self.workers).map(root_search, tasks)
+        child_stats = merge_root_stats([child_stats for child_stats, _ in results])
+        if decision is not None:
+            playouts = sum(n for _, _, n in child_stats)
+            searches = sum(searches for _, searches in results)
+            decision.update(search_stats(child_stats, searches, playouts, time.time() - start_time))
+        return best_action(child_stats)
+
 
 class Node:
     """
@@ -53,7 +227,7 @@ class Node:
 
         W is the variable to track number of wins node is involved in and N is to keep track of
         the number of simulations the node is involved in.
-        :param hand: the player's hand at the given node
+        :param hand: the player's hand at the given node, as a card mask
         :param state: the state at the current node
         :param my_turn: whether or not it is the player's turn
         :param action: the action that transitioned from parent to this node.
@@ -65,6 +239,9 @@ class Node:
         self.n = 0
         self.action = action
         self.my_turn = my_turn
+        # Moves that can still be expanded from this node, set up by the search
+        self.untried = 0
+        self.max_children = 0
         if self.parent is None:
             self.depth = 0
 
@@ -72,7 +249,7 @@ class Node:
             self.parent.children.append(self)
             self.depth = self.parent.depth + 1
 
-        self.hand = copy.copy(hand)
+        self.hand = hand
         self.state = state
 
     def UCT(self, c=None):
@@ -88,13 +265,13 @@ class Node:
         Error when parent is null i.e. root node.
         """
         if self.w == 0 and self.n == 0:
-            return np.inf
+            return math.inf
         if c is None:
-            c = np.sqrt(2)
+            c = math.sqrt(2)
         if self.parent is None:
-            return np.nan
+            return math.nan
         exploitation = self.w / self.n
-        exploration = c * np.sqrt(np.log(self.parent.n) / self.n)
+        exploration = c * math.sqrt(math.log(self.parent.n) / self.n)
         return exploitation + exploration
 
     def __str__(self):
@@ -104,7 +281,8 @@ class Node:
         """
         s = 'W: {}, N: {}, UCT: {}\n'.format(self.w, self.n, self.UCT())
         s += 'Depth: {}, Action: {}, Hand: [{}]'.format(self.depth, self.action,
-                                                        ', '.join([str(c) for c in self.hand]))
+                                                        ', '.join(Cards.card_name(c) for c in
+                                                                  Cards.cards(self.hand)))
         return s
 
     def __repr__(self):
@@ -117,249 +295,457 @@ class Node:
 def random_select(hand, state):
     """
     Logic for randomly selecting a card given the hand and state
-    :param hand: the cards the player current has
+    :param hand: the cards the player current has, as a card mask
     :param state: the current GameState
-    :return: the card to play and the altered hand.
+    :return: the card to play and the hand without that card.
+    """
+    poss_cards = Cards.legal_moves(hand, state.leading_suit)
+    card_to_play = Cards.random_card(poss_cards)
+    return card_to_play, hand & ~Cards.bit(card_to_play)
+
+
+def node_moves(state, hand, player):
+    """
+    Works out the moves a search can expand from a state. The player's own moves are every
+    legal card in their hand. The other players' moves are sampled from the legal cards still
+    unseen, capped at the size of the player's hand to keep the tree from growing too wide.
+    States where the player has no cards left, or the round is over, are leaves.
+    :param state: the state at the node
+    :param hand: the player's hand mask at the node
+    :param player: the player running the search
+    :return: the mask of moves, the maximum number of children to expand, and whether the next
+    move is the player's
+    """
+    if not hand or state.terminal_state():
+        return 0, 0, False
+    next_player = state.peek_next_player()
+    leading_suit = state.leading_suit if state.player_turn < state.num_players else None
+    if next_player is player:
+        moves = Cards.legal_moves(hand, leading_suit)
+        return moves, Cards.count(moves), True
+    moves = Cards.legal_moves(available_cards(hand, state.discard), leading_suit)
+    return moves, min(Cards.count(moves), Cards.count(hand)), False
+
+
+def random_rollout(state, hand, player, choose_func=None):
+    """
+    Plays the rest of the round out from a state. The moves are played in place on the state,
+    which is restored before returning. The other players pick from every card still unseen.
+    :param state: the state to play out from
+    :param hand: the player's hand mask
+    :param player: the player running the search
+    :param choose_func: the function used for selecting a card to play
+    :return: whether the player made their bid
+    """
+    if choose_func is None:
+        choose_func = random_select
+    snapshot = state.snapshot()
+    tricks_left = state.curr_hand_size - state.curr_trick
+    for i in range(tricks_left):
+        current_player = state.get_next_player()
+        while current_player is not None:
+
+            if current_player is player:
+                card, hand = choose_func(hand, state)
+            else:
+                cards_avail = available_cards(hand, state.discard)
+                card, _ = choose_func(cards_avail, state)
+            state.apply_move(current_player, card)
+
+            current_player = state.get_next_player()
+        state.finish_trick()
+
+    bid, taken = state.end_trick_info(player)
+    state.restore(snapshot)
+    return bid == taken
+
+
+def best_action(child_stats):
+    """
+    Picks the move with the best win ratio. Falls back to the first move if none has won.
+    :param child_stats: list of (action, w, n) for each child of the root
+    :return: the action of the best move to make.
+    """
+    best_ratio = 0
+    best = child_stats[0][0]
+    for action, w, n in child_stats:
+        if n != 0:
+            ratio = w / n
+            if ratio > best_ratio:
+                best = action
+                best_ratio = ratio
+    return best
+
+
+def merge_root_stats(results):
+    """
+    Adds up the statistics of the root's children from several searches of the same state.
+    :param results: list of the (action, w, n) lists from each search
+    :return: list of (action, w, n) with the totals for each action
+    """
+    totals = {}
+    for child_stats in results:
+        for action, w, n in child_stats:
+            total = totals.setdefault(action, [0, 0])
+            total[0] += w
+            total[1] += n
+    return [(action, w, n) for action, (w, n) in totals.items()]
+
+
+def search_stats(children, searches, playouts, search_time):
+    """
+    Telemetry shared by every kind of search, see SearchStats.
+    :param children: the root's children, as Nodes or (action, w, n) tuples
+    :param searches: the number of iterations run
+    :param playouts: the number of playouts run
+    :param search_time: the seconds the search ran for
+    :return: dict of the telemetry
+    """
+    visits = [(child.action, child.n) if isinstance(child, Node) else (child[0], child[2])
+              for child in children]
+    return {
+        'iterations': searches,
+        'playouts': playouts,
+        'search_time': search_time,
+        'playouts_per_sec': playouts / search_time if search_time else 0,
+        'root_visits': {Cards.card_name(action): n for action, n in visits},
+    }
+
+
+# Process pools for root-parallel search, by number of workers
+_pools = {}
+
+
+def get_pool(workers):
+    """
+    Gets the process pool with the given number of workers, starting it the first time it is
+    needed. Pools are shared by every player searching with the same number of workers and are
+    kept until the program exits.
+    :param workers: number of worker processes
+    :return: the pool
     """
-    if state.leading_suit is not None:
-        poss_cards = [card for i, card in enumerate(hand) if
-                      i in hand.find_list([state.leading_suit])]
-        if len(poss_cards) == 0:
-            poss_cards = hand
-    else:
-        poss_cards = hand
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = multiprocessing.Pool(workers)
+        _pools[workers] = pool
+    return pool
 
-    card_str = str(random.sample(list(poss_cards), 1)[0])
-    card_to_play = hand.get(card_str)[0]
-    return card_to_play, hand
+
+def root_search(args):
+    """
+    Runs one independent search, the task each worker runs in root-parallel mode.
+    :param args: the hand, state, player, search time, iteration budget (or None), rollouts and
+    random seed for the search
+    :return: list of (action, w, n) for each child of the root, and the number of iterations
+    """
+    hand, state, player, search_time, iterations, rollouts, seed = args
+    random.seed(seed)
+    mcts = MonteCarloTreeSearch(hand, state, player, rollouts=rollouts)
+    _, searches = mcts.search(max_search_time=search_time, max_iterations=iterations)
+    return [(child.action, child.w, child.n) for child in mcts.root.children], searches
 
 
 def available_cards(p_hand, cards_out):
     """
-    Creates a deck of all cards that are still out.
-    :param p_hand: player's hand
-    :param cards_out: cards that have already been played
-    :return: deck that has cards that have not been played and are not in the player's hand
+    Creates a mask of all cards that are still out.
+    :param p_hand: player's hand mask
+    :param cards_out: mask of cards that have already been played
+    :return: mask of cards that have not been played and are not in the player's hand
     """
-    new_deck = pydealer.Deck()
-    for card in (p_hand + cards_out):
-        new_deck.get(str(card))
-    return new_deck
+    return Cards.FULL_DECK & ~(p_hand | cards_out)
 
 
 class MonteCarloTreeSearch:
     """
     Implements the Monte Carlo Tree Search (MCTS)for the game Oh, Hell
     """
-    def __init__(self, hand, state, player):
+    def __init__(self, hand, state, player, rollouts=1):
         """
         Creates an instance of the MCTS to find best move to make.
 
         :param hand: the hand of the player
         :param state: the current game state
         :param player: the player who is using this search
+        :param rollouts: number of playouts to run from each new node. When more than one, the
+        playouts are run as a batch with NumPy.
         """
-        self.root = Node(copy.copy(hand), state, my_turn=True)
+        self.root = Node(hand, state, my_turn=True)
         self.player = player
-        self.all_nodes = set()
+        self.rollouts = rollouts
+        self.rng = np.random.default_rng(random.getrandbits(64)) if rollouts > 1 else None
+        # Number of nodes that still have moves to expand
+        self.open_nodes = 0
         # Init children of root
-        for card in hand:
-            cp_hand = copy.deepcopy(hand)
-            card_play = cp_hand.get(str(card))[0]
+        for card in Cards.cards(Cards.legal_moves(hand, state.leading_suit)):
+            cp_hand = hand & ~Cards.bit(card)
             new_state = self.root.state.play_card(self.player, card)
-            child = Node(cp_hand, new_state, my_turn=True, action=card_play, parent=self.root)
-            if len(child.hand) > 0:
-                self.all_nodes.add(child)
+            child = Node(cp_hand, new_state, my_turn=True, action=card, parent=self.root)
+            self.init_moves(child)
+
+    def reroot(self, node):
+        """
+        Makes a node of the tree the new root, dropping everything that is not below it. As for
+        a new search, every legal move at the root is expanded.
+        :param node: the new root, a node where it is the player's turn
+        """
+        node.parent = None
+        self.root = node
+        for card in Cards.cards(node.untried):
+            self.add_child(node, card)
+        node.untried = 0
+        self.open_nodes = 0
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.untried:
+                self.open_nodes += 1
+            stack.extend(current.children)
 
     def next_move(self):
         """
         Simply performs a search over the root's children to find the best move to make.
         :return: the action of the best move to make.
         """
-        best_ratio = 0
-        best_child = self.root.children[0]
-        for child in self.root.children:
-            if child.n != 0:
-                ratio = child.w / child.n
-                if ratio > best_ratio:
-                    best_child = child
-                    best_ratio = ratio
+        return best_action([(child.action, child.w, child.n) for child in self.root.children])
 
-        return best_child.action
-
-    def update_all_nodes(self):
+    def init_moves(self, node):
         """
-        Removes all nodes that are not explorable further.
+        Sets up the moves that can be expanded from a new node, see node_moves.
+        :param node: the newly created node
         """
-        iter_nodes = list(self.all_nodes)
-        for node in iter_nodes:
-            if len(node.hand) == len(node.children):
-                self.all_nodes.remove(node)
+        node.untried, node.max_children, _ = node_moves(node.state, node.hand, self.player)
+        if node.untried:
+            self.open_nodes += 1
 
-    def search(self, choose_func=None, max_search_time=1):
+    def search(self, choose_func=None, max_search_time=1, max_iterations=None, stop_early=False,
+               phase_times=None):
         """
-        Performs the Monte Carlo Tree Search algorithm with a max amount of time allowed.
+        Performs the Monte Carlo Tree Search algorithm with a max amount of time allowed, or a
+        fixed number of iterations. Stops early once every node in the tree has been fully
+        expanded.
         :param choose_func: function for logic to decide what card to play.
         :param max_search_time: the maximum amount of town to run this algorithm.
+        :param max_iterations: if given, the number of iterations to run. The clock is not
+        checked, so the search gives the same result on any machine for the same seed.
+        :param stop_early: whether to stop once the most visited move at the root can no longer
+        be overtaken in the time left, going by the rate of the search so far
+        :param phase_times: if given, dict that the seconds spent in each phase of the search are
+        added to. Phases are only timed when it is given.
         :return: the root node as well as the number of searches performed.
         """
         start_time = time.time()
         searches = 0
-        while time.time() - start_time < max_search_time and len(self.all_nodes) > 0:
-            search_node = self.selection()
-            new_node = self.expansion(search_node, choose_func)
-            end_state = self.simulation(new_node, choose_func)
-            self.backpropogation(end_state, new_node)
-            self.update_all_nodes()
+        while self.open_nodes > 0:
+            if max_iterations is not None:
+                if searches >= max_iterations:
+                    break
+            else:
+                elapsed = time.time() - start_time
+                if elapsed >= max_search_time:
+                    break
+                if stop_early and searches % SETTLED_CHECK == SETTLED_CHECK - 1:
+                    remaining = searches * (max_search_time - elapsed) / elapsed
+                    if self.is_settled(remaining * self.rollouts):
+                        break
+            if phase_times is None:
+                search_node = self.selection()
+                new_node = self.expansion(search_node, choose_func)
+                wins, playouts = self.simulation(new_node, choose_func)
+                self.backpropogation(wins, new_node, playouts)
+            else:
+                self.timed_iteration(choose_func, phase_times)
             searches += 1
         return self.root, searches
 
-    def selection(self):
+    def timed_iteration(self, choose_func, phase_times):
         """
-        Selection logic. Find the best node to explore further. UCT is used as the heuristic
-        function to find the best node.
+        Runs one iteration of the search, adding the time taken by each phase to phase_times.
+        :param choose_func: function for logic to decide what card to play.
+        :param phase_times: dict of the seconds spent in each phase so far
         """
+        t0 = time.perf_counter()
+        search_node = self.selection()
+        t1 = time.perf_counter()
+        new_node = self.expansion(search_node, choose_func)
+        t2 = time.perf_counter()
+        wins, playouts = self.simulation(new_node, choose_func)
+        t3 = time.perf_counter()
+        self.backpropogation(wins, new_node, playouts)
+        t4 = time.perf_counter()
+        phase_times['selection'] += t1 - t0
+        phase_times['expansion'] += t2 - t1
+        phase_times['simulation'] += t3 - t2
+        phase_times['backpropogation'] += t4 - t3
+
+    def tree_shape(self):
+        """
+        :return: the number of nodes in the tree, the depth of its deepest node and the mean
+        depth of the nodes below the root
+        """
+        nodes = 0
+        max_depth = 0
+        depth_total = 0
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            nodes += 1
+            depth_total += depth
+            max_depth = max(max_depth, depth)
+            stack.extend((child, depth + 1) for child in node.children)
+        return nodes, max_depth, depth_total / (nodes - 1) if nodes > 1 else 0
+
+    def visit_order(self):
+        """
+        :return: the root's children, most visited first
+        """
+        return sorted(self.root.children, key=lambda child: child.n, reverse=True)
 
-        leaf_nodes = list(self.all_nodes)
-        if len(leaf_nodes) == 0:
-            return None
-        else:
-            # Select best leaf node
-            best_node = leaf_nodes[0]
-            best_score = best_node.UCT()
-            for poss_node in leaf_nodes[1:]:
-                score = poss_node.UCT()
-                if score > best_score and not poss_node.state.terminal_state():
-                    best_node = poss_node
-                    best_score = score
-            return best_node
+    def is_settled(self, playouts_left):
+        """
+        Checks whether more searching can change the move. That is when the most visited move is
+        the one next_move would pick and no other move can catch up with its visits.
+        :param playouts_left: the number of playouts the search could still run
+        :return: whether the search can stop
+        """
+        children = self.visit_order()
+        if len(children) < 2:
+            return True
+        first, second = children[0], children[1]
+        return first.n - second.n > playouts_left and first.action == self.next_move()
+
+    def is_close(self, close_ratio):
+        """
+        :param close_ratio: visit ratio between the second and the first move counted as close
+        :return: whether the two most visited moves at the root are close
+        """
+        children = self.visit_order()
+        return len(children) > 1 and children[1].n >= close_ratio * children[0].n
+
+    def selection(self):
+        """
+        Selection logic. Descends from the root, taking the child with the best UCT at each
+        level, until it reaches a node that still has moves to expand or a leaf.
+        """
+        node = self.root
+        while not node.untried and node.children:
+            node = max(node.children, key=Node.UCT)
+        return node
 
     def expansion(self, search_node, choose_func=None):
         """
-        Expands the current node by selecting one move to make.
+        Expands the current node by selecting one of its untried moves.
         :param search_node: the node that was selected to be explored.
         :param choose_func: function for choosing cards to play
-        :return: the new node created that is a child of the search node.
+        :return: the new node created that is a child of the search node, or the search node
+        itself if it is a leaf.
         """
         p = search_node
+        if not p.untried:
+            return p
         if choose_func is None:
             choose_func = random_select
 
-        current_state = p.state.copy_state()
-        hand = copy.copy(p.hand)
+        current_state, current_player = self.next_turn(p)
+        card, _ = choose_func(p.untried, current_state)
+        p.untried &= ~Cards.bit(card)
+        if not p.untried or len(p.children) + 1 >= p.max_children:
+            p.untried = 0
+            self.open_nodes -= 1
+
+        return self.add_child(p, card, current_state, current_player)
+
+    def next_turn(self, node):
+        """
+        :param node: a node of the tree
+        :return: a copy of the node's state, with the trick finished if it is complete, and the
+        player whose turn it is in it
+        """
+        current_state = node.state.copy_state()
         current_player = current_state.get_next_player()
-        my_turn = False
 
         # Check if current player is null, means need to start next trick
         if current_player is None:
-            trick_winner = current_state.finish_trick()
+            current_state.finish_trick()
             current_player = current_state.get_next_player()
+        return current_state, current_player
+
+    def add_child(self, parent, card, current_state=None, current_player=None):
+        """
+        Adds the node reached by playing a card from a node to the tree.
+        :param parent: the node to play the card from
+        :param card: the card played by the player whose turn it is at the node
+        :param current_state: the state to play the card on, from next_turn, which is used up.
+        If None, it is worked out from the parent.
+        :param current_player: the player whose turn it is in current_state
+        :return: the new node
+        """
+        if current_state is None:
+            current_state, current_player = self.next_turn(parent)
+        hand = parent.hand
+        my_turn = False
 
         # From current state, expand
         if current_player is self.player:
-            card, hand = choose_func(hand, current_state)
-            if current_state.on_leading_player():
-                leading_suit = current_state.setup_trick(card)
-            current_state = current_state.play_card(self.player, card)
+            hand &= ~Cards.bit(card)
             my_turn = True
 
-        # Trick finished, clean up
-        # Simulate action of other players
-        else:
-            cards_avail = available_cards(hand, current_state.discard)
-            card, _ = choose_func(cards_avail, current_state)
-            if current_state.on_leading_player():
-                leading_suit = current_state.setup_trick(card)
-
-            current_state = current_state.play_card(current_player, card)
+        current_state.apply_move(current_player, card)
 
-        new_node = Node(hand, current_state, my_turn=my_turn, action=card, parent=p)
-        self.all_nodes.add(new_node)
+        new_node = Node(hand, current_state, my_turn=my_turn, action=card, parent=parent)
+        self.init_moves(new_node)
 
         return new_node
 
     def simulation(self, traverse_node, choose_func=None):
         """
-        Runs the simulation of the game until a final state is found
+        Runs the simulation of the game until a final state is found. The moves are played in
+        place on the node's state, which is restored before returning. With more than one
+        rollout and the default choose function, a batch of playouts is run with NumPy instead.
         :param traverse_node: node being traversed until a leaf is found.
         :param choose_func: the function used for selecting a card to play
-        :return: the final state once the terminal state is found.
+        :return: the number of playouts where the player made their bid, and the number of
+        playouts.
         """
-        if choose_func is None:
-            choose_func = random_select
-        current_state = traverse_node.state.copy_state()
-        hand = copy.copy(traverse_node.hand)
-        tricks_left = current_state.curr_hand_size - current_state.curr_trick
-        for i in range(tricks_left):
-            current_player = current_state.get_next_player()
-            while current_player is not None:
-
-                if current_player is self.player:
-                    card, hand = choose_func(copy.copy(hand), current_state)
-                    if current_state.on_leading_player():
-                        leading_suit = current_state.setup_trick(card)
-                    current_state = current_state.play_card(self.player, card)
-                else:
-                    cards_avail = available_cards(hand, current_state.discard)
-                    card, _ = choose_func(cards_avail, current_state)
-                    if current_state.on_leading_player():
-                        leading_suit = current_state.setup_trick(card)
-                    current_state = current_state.play_card(current_player, card)
-
-                current_player = current_state.get_next_player()
-            trick_winner = current_state.finish_trick()
-
-        tracker_data = current_state.calculate_scores()
-
-        return current_state
-
-    def backpropogation(self, final_state, explore_node):
+        if choose_func is None and self.rollouts > 1:
+            wins = batch_rollout(traverse_node.state, self.player, traverse_node.hand,
+                                 self.rollouts, self.rng)
+            return wins, self.rollouts
+        won = random_rollout(traverse_node.state, traverse_node.hand, self.player, choose_func)
+        return int(won), 1
+
+    def backpropogation(self, wins, explore_node, playouts=1):
         """
         Updates the win and simulation variables in all nodes on the path from this leaf node
         back to the root.
-        :param final_state: the state from the terminal node
+        :param wins: the number of playouts where the player made their bid
         :param explore_node: the node that the simulations began from.
+        :param playouts: the number of playouts run from the node
         """
-        bid, taken = final_state.end_trick_info(self.player)
-        won = bid == taken
         p = explore_node
         while p is not None:
-            p.n += 1
-            if won and p.my_turn:
-                p.w += 1
+            p.n += playouts
+            if p.my_turn:
+                p.w += wins
             p = p.parent
 
 
 if __name__ == '__main__':
     # MCTS experiment
     # Runs the experiments for seeing how well the MCTS algorithm fairs
-    from OhHell import OhHell
-    scores = {'1': [], '2': [], '3': [], '4': []}
-    for _ in range(500):
-        players = [PlayerMCTS(str(time), time) for depth in range(1,5)]
-        game = OhHell(players, 5)
-        for _ in range(9):
-            game.play()
-        scoreboard = {player.name: score_row[-1] for player, score_row in zip(players, game.state.get_scoreboard(players))}
-        for player in scoreboard:
-            scores[player].append(scoreboard[player])
-    print('Experiment 1 Average Scores', {player: sum(scores[player]) / len(scores[player]) for player in scores})
-
-    scores = {'1': [], '0.2': [], 'random_1': [], 'random_2': []}
-    for _ in range(500):
-        players = [
-            PlayerMCTS('1', 1),
-            Player('random_1', is_ai=True),
-            PlayerMCTS('0.2', 0.2),
-            Player('random_2', is_ai=True),
-        ]
-        game = OhHell(players, 5)
-        for _ in range(9):
-            game.play()
-        scoreboard = {player.name: score_row[-1] for player, score_row in zip(players, game.state.get_scoreboard(players))}
-        for player in scoreboard:
-            scores[player].append(scoreboard[player])
-    print('Experiment 2 Average Scores', {player: sum(scores[player]) / len(scores[player]) for player in scores})
+    from Tournament import run_tournament
+    roster = [{'name': str(search_time), 'algorithm': 'MCTS', 'search_time': search_time}
+              for search_time in range(1, 5)]
+    stats = run_tournament(roster, 500, max_hand=5, report_every=50)
+    print('Experiment 1 Average Scores', stats.report())
+
+    roster = [
+        {'name': '1', 'algorithm': 'MCTS', 'search_time': 1},
+        {'name': 'random_1'},
+        {'name': '0.2', 'algorithm': 'MCTS', 'search_time': 0.2},
+        {'name': 'random_2'},
+    ]
+    stats = run_tournament(roster, 500, max_hand=5, report_every=50)
+    print('Experiment 2 Average Scores', stats.report())
 
 # Experiment 1 Average Scores {'1': 16.836, '2': 13.016, '3': 13.048, '4': 13.36}
 # Experiment 2 Average Scores {'1': 46.556, '0.2': 45.934, 'random_1': 42.81, 'random_2': 41.38}
@@ -0,0 +1,36 @@
+"""
+Builds the players of a game from their specs, the player dicts sent by a client or listed in a
+tournament roster.
+"""
+from Player import Player
+from PlayerMCTS import PlayerMCTS
+from SearchStats import SearchStats
+from STS import STSPlayer
+from TimeManager import TimeManager
+from TreeParallelMCTS import PlayerTreeMCTS
+
+
+def make_player(spec, stats=None):
+    """
+    Builds an AI player from its spec.
+    :param spec: dict with the name of the player, its algorithm ('MCTS', 'STS' or none for
+    random play) and the options of the algorithm. An MCTS spec with 'stats' set gets its own
+    SearchStats, unless one is given.
+    :param stats: collector for the telemetry of an MCTS player's decisions
+    :return: the player
+    """
+    if spec.get('algorithm') == 'MCTS':
+        mcts_class = PlayerTreeMCTS if spec.get('parallel') == 'tree' else PlayerMCTS
+        time_manager = None
+        if 'time_bank' in spec:
+            time_manager = TimeManager(spec['time_bank'], per_game=spec.get('bank_per_game', False))
+        if stats is None and spec.get('stats'):
+            stats = SearchStats()
+        return mcts_class(spec['name'], spec.get('search_time', 3), spec.get('rollouts', 1),
+                          spec.get('workers', 1), spec.get('iterations'), time_manager, stats,
+                          spec.get('endgame_cards', 4), spec.get('endgame_samples', 30),
+                          spec.get('bid_table', True))
+    elif spec.get('algorithm') == 'STS':
+        return STSPlayer(spec['name'], spec.get('max_depth', float('inf')),
+                         bid_table=spec.get('bid_table', True))
+    return Player(spec['name'], is_ai=True)
@@ -1,28 +1,62 @@
+from collections import OrderedDict
+
+from BidTable import table_bid
 from Player import Player
-import pydealer
-from itertools import product, chain
-from copy import copy
+import Cards
 
-custom_ranks = {"suits": {"Spades": 1, "Hearts": 1, "Clubs": 1, "Diamonds": 1},
-                "values": {"Ace": 13, "King": 12, "Queen": 11, "Jack": 10, "10": 9,
-                            "9": 8, "8": 7, "7": 6, "6": 5, "5": 4, "4": 3, "3": 2, "2": 1,}}
+# Default number of explored positions an STSPlayer keeps in its cache
+CACHE_SIZE = 1 << 16
+# BEST_RANKS[trump_suit][card] is the card's strength with the suit led that suits it best
+BEST_RANKS = [[max(Cards.TRICK_RANKS[trump][lead][card] for lead in range(Cards.NUM_SUITS))
+               for card in range(Cards.NUM_CARDS)] for trump in range(Cards.NO_TRUMP + 1)]
 
 class STSPlayer(Player):
     """
     Inherits from the Player class. Changes the logic for selecting and playing a
     card.
     """
-    def __init__(self, name, max_depth=float('inf')):
+    def __init__(self, name, max_depth=float('inf'), cache_size=CACHE_SIZE, bid_table=True):
         """
         Constructs an instance of the STSPlayer.
         :param name: The name of the agent.
         :param max_depth: The maximum depth to traverse the game tree.
+        :param cache_size: The most explored positions to remember, least recently used are
+        dropped first.
+        :param bid_table: Whether to bid from the precomputed bid table, see BidTable. Without
+        it, or for games the table doesn't cover, the agent bids its hand size.
         """
         super().__init__(name, is_ai=True)
         self.max_depth = max_depth
+        self.cache_size = cache_size
+        # Results of explore_node for the current round, and the game and round they belong to
+        self.cache = OrderedDict()
+        self.cache_game = None
+        self.cache_round = None
+        self.bid_table = bid_table
+
+    def __getstate__(self):
+        """
+        Leaves the cache out when the player is pickled, for worker processes or the game store.
+        It is rebuilt empty when the player is loaded.
+        :return: the state to pickle
+        """
+        player_state = self.__dict__.copy()
+        player_state['cache'] = OrderedDict()
+        player_state['cache_game'] = None
+        player_state['cache_round'] = None
+        return player_state
 
     def make_bid(self, state, is_dealer):
-        return len(self.hand)
+        """
+        Bids the number of tricks the hand most often takes according to the bid table.
+        :param state: the game state
+        :param is_dealer: whether the player is the dealer and has an extra restriction on bids.
+        :return: the bid the agent is making.
+        """
+        bid = table_bid(state, self, is_dealer) if self.bid_table else None
+        if bid is None:
+            return Cards.count(self.hand)
+        return bid
 
     def play_card(self, state):
         """
@@ -30,75 +64,81 @@ class STSPlayer(Player):
         :param state: The GameState representing the current state of the game
         :return: card to be played
         """
+        if state.game_id != self.cache_game or state.curr_round != self.cache_round:
+            self.cache.clear()
+            self.cache_game = state.game_id
+            self.cache_round = state.curr_round
         card, prob = self.explore_node(self.hand, self.max_depth, leading_suit=state.leading_suit, trump_suit=state.trump_suit)
-        self.hand.get(str(card))
+        self.hand &= ~Cards.bit(card)
         return card
 
     def explore_node(self, cards, max_depth, leading_suit=None, trump_suit=None):
         """
-        Recursively explores the game tree to find expected points down each branch.
-        :param cards: The cards available to the agent
+        Recursively explores the game tree to find expected points down each branch. The same
+        hands come up again and again down different branches, so results are cached. Exploring
+        deeper than the number of cards in the hand gives the same result, so the depth is capped
+        at it in the cache key. Below a node at depth 2, the best of the four leading suits is
+        the strongest card in hand led in its own suit or as trump, so it is worked out directly
+        rather than by exploring the four nodes, and nodes at depth 1 are not cached.
+        :param cards: The mask of cards available to the agent
         :param max_depth: The maximum depth to search (relative to current depth)
         :param leading_suit: The leading suit for the trick
         :param trump_suit: The trump suit for the round
         :return: optimal card, and probability of winning the trick with that card
         """
+        card_list = Cards.cards(cards)
+        depth = min(max_depth, len(card_list))
+        if depth > 1:
+            key = (cards, leading_suit, trump_suit, depth)
+            cache = self.cache
+            result = cache.get(key)
+            if result is not None:
+                cache.move_to_end(key)
+                return result
+
         results = {}
-        for card in cards:
-            lead = leading_suit if leading_suit is not None else card.suit
-            if not card.suit == lead and not card.suit == trump_suit:
+        trump = trump_suit if trump_suit is not None else Cards.NO_TRUMP
+        ranks = Cards.TRICK_RANKS[trump]
+        for card in card_list:
+            lead = leading_suit if leading_suit is not None else Cards.suit_of(card)
+            strength = ranks[lead][card]
+            if strength == 0:
                 results[card] = 0
-            elif card.suit == trump_suit:
-                results[card] = 1 - ((13 - custom_ranks['values'][card.value]) / 52)
             else:
-                results[card] = 1 - ((26 - custom_ranks['values'][card.value]) / 52)
-            
-            if len(cards) > 1 and max_depth > 1:
-                clone_hand = copy(cards)
-                clone_hand.get(str(card))
+                results[card] = 1 - ((Cards.TOP_STRENGTH - strength) / 52)
+
+            if depth == 2:
+                best = max(BEST_RANKS[trump][other] for other in card_list if other != card)
+                results[card] += 1 - ((Cards.TOP_STRENGTH - best) / 52)
+            elif depth > 2:
+                clone_hand = cards & ~Cards.bit(card)
                 probs = [prob for _, prob in [
-                    self.explore_node(clone_hand, max_depth - 1, leading_suit=suit, trump_suit=trump_suit) for suit in ['Clubs', 'Hearts', 'Spades', 'Diamonds']
+                    self.explore_node(clone_hand, max_depth - 1, leading_suit=suit, trump_suit=trump_suit) for suit in range(Cards.NUM_SUITS)
                 ]]
                 results[card] += max(probs)
 
         card, prob = max(results.items(), key=lambda x: x[1])
+        if depth > 1:
+            cache[key] = (card, prob)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
         return card, prob
 
 if __name__ == '__main__':
     # STS experiment
-    from OhHell import OhHell
-    scores = {'1': [], '2': [], '3': [], '4': []}
-    for _ in range(500):
-        players = [STSPlayer(str(depth), depth) for depth in range(1,5)]
-        game = OhHell(players, 5)
-        for _ in range(9):
-            game.play()
-        scoreboard = {player.name: score_row[-1] for player, score_row in zip(players, game.state.get_scoreboard(players))}
-        for player in scoreboard:
-            scores[player].append(scoreboard[player])
-    print('Experiment 1 Average Scores', {player: sum(scores[player]) / len(scores[player]) for player in scores})
+    from Tournament import run_tournament
+    roster = [{'name': str(depth), 'algorithm': 'STS', 'max_depth': depth} for depth in range(1, 5)]
+    stats = run_tournament(roster, 500, max_hand=5, report_every=50)
+    print('Experiment 1 Average Scores', stats.report())
 
-    scores = {
-        'sts_shallow': [],
-        'sts_deep': [],
-        'random_1': [],
-        'random_2': []
-    }
-    for _ in range(500):
-        players = [
-            STSPlayer('sts_shallow', max_depth=1),
-            Player('random_1', is_ai=True),
-            STSPlayer('sts_deep', max_depth=5),
-            Player('random_2', is_ai=True)
-        ]
-        game = OhHell(players, max_hand=5)
-        for _ in range(9):
-            game.play()
-        scoreboard = {player.name: score_row[-1] for player, score_row in zip(players, game.state.get_scoreboard(players))}
-        for player in scoreboard:
-            scores[player].append(scoreboard[player])
-    
-    print('Experiment 2 Average Scores', {player: sum(scores[player]) / len(scores[player]) for player in scores})
+    roster = [
+        {'name': 'sts_shallow', 'algorithm': 'STS', 'max_depth': 1},
+        {'name': 'random_1'},
+        {'name': 'sts_deep', 'algorithm': 'STS', 'max_depth': 5},
+        {'name': 'random_2'},
+    ]
+    stats = run_tournament(roster, 500, max_hand=5, report_every=50)
+    print('Experiment 2 Average Scores', stats.report())
 
 # Experiment 1 Average Scores {'1': 16.836, '2': 13.016, '3': 13.048, '4': 13.36}
 # Experiment 2 Average Scores {'sts_shallow': 17.716, 'sts_deep': 14.42, 'random_1': 44.054, 'random_2': 44.09}
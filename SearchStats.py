@@ -0,0 +1,142 @@
+"""
+Telemetry of the decisions made by search players.
+
+A search player given a collector calls its record method once per card it plays, with a dict
+describing the decision. Any object with a record method can be used. SearchStats keeps running
+totals that can be merged, so the decisions of many players and games add up to one summary.
+Players without a collector skip the measurements entirely.
+
+The decision dict has:
+    iterations: number of search iterations run
+    playouts: number of random playouts run
+    search_time: seconds spent in the search loop
+    playouts_per_sec: playouts divided by search_time
+    nodes: number of nodes in the tree after the search
+    max_depth, mean_depth: depth of the deepest node and mean depth of the nodes below the root
+    phase_times: seconds spent in selection, expansion, simulation and backpropogation
+    root_visits: visits of each card at the root, by card name
+    decision_time: seconds from being asked for a card to returning it
+    forced: whether the card was the only legal move, and so played without searching
+    endgame: whether the card was picked by the endgame solver instead of searching
+Forced and endgame decisions only report decision_time. Parallel searches only report what
+their workers send back: iterations, playouts, search time, root_visits and decision_time.
+"""
+PHASES = ('selection', 'expansion', 'simulation', 'backpropogation')
+
+# Decision fields that are added up across decisions
+SUMMED = ('iterations', 'playouts', 'search_time', 'nodes', 'decision_time')
+
+
+class SearchStats:
+    """
+    Running totals of the decisions recorded by one or more search players.
+    """
+    def __init__(self):
+        self.decisions = 0
+        self.forced = 0
+        self.endgame = 0
+        self.totals = {field: 0 for field in SUMMED}
+        self.phase_times = {phase: 0 for phase in PHASES}
+        # Sum over decisions of mean depth times nodes, to get the mean depth of all nodes
+        self.depth_total = 0
+        self.max_depth = 0
+        self.max_decision_time = 0
+        self.last = None
+
+    def record(self, decision):
+        """
+        Adds a decision to the totals.
+        :param decision: dict describing the decision, see the module docstring
+        """
+        self.last = decision
+        self.decisions += 1
+        self.max_decision_time = max(self.max_decision_time, decision['decision_time'])
+        if decision.get('forced') or decision.get('endgame'):
+            if decision.get('forced'):
+                self.forced += 1
+            else:
+                self.endgame += 1
+            self.totals['decision_time'] += decision['decision_time']
+            return
+        for field in SUMMED:
+            self.totals[field] += decision.get(field, 0)
+        for phase, seconds in decision.get('phase_times', {}).items():
+            self.phase_times[phase] += seconds
+        self.depth_total += decision.get('mean_depth', 0) * decision.get('nodes', 0)
+        self.max_depth = max(self.max_depth, decision.get('max_depth', 0))
+
+    def merge(self, other):
+        """
+        Adds the totals of another collector to this one.
+        :param other: a SearchStats, or the dict from its to_dict
+        :return: this collector
+        """
+        if isinstance(other, dict):
+            other = SearchStats.from_dict(other)
+        self.decisions += other.decisions
+        self.forced += other.forced
+        self.endgame += other.endgame
+        for field in SUMMED:
+            self.totals[field] += other.totals[field]
+        for phase in PHASES:
+            self.phase_times[phase] += other.phase_times[phase]
+        self.depth_total += other.depth_total
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self.max_decision_time = max(self.max_decision_time, other.max_decision_time)
+        return self
+
+    def to_dict(self):
+        """
+        :return: the totals as a dict that can be written as JSON or sent between processes
+        """
+        return {
+            'decisions': self.decisions,
+            'forced': self.forced,
+            'endgame': self.endgame,
+            'totals': dict(self.totals),
+            'phase_times': dict(self.phase_times),
+            'depth_total': self.depth_total,
+            'max_depth': self.max_depth,
+            'max_decision_time': self.max_decision_time,
+        }
+
+    @staticmethod
+    def from_dict(data):
+        """
+        :param data: totals from to_dict
+        :return: a SearchStats holding the totals
+        """
+        stats = SearchStats()
+        stats.decisions = data['decisions']
+        stats.forced = data['forced']
+        stats.endgame = data['endgame']
+        stats.totals.update(data['totals'])
+        stats.phase_times.update(data['phase_times'])
+        stats.depth_total = data['depth_total']
+        stats.max_depth = data['max_depth']
+        stats.max_decision_time = data['max_decision_time']
+        return stats
+
+    def summary(self):
+        """
+        :return: dict of the averages over the recorded decisions
+        """
+        searched = self.decisions - self.forced - self.endgame
+        search_time = self.totals['search_time']
+        nodes = self.totals['nodes']
+        phase_total = sum(self.phase_times.values())
+        return {
+            'decisions': self.decisions,
+            'forced': self.forced,
+            'endgame': self.endgame,
+            'mean_iterations': self.totals['iterations'] / searched if searched else 0,
+            'playouts_per_sec': self.totals['playouts'] / search_time if search_time else 0,
+            'mean_nodes': nodes / searched if searched else 0,
+            'mean_depth': self.depth_total / nodes if nodes else 0,
+            'max_depth': self.max_depth,
+            'phase_share': {phase: seconds / phase_total if phase_total else 0
+                            for phase, seconds in self.phase_times.items()},
+            'mean_decision_time': self.totals['decision_time'] / self.decisions
+            if self.decisions else 0,
+            'max_decision_time': self.max_decision_time,
+        }
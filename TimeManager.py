@@ -0,0 +1,77 @@
+"""
+Code for sharing out a bank of thinking time between the decisions of a search player.
+
+The bank covers either one round or the whole game. Each decision gets a share of what is left
+in proportion to how many moves it has to choose between, compared with the decisions still to
+come, so forced and nearly forced plays leave time for the harder ones.
+"""
+import Cards
+
+
+class TimeManager:
+    """
+    Keeps the time bank of one player and decides how long each of their searches may run.
+    """
+    def __init__(self, time_bank, per_game=False, extension=0.5, close_ratio=0.9):
+        """
+        Creates a time manager with a full bank.
+        :param time_bank: seconds of search time for each round, or for the game if per_game
+        :param per_game: whether the bank covers the whole game instead of one round
+        :param extension: fraction of a decision's time that may be added when the top two
+        moves at the root are close after the time is up
+        :param close_ratio: visit ratio between the second best and the best move at the root
+        above which the decision counts as close
+        """
+        self.time_bank = time_bank
+        self.per_game = per_game
+        self.extension = extension
+        self.close_ratio = close_ratio
+        self.remaining = time_bank
+        # Game and round the bank is being spent on
+        self.game = None
+        self.round = None
+
+    def refill(self, state):
+        """
+        Fills the bank back up when a new round or game has started.
+        :param state: The GameState representing the current state of the game
+        """
+        if state.game_id != self.game or (not self.per_game and state.curr_round != self.round):
+            self.remaining = self.time_bank
+        self.game = state.game_id
+        self.round = state.curr_round
+
+    def budget(self, state, hand, num_moves):
+        """
+        Works out how long to search for the current decision. A decision is weighted by the
+        number of moves beyond the first it can choose from, and later decisions are assumed to
+        choose between every card the player will be holding.
+        :param state: The GameState representing the current state of the game
+        :param hand: the player's hand mask before playing
+        :param num_moves: number of legal moves for this decision
+        :return: the seconds to search for
+        """
+        self.refill(state)
+        weight = num_moves - 1
+        if weight <= 0:
+            return 0
+        held = Cards.count(hand)
+        later = sum(range(held - 1))
+        if self.per_game:
+            for hand_size in state.round_hand[state.curr_round + 1:]:
+                later += sum(range(hand_size))
+        return self.remaining * weight / (weight + later)
+
+    def extra(self, seconds):
+        """
+        :param seconds: the time given to the current decision
+        :return: the extra seconds a close decision may take, limited by what is in the bank
+        """
+        return max(0, min(seconds * self.extension, self.remaining - seconds))
+
+    def spend(self, seconds):
+        """
+        Takes the time used by a decision out of the bank.
+        :param seconds: the time the search ran for
+        """
+        self.remaining = max(0, self.remaining - seconds)
@@ -0,0 +1,204 @@
+"""
+Headless tournament runner for pitting players against each other over many games.
+
+Games are spread across a process pool and the players are rotated round the table from one
+game to the next so no player keeps the same seat. Each finished game is appended to a results
+file as a line of JSON, so an interrupted tournament picks up where it left off when it is run
+again with the same file. Running this file plays the tournament described by a roster file:
+
+    python Tournament.py roster.json --games 500 --max-hand 5 --workers 8 --out results.jsonl
+
+The roster is a JSON list of player specs in the same form the web app takes, e.g.
+{"name": "mcts_short", "is_ai": true, "algorithm": "MCTS", "search_time": 1}. Players without
+an algorithm play randomly. MCTS and STS players bid from the precomputed bid table unless
+their spec has "bid_table": false. MCTS players with "stats": true collect search telemetry, which
+is summed over the games and printed at the end. Given --log DIR, every move of every game is
+recorded to a GameLog shard per worker process in that directory.
+"""
+import json
+import math
+import multiprocessing
+import os
+import random
+
+from GameLog import GameLog
+from OhHell import OhHell
+from PlayerSpec import make_player
+from SearchStats import SearchStats
+
+# z value of the confidence intervals reported for the mean scores
+Z_95 = 1.96
+
+
+def play_game(args):
+    """
+    Plays one full game, the task run by each worker process.
+    :param args: the game number, its random seed, the roster, the largest hand size and the
+    directory of the game log, or None
+    :return: dict with the game number, the seed, each player's final score and the search
+    telemetry of the players that collect it
+    """
+    game_id, seed, roster, max_hand, log_dir = args
+    random.seed(seed)
+    shift = game_id % len(roster)
+    players = [make_player(spec) for spec in roster[shift:] + roster[:shift]]
+    log = GameLog.open_shard(log_dir) if log_dir is not None else None
+    game = OhHell(players, max_hand=max_hand, log=log)
+    try:
+        for _ in range(game.state.num_rounds):
+            game.play()
+    finally:
+        if log is not None:
+            log.close()
+    scoreboard = game.state.get_scoreboard(players)
+    return {
+        'game': game_id,
+        'seed': seed,
+        'scores': {player.name: float(score_row[-1]) for player, score_row in zip(players, scoreboard)},
+        'search': {player.name: player.stats.to_dict() for player in players
+                   if getattr(player, 'stats', None) is not None}
+    }
+
+
+class ScoreStats:
+    """
+    Running statistics of the scores of every player over the games played so far, and the
+    search telemetry of the players that collect it.
+    """
+    def __init__(self, names):
+        """
+        :param names: the names of the players
+        """
+        self.games = 0
+        self.sums = {name: 0 for name in names}
+        self.squares = {name: 0 for name in names}
+        self.search = {}
+
+    def add(self, scores, search=None):
+        """
+        Adds the final scores of a game.
+        :param scores: dict of the score of each player
+        :param search: dict of the SearchStats totals of each player collecting them
+        """
+        for name, totals in (search or {}).items():
+            self.search.setdefault(name, SearchStats()).merge(totals)
+        self.games += 1
+        for name, score in scores.items():
+            self.sums[name] += score
+            self.squares[name] += score * score
+
+    def summary(self):
+        """
+        :return: dict of (mean, half width of the 95% confidence interval) for each player
+        """
+        out = {}
+        for name, total in self.sums.items():
+            mean = total / self.games
+            if self.games > 1:
+                variance = max(0, (self.squares[name] - self.games * mean * mean) / (self.games - 1))
+                half_width = Z_95 * math.sqrt(variance / self.games)
+            else:
+                half_width = float('inf')
+            out[name] = (mean, half_width)
+        return out
+
+    def report(self):
+        """
+        :return: one line with each player's mean score and confidence interval
+        """
+        return 'games {}: '.format(self.games) + ', '.join(
+            '{} {:.2f} +/- {:.2f}'.format(name, mean, half_width)
+            for name, (mean, half_width) in self.summary().items())
+
+
+def load_results(path):
+    """
+    Reads the games already finished from a results file. Partly written lines, left by an
+    interruption, are skipped.
+    :param path: the results file
+    :return: list of the results of the finished games
+    """
+    results = []
+    if path is None or not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    return results
+
+
+def run_tournament(roster, games, max_hand=None, seed=0, workers=None, out=None,
+                   report=print, report_every=1, log_dir=None):
+    """
+    Plays a tournament, spreading the games across a process pool. Game i is played with seed
+    seed + i, so a game gives the same result whichever worker plays it.
+    :param roster: list of player specs, see make_player
+    :param games: the number of games to play
+    :param max_hand: the largest hand size in each game, None for the largest possible
+    :param seed: the seed of the first game
+    :param workers: the number of processes to play games in, defaults to the number of CPUs.
+    MCTS players should search with a single worker, as pool processes can't start their own.
+    :param out: file to append the result of each game to. Games already in the file are not
+    played again.
+    :param report: function called with a line of statistics as games finish
+    :param report_every: the number of games between reports
+    :param log_dir: directory to record the moves of the games to, see GameLog, or None
+    :return: the ScoreStats over all the games
+    """
+    stats = ScoreStats([spec['name'] for spec in roster])
+    done = set()
+    for result in load_results(out):
+        if result['game'] < games and result['game'] not in done:
+            done.add(result['game'])
+            stats.add(result['scores'], result.get('search'))
+    tasks = [(i, seed + i, roster, max_hand, log_dir) for i in range(games) if i not in done]
+    if not tasks:
+        return stats
+
+    log = None
+    if out is not None:
+        log = open(out, 'a+')
+        # Start on a new line if the last write was cut off
+        if log.tell() > 0:
+            log.seek(log.tell() - 1)
+            if log.read(1) != '\n':
+                log.write('\n')
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for result in pool.imap_unordered(play_game, tasks):
+                if log is not None:
+                    log.write(json.dumps(result) + '\n')
+                    log.flush()
+                stats.add(result['scores'], result.get('search'))
+                if stats.games % report_every == 0 or stats.games == games:
+                    report(stats.report())
+    finally:
+        if log is not None:
+            log.close()
+    return stats
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Play a tournament of Oh, Hell between AI players.')
+    parser.add_argument('roster', help='JSON file with the list of player specs')
+    parser.add_argument('--games', type=int, default=500)
+    parser.add_argument('--max-hand', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=None, help='results file, resumed if it exists')
+    parser.add_argument('--report-every', type=int, default=1)
+    parser.add_argument('--log', default=None, help='directory to record the moves of the games to')
+    args = parser.parse_args()
+
+    with open(args.roster) as f:
+        roster = json.load(f)
+    stats = run_tournament(roster, args.games, max_hand=args.max_hand, seed=args.seed,
+                           workers=args.workers, out=args.out, report_every=args.report_every,
+                           log_dir=args.log)
+    for name, search in stats.search.items():
+        print(name, json.dumps(search.summary()))
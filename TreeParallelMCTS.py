@@ -0,0 +1,396 @@
+"""
+Code for running the MCTS with several processes growing one shared tree (tree-parallel MCTS).
+
+The node statistics live in shared memory arrays. Workers take a lock to walk down the tree and
+claim a move to expand, then replay the moves from the root to get the node's state and run
+the playouts without the lock. A virtual loss is added along the path while a worker is busy,
+so the other workers spread out over different paths instead of all following the same one.
+"""
+import math
+import multiprocessing
+import random
+import threading
+import time
+
+import numpy as np
+
+import Cards
+from BatchRollout import batch_rollout
+from PlayerMCTS import PlayerMCTS, best_action, node_moves, random_rollout, search_stats
+
+# Number of nodes the shared tree can hold, new nodes stop being added once it is full
+DEFAULT_CAPACITY = 1 << 17
+# Largest hand that can be dealt, (52 - 1) // 2, which bounds the children of a node
+MAX_CHILDREN = (Cards.NUM_CARDS - 1) // 2
+
+# Indexes into the header of the shared tree
+SIZE = 0
+OPEN_NODES = 1
+# New nodes claimed by a worker whose moves aren't known yet, which may still open
+PENDING = 2
+
+
+class SharedTree:
+    """
+    The statistics of a search tree held in shared memory so several processes can grow the
+    same tree. Nodes are rows in the arrays, node 0 is the root. Only the move leading to a node
+    is stored, states are rebuilt by replaying moves from the root.
+    """
+    fields = [
+        ('header', 'q', 3),
+        ('parent', 'i', 1),
+        ('action', 'b', 1),
+        ('my_turn', 'b', 1),
+        ('next_me', 'b', 1),
+        ('w', 'q', 1),
+        ('n', 'q', 1),
+        ('virtual', 'i', 1),
+        ('untried', 'Q', 1),
+        ('max_children', 'b', 1),
+        ('num_children', 'b', 1),
+        ('children', 'i', MAX_CHILDREN),
+    ]
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, buffers=None):
+        """
+        Creates the shared arrays, or wraps arrays that were already created by another process.
+        :param capacity: the number of nodes the tree can hold
+        :param buffers: the shared arrays of an existing tree
+        """
+        self.capacity = capacity
+        if buffers is None:
+            buffers = {}
+            for name, typecode, width in SharedTree.fields:
+                size = width * (1 if name == 'header' else capacity)
+                buffers[name] = multiprocessing.RawArray(typecode, size)
+        self.buffers = buffers
+        for name, typecode, width in SharedTree.fields:
+            array = np.frombuffer(buffers[name], dtype=np.dtype(typecode))
+            if width > 1 and name != 'header':
+                array = array.reshape(capacity, width)
+            setattr(self, name, array)
+
+    def reset(self, hand, state):
+        """
+        Clears the tree and sets up the root for a new search.
+        :param hand: the hand of the player searching
+        :param state: the state to search from, with the player about to play
+        """
+        moves = Cards.legal_moves(hand, state.leading_suit)
+        self.header[SIZE] = 1
+        self.header[OPEN_NODES] = 1 if moves else 0
+        self.header[PENDING] = 0
+        self.init_node(0, parent=-1, action=-1, my_turn=True)
+        self.untried[0] = moves
+        self.max_children[0] = Cards.count(moves)
+        self.next_me[0] = True
+
+    def init_node(self, node, parent, action, my_turn):
+        """
+        Clears the statistics of a newly allocated node.
+        """
+        self.parent[node] = parent
+        self.action[node] = action
+        self.my_turn[node] = my_turn
+        self.next_me[node] = False
+        self.w[node] = 0
+        self.n[node] = 0
+        self.virtual[node] = 0
+        self.untried[node] = 0
+        self.max_children[node] = 0
+        self.num_children[node] = 0
+
+    def root_stats(self):
+        """
+        :return: list of (action, w, n) for each child of the root
+        """
+        children = self.children[0, :self.num_children[0]]
+        return [(int(self.action[c]), int(self.w[c]), int(self.n[c])) for c in children]
+
+
+class TreeSearchWorker:
+    """
+    The search run by each worker process on the shared tree.
+    """
+    def __init__(self, tree, lock, hand, state, player, rollouts=1):
+        """
+        :param tree: the SharedTree
+        :param lock: lock guarding changes to the shape of the tree and its statistics
+        :param hand: the hand of the player at the root
+        :param state: the state at the root
+        :param player: the player who is using this search
+        :param rollouts: number of playouts to run from each new node
+        """
+        self.tree = tree
+        self.lock = lock
+        self.hand = hand
+        self.state = state
+        self.player = player
+        self.rollouts = rollouts
+        self.rng = np.random.default_rng(random.getrandbits(64)) if rollouts > 1 else None
+
+    def search(self, max_search_time):
+        """
+        Runs iterations until the time is up or every node is fully expanded. A node another
+        worker is expanding may still open, so the search only ends early once none are pending.
+        :param max_search_time: the maximum amount of time to search
+        :return: number of iterations run by this worker
+        """
+        start_time = time.time()
+        searches = 0
+        header = self.tree.header
+        while (time.time() - start_time < max_search_time
+               and (header[OPEN_NODES] > 0 or header[PENDING] > 0)):
+            with self.lock:
+                path, expanded = self.select_and_expand()
+            state, hand = self.replay(path)
+            if expanded:
+                moves = node_moves(state, hand, self.player)
+            if self.rollouts > 1:
+                wins = batch_rollout(state, self.player, hand, self.rollouts, self.rng)
+            else:
+                wins = int(random_rollout(state, hand, self.player))
+            with self.lock:
+                if expanded:
+                    self.finish_expansion(path[-1], *moves)
+                self.backpropogation(path, wins, self.rollouts)
+            searches += 1
+        return searches
+
+    def select_and_expand(self):
+        """
+        Walks down from the root taking the child with the best UCT, counting a virtual loss on
+        each node passed. If the node reached has untried moves, claims one of them as a new
+        child. Must be called with the lock held.
+        :return: the path of nodes from the root, and whether the last one is a new node
+        """
+        tree = self.tree
+        node = 0
+        path = [0]
+        tree.virtual[0] += 1
+        while not tree.untried[node] and tree.num_children[node]:
+            node = self.best_child(node)
+            path.append(node)
+            tree.virtual[node] += 1
+
+        untried = int(tree.untried[node])
+        if not untried or tree.header[SIZE] >= tree.capacity:
+            return path, False
+
+        card = Cards.random_card(untried)
+        untried &= ~Cards.bit(card)
+        count = int(tree.num_children[node])
+        if not untried or count + 1 >= tree.max_children[node]:
+            untried = 0
+            tree.header[OPEN_NODES] -= 1
+        tree.untried[node] = untried
+
+        child = int(tree.header[SIZE])
+        tree.header[SIZE] += 1
+        tree.init_node(child, parent=node, action=card, my_turn=tree.next_me[node])
+        tree.virtual[child] = 1
+        tree.children[node, count] = child
+        tree.num_children[node] = count + 1
+        tree.header[PENDING] += 1
+        path.append(child)
+        return path, True
+
+    def best_child(self, node, c=math.sqrt(2)):
+        """
+        Scores the children of a node with UCT, counting virtual losses as visits without a win.
+        :param node: the node to pick a child of
+        :param c: the exploration constant
+        :return: the best child
+        """
+        tree = self.tree
+        children = tree.children[node, :tree.num_children[node]]
+        n = tree.n[children] + tree.virtual[children]
+        parent_n = tree.n[node] + tree.virtual[node]
+        if not n.all():
+            return int(children[np.argmin(n)])
+        scores = tree.w[children] / n + c * np.sqrt(np.log(parent_n) / n)
+        return int(children[np.argmax(scores)])
+
+    def replay(self, path):
+        """
+        Rebuilds the state at the end of a path by playing its moves from the root.
+        :param path: the nodes from the root
+        :return: the state and the player's hand at the last node
+        """
+        state = self.state.copy_state()
+        hand = self.hand
+        for i, node in enumerate(path[1:]):
+            card = int(self.tree.action[node])
+            if i == 0:
+                current_player = self.player
+            else:
+                current_player = state.get_next_player()
+                if current_player is None:
+                    state.finish_trick()
+                    current_player = state.get_next_player()
+            if current_player is self.player:
+                hand &= ~Cards.bit(card)
+            state.apply_move(current_player, card)
+        return state, hand
+
+    def finish_expansion(self, node, untried, max_children, next_me):
+        """
+        Fills in the moves of a new node once its state is known. Must be called with the lock
+        held.
+        """
+        tree = self.tree
+        tree.untried[node] = untried
+        tree.max_children[node] = max_children
+        tree.next_me[node] = next_me
+        tree.header[PENDING] -= 1
+        if untried:
+            tree.header[OPEN_NODES] += 1
+
+    def backpropogation(self, path, wins, playouts):
+        """
+        Adds the playouts to every node on the path and takes back the virtual losses. Must be
+        called with the lock held.
+        """
+        tree = self.tree
+        for node in path:
+            tree.n[node] += playouts
+            tree.virtual[node] -= 1
+            if tree.my_turn[node]:
+                tree.w[node] += wins
+
+
+# Set in each worker process by init_worker
+_worker_tree = None
+_worker_lock = None
+
+
+def init_worker(buffers, capacity, lock):
+    """
+    Pool initializer, attaches the worker process to the shared tree.
+    """
+    global _worker_tree, _worker_lock
+    _worker_tree = SharedTree(capacity, buffers)
+    _worker_lock = lock
+
+
+def tree_worker(args):
+    """
+    The task each worker runs for one search.
+    :param args: the hand, state, player, search time, rollouts and random seed for the search
+    :return: number of iterations run by the worker
+    """
+    hand, state, player, search_time, rollouts, seed = args
+    random.seed(seed)
+    worker = TreeSearchWorker(_worker_tree, _worker_lock, hand, state, player, rollouts)
+    return worker.search(search_time)
+
+
+# Process pools, their shared trees and the locks held by the search using each tree, by number
+# of workers
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(workers, capacity=DEFAULT_CAPACITY):
+    """
+    Gets the process pool and shared tree for the given number of workers, starting them the
+    first time they are needed. They are kept until the program exits.
+    :param workers: number of worker processes
+    :param capacity: the number of nodes the tree can hold
+    :return: the pool, its SharedTree and the lock to hold while searching with them
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            tree = SharedTree(capacity)
+            lock = multiprocessing.Lock()
+            pool = multiprocessing.Pool(workers, initializer=init_worker,
+                                        initargs=(tree.buffers, capacity, lock))
+            _pools[workers] = (pool, tree, threading.Lock())
+        return _pools[workers]
+
+
+def tree_parallel_search(hand, state, player, search_time, workers, rollouts=1):
+    """
+    Runs a tree-parallel MCTS from the given state. Searches from several threads share the
+    tree, so they take turns.
+    :param hand: the hand of the player
+    :param state: the current game state, with the player about to play
+    :param player: the player who is using this search
+    :param search_time: the amount of time to search for
+    :param workers: the number of worker processes
+    :param rollouts: number of playouts to run from each new node
+    :return: list of (action, w, n) for each child of the root, and the total iterations
+    """
+    pool, tree, search_lock = get_pool(workers)
+    seed = random.getrandbits(32)
+    tasks = [(hand, state, player, search_time, rollouts, seed + i) for i in range(workers)]
+    with search_lock:
+        tree.reset(hand, state)
+        searches = pool.map(tree_worker, tasks)
+        return tree.root_stats(), sum(searches)
+
+
+class PlayerTreeMCTS(PlayerMCTS):
+    """
+    Inherits from the PlayerMCTS class. Searches with several worker processes growing one
+    shared tree, rather than an independent tree per worker.
+    """
+    def parallel_search(self, state, search_time, decision=None):
+        """
+        Tree-parallel MCTS over the player's workers. Always runs for a time, as the order the
+        workers update the tree in is not repeatable anyway.
+        :param state: The GameState representing the current state of the game
+        :param search_time: the time the workers search for
+        :param decision: dict to add the telemetry of the search to, or None
+        :return: the best card to play
+        """
+        start_time = time.time()
+        child_stats, searches = tree_parallel_search(self.hand, state, self, search_time,
+                                                     self.workers, self.rollouts)
+        if decision is not None:
+            playouts = sum(n for _, _, n in child_stats)
+            decision.update(search_stats(child_stats, searches, playouts, time.time() - start_time))
+        return best_action(child_stats)
+
+
+if __name__ == '__main__':
+    # Benchmark of the tree-parallel search against the single-threaded search, given the same
+    # wall time on the same positions
+    import sys
+
+    from GameState import GameState
+    from Player import Player
+    from PlayerMCTS import MonteCarloTreeSearch
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+    search_time = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    for num_players, max_hand in [(4, 5), (4, 10), (5, 10)]:
+        random.seed(num_players * 100 + max_hand)
+        players = [PlayerTreeMCTS('mcts', search_time, workers=workers)] + \
+                  [Player('random_{}'.format(i), is_ai=True) for i in range(1, num_players)]
+        state = GameState(players, max_hand)
+        state.curr_round = max_hand - 1
+        state.begin_round()
+        deck = list(range(Cards.NUM_CARDS))
+        random.shuffle(deck)
+        for i, player in enumerate(state.get_bid_order()):
+            for card in deck[i * max_hand:(i + 1) * max_hand]:
+                player.hand |= Cards.bit(card)
+        state.set_trump_suit(deck[-1])
+        for player in state.get_bid_order():
+            state.collect_bid(player, 1)
+        player = state.get_next_player()
+
+        mcts = MonteCarloTreeSearch(player.hand, state.copy_state(), player)
+        root, single = mcts.search(max_search_time=search_time)
+        nodes, stack = 0, [root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            stack.extend(node.children)
+        stats, shared = tree_parallel_search(player.hand, state, player, search_time, workers)
+        print('{} players, {} cards: single {} iterations ({} nodes), tree-parallel x{} {} '
+              'iterations ({} nodes), moves {} / {}'.format(
+                  num_players, max_hand, single, nodes, workers, shared,
+                  int(get_pool(workers)[1].header[SIZE]), Cards.card_name(mcts.next_move()),
+                  Cards.card_name(best_action(stats))))
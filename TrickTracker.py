@@ -101,11 +101,102 @@ class TrickTracker:
         Copies the current trick tracker to ensure that reference remain the same
         :return: new tracker
         """
-        new_tracker = copy.deepcopy(self)
-        new_tracker.bid_history = copy.copy(self.bid_history)
-        new_tracker.trick_history = copy.copy(self.trick_history)
+        new_tracker = copy.copy(self)
+        new_tracker.bid_history = {player: list(bids) for player, bids in self.bid_history.items()}
+        new_tracker.trick_history = {player: list(tricks) for player, tricks in
+                                     self.trick_history.items()}
         new_tracker.tricks_taken = copy.copy(self.tricks_taken)
-        new_tracker.player2idx = copy.copy(self.player2idx)
         new_tracker.curr_bid = copy.copy(self.curr_bid)
+        new_tracker.scoreboard = self.scoreboard.copy()
 
         return new_tracker
+
+
+class BatchTrickTracker:
+    """
+    Tracks the score of many games with the same number of players and rounds, in arrays shared
+    by all of them rather than a TrickTracker per game. Players are numbered by their seat in
+    each game, and every method acts on all the games at once, or on the games given as an
+    array of their indices. Each game can be on a round of its own.
+    """
+    def __init__(self, num_games, num_players, num_rounds):
+        """
+        :param num_games: the number of games tracked
+        :param num_players: the number of players in each game
+        :param num_rounds: the number of rounds in each game
+        """
+        self.num_games = num_games
+        self.num_players = num_players
+        self.num_rounds = num_rounds
+        # Bid and tricks taken of every player in every round, by game, seat and round
+        self.bid_history = np.zeros((num_games, num_players, num_rounds), dtype=np.int8)
+        self.trick_history = np.zeros((num_games, num_players, num_rounds), dtype=np.int8)
+        # Tricks taken so far in the current round, by game and seat
+        self.tricks_taken = np.zeros((num_games, num_players), dtype=np.int8)
+        # Cumulative score after each round, by game, seat and round
+        self.scoreboard = np.zeros((num_games, num_players, num_rounds), dtype=np.int16)
+        self.curr_round = np.zeros(num_games, dtype=np.int64)
+
+    def _games(self, games):
+        """
+        :param games: indices of games, or None for all of them
+        :return: the indices of the games as an array
+        """
+        return np.arange(self.num_games) if games is None else np.asarray(games)
+
+    def collect_bids(self, bids, games=None):
+        """
+        Records the bids of every player for the current round.
+        :param bids: (games, players) array of the bids
+        :param games: the indices of the games bidding, None for all of them
+        """
+        games = self._games(games)
+        self.bid_history[games, :, self.curr_round[games]] = bids
+
+    def trick_taken(self, winners, games=None):
+        """
+        Records which player took a trick in each game and increments their value by 1
+        :param winners: the seat of the trick winner in each game
+        :param games: the indices of the games, None for all of them. Each game appears at most
+        once.
+        """
+        self.tricks_taken[self._games(games), winners] += 1
+
+    def calculate_scores(self, games=None):
+        """
+        Scores the current round of the games; players who get their bids get a bonus 10 points
+        and all players get a point for each trick they took
+        :param games: the indices of the games to score, None for all of them
+        :return: (games, players) arrays of the tricks taken and the bids, the same information
+        as the output of TrickTracker.calculate_scores
+        """
+        games = self._games(games)
+        rounds = self.curr_round[games]
+        taken = self.tricks_taken[games]
+        bids = self.bid_history[games, :, rounds]
+        self.trick_history[games, :, rounds] = taken
+        points = taken + 10 * (taken == bids)
+        previous = self.scoreboard[games, :, np.maximum(rounds - 1, 0)]
+        self.scoreboard[games, :, rounds] = points + previous * (rounds > 0)[:, None]
+        return taken, bids
+
+    def reset(self, games=None):
+        """
+        Updates variables for the next round
+        :param games: the indices of the games moving on, None for all of them
+        """
+        games = self._games(games)
+        self.curr_round[games] += 1
+        self.tricks_taken[games] = 0
+
+    def get_scoreboard(self, game, seats=None):
+        """
+        Return the scoreboard of a game in the order of the seats given
+        :param game: the index of the game
+        :param seats: the seats in the given order to display, None for the seat order
+        :return: (players, rounds) scoreboard, a view into the shared scoreboard when seats is
+        None
+        """
+        if seats is None:
+            return self.scoreboard[game]
+        return self.scoreboard[game, seats]
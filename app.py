@@ -1,17 +1,118 @@
 import eventlet
 import socketio
-from Player import Player
-from PlayerMCTS import PlayerMCTS
-from STS import STSPlayer
-from OhHell import OhHell
+from collections import deque
+from GameServer import (attach_stats, create_game, event_batch, game_error, latency_summary,
+                        log_from_environ, read_checkpoint, restore_game, resume_allowed,
+                        store_from_environ, write_checkpoint)
+from GameStore import StaleGameError
+from OhHell import DEAL
+from Offload import DecisionPool
+from SearchStats import SearchStats
 import os
+import time
 
-sio = socketio.Server(cors_allowed_origins='*')
+# Set MESSAGE_QUEUE to the URL of a Redis server shared by the server's processes, so an event is
+# delivered to its client whichever process the client is connected to
+MESSAGE_QUEUE = os.environ.get('MESSAGE_QUEUE')
+sio = socketio.Server(cors_allowed_origins='*',
+                      client_manager=socketio.RedisManager(MESSAGE_QUEUE) if MESSAGE_QUEUE else None)
 app = socketio.WSGIApp(sio)
 
 GAME_TIMEOUT_LENGTH = int(os.environ.get('GAME_TIMEOUT_LENGTH') or 600)
 
-existing_games = {}
+# Games of the clients, kept in memory unless GAME_STORE names a SQLite file shared by the
+# server's processes. Unused games are evicted, see GameServer.store_from_environ.
+existing_games = store_from_environ()
+# How often games that have gone unused are evicted, in seconds
+SWEEP_INTERVAL = float(os.environ.get('SWEEP_INTERVAL') or 60)
+
+# Timeout timer of each game waiting on an answer from its client
+waiting = {}
+
+# Telemetry of every MCTS decision made by the server, when SEARCH_STATS is set
+search_stats = SearchStats() if os.environ.get('SEARCH_STATS') else None
+
+# Log of the moves of every game, to a shard of this process in GAME_LOG_DIR if it is set
+game_log = log_from_environ()
+
+# AI decisions run in this many worker processes so a search doesn't hold up the other games.
+# Defaults to the number of CPUs, 0 runs them on the event loop.
+AI_WORKERS = os.environ.get('AI_WORKERS')
+decision_pool = None if AI_WORKERS == '0' else DecisionPool(int(AI_WORKERS) if AI_WORKERS else None)
+# How often a waiting decision checks whether its worker is done, in seconds
+DECIDE_POLL_INTERVAL = 0.005
+# How often the event loop is checked for delays, in seconds
+LATENCY_INTERVAL = 0.05
+
+# Delays of the event loop over the last minute, in seconds
+loop_delays = deque(maxlen=int(60 / LATENCY_INTERVAL))
+
+# Live games are written to this file every CHECKPOINT_INTERVAL seconds when it is set, and the
+# games in it can be carried on with resume_game after a restart
+CHECKPOINT_FILE = os.environ.get('CHECKPOINT_FILE')
+CHECKPOINT_INTERVAL = float(os.environ.get('CHECKPOINT_INTERVAL') or 30)
+# Games from the checkpoint that no client has carried on yet, by the id they were saved under.
+# They are dropped once they have gone unused for the store's GAME_TTL since the restart.
+saved_games = read_checkpoint(CHECKPOINT_FILE) if CHECKPOINT_FILE else {}
+saved_games_until = time.time() + existing_games.ttl if existing_games.ttl else None
+
+def decide(player, method, *args):
+    '''
+    Gets a decision from an AI player in the decision pool, letting the event loop serve other
+    clients until it is done.
+    :param player: the AI player making the decision.
+    :param method: the name of the method of the player to call.
+    :param args: the arguments of the method.
+    :return: the result of the decision.
+    '''
+    future = decision_pool.submit(player, method, *args)
+    while not future.done():
+        eventlet.sleep(DECIDE_POLL_INTERVAL)
+    return decision_pool.finish(player, future)
+
+def monitor_loop():
+    '''
+    Measures how late the event loop wakes up from a short sleep, the delay any event waiting
+    to be handled would see.
+    '''
+    while True:
+        start = time.perf_counter()
+        eventlet.sleep(LATENCY_INTERVAL)
+        loop_delays.append(time.perf_counter() - start - LATENCY_INTERVAL)
+
+sio.start_background_task(monitor_loop)
+
+def sweep_loop():
+    '''
+    Evicts the games that have gone unused every SWEEP_INTERVAL seconds, and tells their
+    clients. With a shared store this evicts the games of every process, whose clients are only
+    told through the MESSAGE_QUEUE.
+    '''
+    while True:
+        eventlet.sleep(SWEEP_INTERVAL)
+        for sid in existing_games.sweep():
+            if sid in waiting:
+                waiting.pop(sid).cancel()
+            sio.emit('error', 'Game expired', room=sid)
+
+sio.start_background_task(sweep_loop)
+
+def checkpoint_loop():
+    '''
+    Writes the live games to the checkpoint file every CHECKPOINT_INTERVAL seconds. A failed
+    write is reported and tried again next time.
+    '''
+    while True:
+        eventlet.sleep(CHECKPOINT_INTERVAL)
+        if saved_games_until is not None and time.time() > saved_games_until:
+            saved_games.clear()
+        try:
+            write_checkpoint(CHECKPOINT_FILE, existing_games, saved_games)
+        except Exception as error:
+            print(f'Checkpoint failed: {error}')
+
+if CHECKPOINT_FILE:
+    sio.start_background_task(checkpoint_loop)
 
 # Start a new game
 @sio.event
@@ -22,38 +123,97 @@ def new_game(sid, data):
     :param data: data for the game. Includes a list of players and a maximum hand size.
     '''
     # Set up the game
-    players = data.get('players')
-    if players is None or len(players) < 2:
-        sio.emit('game_init', { 'error': 'Not enough players provided' })
+    error = game_error(data.get('players'))
+    if error is not None:
+        sio.emit('game_init', { 'error': error })
         return
-    if all(['is_ai' in player and player['is_ai'] for player in players]):
-        sio.emit('game_init', { 'error': 'No human players provided' })
+    game = create_game(data, search_stats, decide if decision_pool is not None else None,
+                       game_log)
+    if sid in waiting:
+        waiting.pop(sid).cancel()
+    existing_games.save(sid, game)
+    sio.emit('game_init', { 'success': sid, 'resume_token': game.setup['resume_token'] }, room=sid)
+
+@sio.event
+def resume_game(sid, data):
+    '''
+    Carries on a game from the checkpoint after the server restarted. The client gets game_init
+    as for a new game, followed by the request the game was waiting on, if any.
+    :param sid: sid of the client.
+    :param data: includes the id of the game and its resume token, given in game_init when it
+    was set up.
+    '''
+    saved = saved_games.get(data.get('game'))
+    if saved is None or not resume_allowed(saved[0], data.get('resume_token')):
+        sio.emit('game_init', { 'error': 'No saved game found' }, room=sid)
         return
-    if len(players) != len(set([player['name'] for player in players])):
-        sio.emit('game_init', { 'error': 'Players must have unique names' })
+    del saved_games[data.get('game')]
+    game = restore_game(*saved, search_stats, decide if decision_pool is not None else None,
+                        game_log)
+    if sid in waiting:
+        waiting.pop(sid).cancel()
+    version = existing_games.save(sid, game)
+    sio.emit('game_init', { 'success': sid, 'resume_token': game.setup['resume_token'] }, room=sid)
+    if game.phase != DEAL:
+        advance_game(sid, game, version)
+
+def load_game(sid):
+    '''
+    :param sid: the id of the client.
+    :return: the client's game and its version, or (None, None) if they have no game.
+    '''
+    game, version = existing_games.load(sid)
+    if game is not None:
+        attach_stats(game, search_stats)
+        game.log = game_log
+    return game, version
+
+def advance_game(sid, game, version, answer=None):
+    '''
+    Plays the client's game until it needs an answer from the client and stores it, then sends
+    the client the events of the game and the request, one by one or as one batch. Nothing waits
+    for the answer, it carries the game on from the request's callback.
+    :param sid: the id of the client playing the game.
+    :param game: the client's game.
+    :param version: the version of the game when it was loaded.
+    :param answer: the client's answer to the last request, None to start a round.
+    '''
+    request, events = game.step(answer)
+    try:
+        version = existing_games.save(sid, game, version)
+    except StaleGameError:
+        # The game was changed or replaced during the step, this copy of it is dropped
+        return
+    answered = None
+    if request is not None:
+        timer = waiting[sid] = eventlet.spawn_after(GAME_TIMEOUT_LENGTH, time_out, sid)
+
+        def answered(answer=None):
+            # Ignore answers to requests of a game that has timed out or been replaced
+            if waiting.get(sid) is not timer:
+                return
+            waiting.pop(sid).cancel()
+            game, current = load_game(sid)
+            if current == version:
+                advance_game(sid, game, current, answer)
+    if game.setup.get('batch_events'):
+        sio.emit('events', event_batch(game, events, request), room=sid, callback=answered)
         return
+    for event, data in events:
+        sio.emit(event, data, room=sid)
+    if request is not None:
+        sio.emit(request.event, request.data, room=sid, callback=answered)
 
-    def init_player(player):
-        if 'is_ai' in player and player['is_ai']:
-            if 'algorithm' not in player:
-                return Player(player['name'], is_ai=True) 
-            elif player['algorithm'] == 'MCTS':
-                return PlayerMCTS(player['name'], player['search_time'])
-            elif player['algorithm'] == 'STS':
-                return STSPlayer(player['name'], player['max_depth'])
-            else:
-                return Player(player['name'], is_ai=True)
-        return Player(player['name'])
-    players = [init_player(player) for player in players]
-
-    max_hand = data.get('max_hand')
-    def ask(event, data=None):
-        return sio.call(event, data, sid=sid, timeout=GAME_TIMEOUT_LENGTH)
-    def inform(event, data=None):
-        return sio.emit(event, data, room=sid)
-    game = OhHell(players, max_hand=max_hand, ask=ask, inform=inform)
-    existing_games[sid] = game
-    inform('game_init', { 'success': sid })
+def time_out(sid):
+    '''
+    Ends a game whose client took too long to answer. A game another process has evicted in
+    the meantime was already reported as expired.
+    :param sid: the id of the client.
+    '''
+    waiting.pop(sid, None)
+    if existing_games.load(sid)[0] is not None:
+        sio.emit('error', 'Game timed out', room=sid)
+    sio.disconnect(sid)
 
 @sio.event
 def deal(sid):
@@ -61,18 +221,44 @@ def deal(sid):
     Deal the next round of an existing game.
     :param sid: the id of the client whose game should be dealt.
     '''
-    if sid not in existing_games:
+    game, version = load_game(sid)
+    if game is None:
         sio.emit('error', 'No game exists', room=sid)
         return
-    game = existing_games[sid]
     if game.state.curr_round >= game.state.num_rounds:
         sio.emit('error', 'Game already ended', room=sid)
         return
-    try:
-        game.play()
-    except socketio.exceptions.TimeoutError:
-        sio.emit('error', 'Game timed out', room=sid)
-        sio.disconnect(sid)
+    if game.phase != DEAL or sid in waiting:
+        sio.emit('error', 'Round already in progress', room=sid)
+        return
+    advance_game(sid, game, version)
+
+@sio.event
+def get_search_stats(sid):
+    '''
+    Sends the summary of the MCTS decisions made by the server since it started.
+    :param sid: the id of the client asking for the summary.
+    '''
+    if search_stats is None:
+        sio.emit('error', 'Search stats are not being collected', room=sid)
+        return
+    sio.emit('search_stats', search_stats.summary(), room=sid)
+
+@sio.event
+def get_store_stats(sid):
+    '''
+    Sends the number of games stored, their size and the number of games evicted by reason.
+    :param sid: the id of the client asking for the stats.
+    '''
+    sio.emit('store_stats', existing_games.stats(), room=sid)
+
+@sio.event
+def get_loop_latency(sid):
+    '''
+    Sends the delays of the event loop over the last minute, in milliseconds.
+    :param sid: the id of the client asking for the delays.
+    '''
+    sio.emit('loop_latency', latency_summary(loop_delays), room=sid)
 
 @sio.event
 def disconnect(sid):
@@ -81,10 +267,9 @@ def disconnect(sid):
     :param sid: The id of the disconnecting client.
     '''
     print(f'{sid} disconnected')
-    try:
-        global existing_games
-        del existing_games[sid]
-    except KeyError:
+    if sid in waiting:
+        waiting.pop(sid).cancel()
+    if not existing_games.delete(sid):
         print(f'No game found for {sid}')
 
 if __name__ == '__main__':
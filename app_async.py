@@ -0,0 +1,245 @@
+import asyncio
+import socketio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from GameServer import (attach_stats, create_game, event_batch, game_error, latency_summary,
+                        log_from_environ, store_from_environ)
+from GameStore import StaleGameError
+from OhHell import DEAL
+from Offload import DecisionPool
+from SearchStats import SearchStats
+import os
+import time
+
+# The same events as app.py, served by asyncio under an ASGI server:
+#     uvicorn app_async:app
+# Set MESSAGE_QUEUE to the URL of a Redis server shared by the server's processes, so an event is
+# delivered to its client whichever process the client is connected to
+MESSAGE_QUEUE = os.environ.get('MESSAGE_QUEUE')
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*',
+                           client_manager=socketio.AsyncRedisManager(MESSAGE_QUEUE)
+                           if MESSAGE_QUEUE else None)
+app = socketio.ASGIApp(sio)
+
+GAME_TIMEOUT_LENGTH = int(os.environ.get('GAME_TIMEOUT_LENGTH') or 600)
+
+# Games of the clients, kept in memory unless GAME_STORE names a SQLite file shared by the
+# server's processes. Unused games are evicted, see GameServer.store_from_environ.
+existing_games = store_from_environ()
+# How often games that have gone unused are evicted, in seconds
+SWEEP_INTERVAL = float(os.environ.get('SWEEP_INTERVAL') or 60)
+
+# Timeout timer of each game waiting on an answer from its client
+waiting = {}
+
+# Games with a step running in the step executor
+stepping = set()
+
+# Telemetry of every MCTS decision made by the server, when SEARCH_STATS is set
+search_stats = SearchStats() if os.environ.get('SEARCH_STATS') else None
+
+# Log of the moves of every game, to a shard of this process in GAME_LOG_DIR if it is set
+game_log = log_from_environ()
+
+# AI decisions run in this many worker processes, as in app.py. 0 runs them in the step threads.
+AI_WORKERS = os.environ.get('AI_WORKERS')
+decision_pool = None if AI_WORKERS == '0' else DecisionPool(int(AI_WORKERS) if AI_WORKERS else None)
+# Games are stepped in these threads, which wait on the decisions of the AI players, so the event
+# loop only sends and receives messages
+STEP_THREADS = int(os.environ.get('STEP_THREADS') or 32)
+step_executor = ThreadPoolExecutor(STEP_THREADS)
+# How often the event loop is checked for delays, in seconds
+LATENCY_INTERVAL = 0.05
+
+# Delays of the event loop over the last minute, in seconds
+loop_delays = deque(maxlen=int(60 / LATENCY_INTERVAL))
+monitor = None
+sweeper = None
+
+def decide(player, method, *args):
+    '''
+    Gets a decision from an AI player in the decision pool, waiting in the step thread.
+    :param player: the AI player making the decision.
+    :param method: the name of the method of the player to call.
+    :param args: the arguments of the method.
+    :return: the result of the decision.
+    '''
+    return decision_pool.finish(player, decision_pool.submit(player, method, *args))
+
+async def monitor_loop():
+    '''
+    Measures how late the event loop wakes up from a short sleep, the delay any event waiting
+    to be handled would see.
+    '''
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LATENCY_INTERVAL)
+        loop_delays.append(time.perf_counter() - start - LATENCY_INTERVAL)
+
+async def sweep_loop():
+    '''
+    Evicts the games that have gone unused every SWEEP_INTERVAL seconds, and tells their
+    clients. With a shared store this evicts the games of every process, whose clients are only
+    told through the MESSAGE_QUEUE.
+    '''
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        for sid in existing_games.sweep():
+            if sid in waiting:
+                waiting.pop(sid).cancel()
+            await sio.emit('error', 'Game expired', room=sid)
+
+@sio.event
+async def connect(sid, environ):
+    '''
+    Starts measuring the event loop and sweeping the games once the loop is running.
+    '''
+    global monitor, sweeper
+    if monitor is None:
+        monitor = sio.start_background_task(monitor_loop)
+        sweeper = sio.start_background_task(sweep_loop)
+
+# Start a new game
+@sio.event
+async def new_game(sid, data):
+    '''
+    Sets up a new game for the client.
+    :param sid: sid of the client.
+    :param data: data for the game. Includes a list of players and a maximum hand size.
+    '''
+    # Set up the game
+    error = game_error(data.get('players'))
+    if error is not None:
+        await sio.emit('game_init', { 'error': error })
+        return
+    game = create_game(data, search_stats, decide if decision_pool is not None else None,
+                       game_log)
+    if sid in waiting:
+        waiting.pop(sid).cancel()
+    existing_games.save(sid, game)
+    await sio.emit('game_init', { 'success': sid }, room=sid)
+
+def load_game(sid):
+    '''
+    :param sid: the id of the client.
+    :return: the client's game and its version, or (None, None) if they have no game.
+    '''
+    game, version = existing_games.load(sid)
+    if game is not None:
+        attach_stats(game, search_stats)
+        game.log = game_log
+    return game, version
+
+async def advance_game(sid, game, version, answer=None):
+    '''
+    Plays the client's game in a step thread until it needs an answer from the client and
+    stores it, then sends the client the events of the game and the request, one by one or as
+    one batch. Nothing waits for the answer, it carries the game on from the request's callback.
+    :param sid: the id of the client playing the game.
+    :param game: the client's game.
+    :param version: the version of the game when it was loaded.
+    :param answer: the client's answer to the last request, None to start a round.
+    '''
+    loop = asyncio.get_running_loop()
+    stepping.add(sid)
+    try:
+        request, events = await loop.run_in_executor(step_executor, game.step, answer)
+    finally:
+        stepping.discard(sid)
+    try:
+        version = existing_games.save(sid, game, version)
+    except StaleGameError:
+        # The client left or started another game during the step, this copy of it is dropped
+        return
+    answered = None
+    if request is not None:
+        timer = waiting[sid] = loop.call_later(GAME_TIMEOUT_LENGTH, sio.start_background_task,
+                                               time_out, sid)
+
+        def answered(answer=None):
+            # Ignore answers to requests of a game that has timed out or been replaced
+            if waiting.get(sid) is not timer:
+                return
+            waiting.pop(sid).cancel()
+            game, current = load_game(sid)
+            if current == version:
+                sio.start_background_task(advance_game, sid, game, current, answer)
+    if game.setup.get('batch_events'):
+        await sio.emit('events', event_batch(game, events, request), room=sid, callback=answered)
+        return
+    for event, data in events:
+        await sio.emit(event, data, room=sid)
+    if request is not None:
+        await sio.emit(request.event, request.data, room=sid, callback=answered)
+
+async def time_out(sid):
+    '''
+    Ends a game whose client took too long to answer. A game another process has evicted in
+    the meantime was already reported as expired.
+    :param sid: the id of the client.
+    '''
+    waiting.pop(sid, None)
+    if existing_games.load(sid)[0] is not None:
+        await sio.emit('error', 'Game timed out', room=sid)
+    await sio.disconnect(sid)
+
+@sio.event
+async def deal(sid):
+    '''
+    Deal the next round of an existing game.
+    :param sid: the id of the client whose game should be dealt.
+    '''
+    game, version = load_game(sid)
+    if game is None:
+        await sio.emit('error', 'No game exists', room=sid)
+        return
+    if game.state.curr_round >= game.state.num_rounds:
+        await sio.emit('error', 'Game already ended', room=sid)
+        return
+    if game.phase != DEAL or sid in waiting or sid in stepping:
+        await sio.emit('error', 'Round already in progress', room=sid)
+        return
+    await advance_game(sid, game, version)
+
+@sio.event
+async def get_search_stats(sid):
+    '''
+    Sends the summary of the MCTS decisions made by the server since it started.
+    :param sid: the id of the client asking for the summary.
+    '''
+    if search_stats is None:
+        await sio.emit('error', 'Search stats are not being collected', room=sid)
+        return
+    await sio.emit('search_stats', search_stats.summary(), room=sid)
+
+@sio.event
+async def get_store_stats(sid):
+    '''
+    Sends the number of games stored, their size and the number of games evicted by reason.
+    :param sid: the id of the client asking for the stats.
+    '''
+    await sio.emit('store_stats', existing_games.stats(), room=sid)
+
+@sio.event
+async def get_loop_latency(sid):
+    '''
+    Sends the delays of the event loop over the last minute, in milliseconds.
+    :param sid: the id of the client asking for the delays.
+    '''
+    await sio.emit('loop_latency', latency_summary(loop_delays), room=sid)
+
+@sio.event
+async def disconnect(sid):
+    '''
+    Cleans up any leftover information after a client disconnects
+    :param sid: The id of the disconnecting client.
+    '''
+    print(f'{sid} disconnected')
+    if sid in waiting:
+        waiting.pop(sid).cancel()
+    if not existing_games.delete(sid):
+        print(f'No game found for {sid}')
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1 @@
+uvicorn app_async:app --host localhost --port 5000 --reload